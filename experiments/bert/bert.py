@@ -7,7 +7,7 @@ import pandas as pd
 from pytorch_pretrained_bert import BertTokenizer, BertForSequenceClassification, BertAdam
 from tqdm import tqdm
 
-from transfer_nlp.loaders.loaders import DatasetSplits, DataFrameDataset
+from transfer_nlp.loaders.loaders import DatasetSplits, DataFrameDataset, read_csv_cached
 from transfer_nlp.loaders.vectorizers import Vectorizer
 from transfer_nlp.loaders.vocabulary import Vocabulary
 from transfer_nlp.plugins.config import register_plugin, ExperimentConfig
@@ -15,12 +15,16 @@ from transfer_nlp.plugins.config import register_plugin, ExperimentConfig
 tqdm.pandas()
 
 
+# Columns used by both the vectorizer and the dataset, so that the csv file is only parsed once
+NEWS_COLUMNS = {'title': str, 'category': str, 'split': str}
+
+
 @register_plugin
 class BertVectorizer(Vectorizer):
     def __init__(self, data_file: str, bert_version: str):
         super().__init__(data_file=data_file)
         self.tokenizer = BertTokenizer.from_pretrained(bert_version)
-        df = pd.read_csv(data_file)
+        df = read_csv_cached(data_file, usecols=list(NEWS_COLUMNS), dtype=NEWS_COLUMNS)
         self.target_vocab = Vocabulary(add_unk=False)
         self.target_vocab.add_many(set(df.category))
 
@@ -38,7 +42,7 @@ class BertDataloader(DatasetSplits):
     def __init__(self, data_file: str, batch_size: int, max_sequence: int, vectorizer: Vectorizer):
         self.vectorizer: Vectorizer = vectorizer
         self.max_sequence: int = max_sequence + 2
-        df = pd.read_csv(data_file)
+        df = read_csv_cached(data_file, usecols=list(NEWS_COLUMNS), dtype=NEWS_COLUMNS)
         df[['input_ids', 'attention_mask', 'token_type_ids']] = df.progress_apply(
             lambda row: pd.Series(self.vectorizer.vectorize(title=row['title'], max_seq_length=self.max_sequence)), axis=1)
         df['y_target'] = df['category'].progress_apply(lambda x: self.vectorizer.target_vocab.lookup_token(x))
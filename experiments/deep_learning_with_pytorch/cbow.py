@@ -2,20 +2,23 @@ import logging
 from typing import Dict, List, Any
 
 import numpy as np
-import pandas as pd
 import torch
 
 from transfer_nlp.common.tokenizers import CustomTokenizer
 from transfer_nlp.embeddings.embeddings import Embedding
-from transfer_nlp.loaders.loaders import DatasetSplits, DataFrameDataset
+from transfer_nlp.loaders.loaders import DatasetSplits, DataFrameDataset, read_csv_cached
 from transfer_nlp.loaders.vectorizers import Vectorizer
-from transfer_nlp.loaders.vocabulary import CBOWVocabulary
+from transfer_nlp.loaders.vocabulary import CBOWVocabulary, VocabularyBuilder
 from transfer_nlp.plugins.config import register_plugin
 from transfer_nlp.plugins.predictors import PredictorABC
 
 logger = logging.getLogger(__name__)
 
 
+# Columns used by both the vectorizer and the dataset, so that the csv file is only parsed once
+CBOW_COLUMNS = {'context': str, 'target': str, 'split': str}
+
+
 # Vectorizer
 @register_plugin
 class CBOWVectorizer(Vectorizer):
@@ -25,29 +28,21 @@ class CBOWVectorizer(Vectorizer):
         super().__init__(data_file=data_file)
 
         self.tokenizer = CustomTokenizer()
-        df = pd.read_csv(data_file)
-
-        data_vocab = CBOWVocabulary()
-        max_context = 0
-        for index, row in df.iterrows():
-            tokens = self.tokenizer.tokenize(text=row.context)
-            max_context = max(max_context, len(tokens))
-            for token in tokens:
-                data_vocab.add_token(token)
-                data_vocab.add_token(row.target)
+        df = read_csv_cached(data_file, usecols=list(CBOW_COLUMNS), dtype=CBOW_COLUMNS)
+
+        builder = VocabularyBuilder(tokenizer=self.tokenizer).update(df.context).update_tokens(df.target)
+        data_vocab = builder.build(CBOWVocabulary())
         self.data_vocab = data_vocab
         self.target_vocab = data_vocab
-        self.max_context = max_context
+        self.max_context = builder.max_length
 
     def vectorize(self, context: str) -> np.array:
 
         tokens = self.tokenizer.tokenize(text=context)
-        indices = [self.data_vocab.lookup_token(token) for token in tokens]
         vector_length = self.max_context
 
-        out_vector = np.zeros(vector_length, dtype=np.int64)
-        out_vector[:len(indices)] = indices
-        out_vector[len(indices):] = self.data_vocab.mask_index
+        out_vector = np.full(vector_length, self.data_vocab.mask_index, dtype=np.int64)
+        out_vector[:len(tokens)] = self.data_vocab.lookup_tokens(tokens)
 
         return out_vector
 
@@ -57,7 +52,7 @@ class CBOWVectorizer(Vectorizer):
 class CBOWDataset(DatasetSplits):
 
     def __init__(self, data_file: str, batch_size: int, vectorizer: Vectorizer):
-        self.df = pd.read_csv(data_file)
+        self.df = read_csv_cached(data_file, usecols=list(CBOW_COLUMNS), dtype=CBOW_COLUMNS)
 
         # preprocessing
         self.vectorizer: Vectorizer = vectorizer
@@ -77,21 +72,26 @@ class CBOWDataset(DatasetSplits):
 @register_plugin
 class CBOWClassifier(torch.nn.Module):  # Simplified cbow Model
 
-    def __init__(self, data: DatasetSplits, embedding_size: int, glove_path: str = None, padding_idx: int = 0):
+    def __init__(self, data: DatasetSplits, embedding_size: int, glove_path: str = None, padding_idx: int = 0,
+                 embeddings: Embedding = None, quantization: str = None, freeze_embeddings: bool = False):
+        """
+        :param glove_path: pre-trained embeddings file used to initialize the embeddings
+        :param embeddings: pre-trained embeddings shared with other objects of the experiment, used instead of glove_path
+        :param quantization: `int8` or `float16` to store the pre-trained embeddings quantized and frozen, e.g. for serving
+        :param freeze_embeddings: freeze the pre-trained embeddings, shared with the other models instead of copied
+        """
         super(CBOWClassifier, self).__init__()
         self.num_embeddings = len(data.vectorizer.data_vocab)
         self.embedding_size = embedding_size
         self.padding_idx = padding_idx
 
-        if glove_path:
+        if glove_path and embeddings is None:
+            embeddings = Embedding(glove_filepath=glove_path, data=data)
+
+        if embeddings is not None:
             logger.info("Using pre-trained word embeddings...")
-            self.embeddings = Embedding(glove_filepath=glove_path, data=data).embeddings
-            self.embeddings = torch.from_numpy(self.embeddings).float()
-            glove_size = len(self.embeddings[0])
-            self.embedding: torch.nn.Embedding = torch.nn.Embedding(embedding_dim=glove_size,
-                                                                    num_embeddings=self.num_embeddings,
-                                                                    padding_idx=self.padding_idx,
-                                                                    _weight=self.embeddings)
+            self.embedding: torch.nn.Module = embeddings.to_module(padding_idx=self.padding_idx,
+                                                                   quantization=quantization, freeze=freeze_embeddings)
 
         else:
             logger.info("Not using pre-trained word embeddings...")
@@ -129,17 +129,11 @@ class CBOWPredictor(PredictorABC):
         super().__init__(vectorizer=data.vectorizer, model=model)
 
     def json_to_data(self, input_json: Dict) -> Dict:
-        return {
-            'x_in': torch.LongTensor([self.vectorizer.vectorize(context=input_string) for input_string in input_json['inputs']])}
+        return self.vectorize_batch(input_json['inputs'], dtypes={'x_in': np.int64})
 
     def output_to_json(self, outputs: List[Dict[str, Any]]) -> Dict[str, Any]:
         return {
             "outputs": outputs}
 
     def decode(self, output: torch.tensor) -> List[Dict[str, Any]]:
-        probabilities = torch.nn.functional.softmax(output, dim=1)
-        probability_values, indices = probabilities.max(dim=1)
-
-        return [{
-            "class": self.vectorizer.data_vocab.lookup_index(index=int(res[1])),
-            "probability": float(res[0])} for res in zip(probability_values, indices)]
+        return self.decode_classes(output, vocabulary=self.vectorizer.data_vocab)
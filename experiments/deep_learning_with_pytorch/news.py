@@ -1,68 +1,75 @@
 import logging
 import string
-from collections import Counter
 from typing import Dict, List, Any
 
 import numpy as np
-import pandas as pd
 import torch
 
-from transfer_nlp.common.tokenizers import CustomTokenizer
+from transfer_nlp.common.tokenizers import BPETokenizer, CustomTokenizer
 from transfer_nlp.embeddings.embeddings import Embedding
-from transfer_nlp.loaders.loaders import DatasetSplits, DataFrameDataset
+from transfer_nlp.loaders.loaders import DatasetSplits, DataFrameDataset, read_csv_cached
 from transfer_nlp.loaders.vectorizers import Vectorizer
-from transfer_nlp.loaders.vocabulary import Vocabulary, SequenceVocabulary
+from transfer_nlp.loaders.vocabulary import HashingVocabulary, Vocabulary, SequenceVocabulary, VocabularyBuilder
 from transfer_nlp.plugins.config import register_plugin
 from transfer_nlp.plugins.predictors import PredictorABC
 
 logger = logging.getLogger(__name__)
 
 
+# Columns used by both the vectorizer and the dataset, so that the csv file is only parsed once
+NEWS_COLUMNS = {'title': str, 'category': str, 'split': str}
+
+
 # Vectorizer class
 @register_plugin
 class NewsVectorizer(Vectorizer):
-    def __init__(self, data_file: str, cutoff: int):
+    def __init__(self, data_file: str, cutoff: int, num_buckets: int = None, subword_vocab_size: int = None):
+        """
+        :param data_file: the news csv file
+        :param cutoff: minimum count of the words kept in the vocabulary
+        :param num_buckets: if given, words are hashed into this number of buckets instead of being stored in the
+        vocabulary, and the cutoff is not used
+        :param subword_vocab_size: if given, titles are split into subwords learnt on the data file instead of words, and
+        the cutoff is not used
+        """
 
         super().__init__(data_file=data_file)
         self.cutoff = cutoff
 
         self.tokenizer = CustomTokenizer()
-        df = pd.read_csv(data_file)
+        df = read_csv_cached(data_file, usecols=list(NEWS_COLUMNS), dtype=NEWS_COLUMNS)
 
         target_vocab = Vocabulary(add_unk=False)
         for category in sorted(set(df.category)):
             target_vocab.add_token(category)
 
-        word_counts = Counter()
-        max_title = 0
-        for title in df.title:
-            tokens = self.tokenizer.tokenize(text=title)
-            max_title = max(max_title, len(tokens))
-            for token in tokens:
-                if token not in string.punctuation:
-                    word_counts[token] += 1
-
-        data_vocab = SequenceVocabulary()
-        for word, word_count in word_counts.items():
-            if word_count >= self.cutoff:
-                data_vocab.add_token(word)
+        if subword_vocab_size:
+            self.tokenizer = BPETokenizer(pre_tokenizer=self.tokenizer).train(df.title, vocab_size=subword_vocab_size)
+            data_vocab = self.tokenizer.build_vocabulary()
+            max_length = max(map(len, self.tokenizer.tokenize_batch(df.title)))
+        elif num_buckets:
+            data_vocab = HashingVocabulary(num_buckets=num_buckets)
+            max_length = max(map(len, self.tokenizer.tokenize_batch(df.title)))
+        else:
+            # Skip punctuation and the empty tokens left by consecutive spaces
+            builder = VocabularyBuilder(tokenizer=self.tokenizer, min_count=self.cutoff, exclude={''}.union(string.punctuation))
+            builder.update(df.title)
+            data_vocab = builder.build(SequenceVocabulary())
+            max_length = builder.max_length
 
         self.data_vocab = data_vocab
         self.target_vocab = target_vocab
-        self.max_title = max_title + 2
+        self.max_title = max_length + 2
 
     def vectorize(self, title: str) -> np.array:
 
         tokens = self.tokenizer.tokenize(text=title)
-        indices = [self.data_vocab.begin_seq_index]
-        indices.extend(self.data_vocab.lookup_token(token)
-                       for token in tokens)
-        indices.append(self.data_vocab.end_seq_index)
         vector_length = self.max_title
 
-        out_vector = np.zeros(vector_length, dtype=np.int64)
-        out_vector[:len(indices)] = indices
-        out_vector[len(indices):] = self.data_vocab.mask_index
+        out_vector = np.full(vector_length, self.data_vocab.mask_index, dtype=np.int64)
+        out_vector[0] = self.data_vocab.begin_seq_index
+        out_vector[1:len(tokens) + 1] = self.data_vocab.lookup_tokens(tokens)
+        out_vector[len(tokens) + 1] = self.data_vocab.end_seq_index
 
         return out_vector
 
@@ -72,7 +79,7 @@ class NewsVectorizer(Vectorizer):
 class NewsDataset(DatasetSplits):
 
     def __init__(self, data_file: str, batch_size: int, vectorizer: Vectorizer):
-        self.df = pd.read_csv(data_file)
+        self.df = read_csv_cached(data_file, usecols=list(NEWS_COLUMNS), dtype=NEWS_COLUMNS)
 
         # preprocessing
         self.vectorizer: Vectorizer = vectorizer
@@ -93,7 +100,14 @@ class NewsDataset(DatasetSplits):
 class NewsClassifier(torch.nn.Module):
 
     def __init__(self, data: DatasetSplits, embedding_size: int, num_channels: int,
-                 hidden_dim: int, dropout_p: float, padding_idx: int = 0, glove_path: str = None):
+                 hidden_dim: int, dropout_p: float, padding_idx: int = 0, glove_path: str = None,
+                 embeddings: Embedding = None, quantization: str = None, freeze_embeddings: bool = False):
+        """
+        :param glove_path: pre-trained embeddings file used to initialize the embeddings
+        :param embeddings: pre-trained embeddings shared with other objects of the experiment, used instead of glove_path
+        :param quantization: `int8` or `float16` to store the pre-trained embeddings quantized and frozen, e.g. for serving
+        :param freeze_embeddings: freeze the pre-trained embeddings, shared with the other models instead of copied
+        """
         super(NewsClassifier, self).__init__()
 
         self.num_embeddings = len(data.vectorizer.data_vocab)
@@ -104,15 +118,13 @@ class NewsClassifier(torch.nn.Module):
         self.hidden_dim: int = hidden_dim
         self.padding_idx: int = padding_idx
 
-        if glove_path:
+        if glove_path and embeddings is None:
+            embeddings = Embedding(glove_filepath=glove_path, data=data)
+
+        if embeddings is not None:
             logger.info("Using pre-trained word embeddings...")
-            self.embeddings = Embedding(glove_filepath=glove_path, data=data).embeddings
-            self.embeddings = torch.from_numpy(self.embeddings).float()
-            glove_size = len(self.embeddings[0])
-            self.emb: torch.nn.Embedding = torch.nn.Embedding(embedding_dim=glove_size,
-                                                              num_embeddings=self.num_embeddings,
-                                                              padding_idx=self.padding_idx,
-                                                              _weight=self.embeddings)
+            self.emb: torch.nn.Module = embeddings.to_module(padding_idx=self.padding_idx,
+                                                             quantization=quantization, freeze=freeze_embeddings)
 
         else:
             logger.info("Not using pre-trained word embeddings...")
@@ -180,17 +192,11 @@ class NewsPredictor(PredictorABC):
         super().__init__(vectorizer=data.vectorizer, model=model)
 
     def json_to_data(self, input_json: Dict) -> Dict:
-        return {
-            'x_in': torch.LongTensor([self.vectorizer.vectorize(title=input_string) for input_string in input_json['inputs']])}
+        return self.vectorize_batch(input_json['inputs'], dtypes={'x_in': np.int64})
 
     def output_to_json(self, outputs: List[Dict[str, Any]]) -> Dict[str, Any]:
         return {
             "outputs": outputs}
 
     def decode(self, output: torch.tensor) -> List[Dict[str, Any]]:
-        probabilities = torch.nn.functional.softmax(output, dim=1)
-        probability_values, indices = probabilities.max(dim=1)
-
-        return [{
-            "class": self.vectorizer.target_vocab.lookup_index(index=int(res[1])),
-            "probability": float(res[0])} for res in zip(probability_values, indices)]
+        return self.decode_classes(output, vocabulary=self.vectorizer.target_vocab)
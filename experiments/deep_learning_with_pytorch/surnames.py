@@ -1,14 +1,15 @@
 import logging
+from functools import partial
 from typing import Any, Tuple, List, Dict
 
 import numpy as np
-import pandas as pd
 import torch
+from torch.utils.data.dataloader import default_collate
 
 from transfer_nlp.common.tokenizers import CharacterTokenizer
-from transfer_nlp.loaders.loaders import DatasetSplits, DataFrameDataset
+from transfer_nlp.loaders.loaders import DatasetSplits, DataFrameDataset, bag_collate, read_csv_cached
 from transfer_nlp.loaders.vectorizers import Vectorizer
-from transfer_nlp.loaders.vocabulary import Vocabulary, SequenceVocabulary
+from transfer_nlp.loaders.vocabulary import Vocabulary, SequenceVocabulary, VocabularyBuilder
 from transfer_nlp.plugins.config import register_plugin
 from transfer_nlp.plugins.helpers import ObjectHyperParams
 from transfer_nlp.plugins.predictors import PredictorABC
@@ -16,35 +17,45 @@ from transfer_nlp.plugins.predictors import PredictorABC
 logger = logging.getLogger(__name__)
 
 
+# Columns used by both the vectorizer and the dataset, so that the csv file is only parsed once
+SURNAMES_COLUMNS = {'surname': str, 'nationality': str, 'split': str}
+
+
 #### Surnames MLP ####
 @register_plugin
 class SurnamesVectorizerMLP(Vectorizer):
 
-    def __init__(self, data_file: str):
+    # Vectorizers saved before the sparse encoding are dense
+    sparse: bool = False
+
+    def __init__(self, data_file: str, sparse: bool = False):
+        """
+        :param data_file: the surnames csv file
+        :param sparse: encode surnames as the sorted indices of the ones of their multi-hot encoding
+        """
 
         super().__init__(data_file=data_file)
+        self.sparse = sparse
         self.tokenizer = CharacterTokenizer()
 
-        df = pd.read_csv(data_file)
-        data_vocab = Vocabulary(unk_token='@')
-        target_vocab = Vocabulary(add_unk=False)
+        df = read_csv_cached(data_file, usecols=list(SURNAMES_COLUMNS), dtype=SURNAMES_COLUMNS)
 
         # Add surnames and nationalities to vocabulary
-        for index, row in df.iterrows():
-            surname = row.surname
-            nationality = row.nationality
-            data_vocab.add_many(tokens=self.tokenizer.tokenize(text=surname))
-            target_vocab.add_token(token=nationality)
+        data_vocab = VocabularyBuilder(tokenizer=self.tokenizer).update(df.surname).build(Vocabulary(unk_token='@'))
+        target_vocab = Vocabulary(add_unk=False)
+        target_vocab.add_many(tokens=df.nationality.unique())
 
         self.data_vocab = data_vocab
         self.target_vocab = target_vocab
 
     def vectorize(self, input_string: str) -> np.array:
 
-        encoding = np.zeros(shape=len(self.data_vocab), dtype=np.float32)
         tokens = self.tokenizer.tokenize(text=input_string)
-        for character in tokens:
-            encoding[self.data_vocab.lookup_token(token=character)] = 1
+        if self.sparse:
+            return np.unique(self.data_vocab.lookup_tokens(tokens=tokens))
+
+        encoding = np.zeros(shape=len(self.data_vocab), dtype=np.float32)
+        encoding[self.data_vocab.lookup_tokens(tokens=tokens)] = 1
 
         return encoding
 
@@ -53,7 +64,7 @@ class SurnamesVectorizerMLP(Vectorizer):
 class SurnamesDatasetMLP(DatasetSplits):
 
     def __init__(self, data_file: str, batch_size: int, vectorizer: Vectorizer):
-        self.df = pd.read_csv(data_file)
+        self.df = read_csv_cached(data_file, usecols=list(SURNAMES_COLUMNS), dtype=SURNAMES_COLUMNS)
 
         # preprocessing
         self.vectorizer: Vectorizer = vectorizer
@@ -65,9 +76,11 @@ class SurnamesDatasetMLP(DatasetSplits):
         val_df = self.df[self.df.split == 'val'][['x_in', 'y_target']]
         test_df = self.df[self.df.split == 'test'][['x_in', 'y_target']]
 
+        # Sparse surnames are stored as indices, and only summed per batch by the model
         super().__init__(train_set=DataFrameDataset(train_df), train_batch_size=batch_size,
                          val_set=DataFrameDataset(val_df), val_batch_size=batch_size,
-                         test_set=DataFrameDataset(test_df), test_batch_size=batch_size)
+                         test_set=DataFrameDataset(test_df), test_batch_size=batch_size,
+                         collate_fn=bag_collate if self.vectorizer.sparse else None)
 
 @register_plugin
 class MultiLayerPerceptron(torch.nn.Module):
@@ -83,16 +96,23 @@ class MultiLayerPerceptron(torch.nn.Module):
         self.fc2 = torch.nn.Linear(in_features=hidden_dim, out_features=self.output_dim)
         # TODO: experiment with more layers
 
-    def forward(self, x_in: torch.Tensor, apply_softmax: bool = False) -> torch.Tensor:
+    def forward(self, x_in: torch.Tensor, x_in_offsets: torch.Tensor = None, apply_softmax: bool = False) -> torch.Tensor:
         """
         Linear -> ReLu -> Linear (+ softmax if probabilities needed)
-        :param x_in: size (batch, input_dim)
+        :param x_in: size (batch, input_dim), or with x_in_offsets the concatenated indices of the ones of the batch
+        multi-hot encodings
+        :param x_in_offsets: size (batch,), start of every example in x_in for sparse inputs
         :param apply_softmax: False if used with the cross entropy loss, True if probability wanted
         :return:
         """
         # TODO: experiment with other activation functions
 
-        intermediate = torch.nn.functional.relu(self.fc(x_in))
+        if x_in_offsets is None:
+            hidden = self.fc(x_in)
+        else:
+            # Summing the weights of the ones gives the product with the dense encoding, without building it
+            hidden = torch.nn.functional.embedding_bag(x_in, self.fc.weight.t(), x_in_offsets, mode='sum') + self.fc.bias
+        intermediate = torch.nn.functional.relu(hidden)
         output = self.fc2(intermediate)
 
         if self.output_dim == 1:
@@ -114,52 +134,55 @@ class MLPPredictor(PredictorABC):
         super().__init__(vectorizer=data.vectorizer, model=model)
 
     def json_to_data(self, input_json: Dict):
-        return {
-            'x_in': torch.tensor([self.vectorizer.vectorize(input_string=input_string) for input_string in input_json['inputs']])}
+        if self.vectorizer.sparse:
+            return bag_collate([{'x_in': self.vectorizer.vectorize(input_string)} for input_string in input_json['inputs']])
+        return self.vectorize_batch(input_json['inputs'])
 
     def output_to_json(self, outputs: List) -> Dict[str, Any]:
         return {
             "outputs": outputs}
 
     def decode(self, output: torch.tensor) -> List[Dict[str, Any]]:
-        probabilities = torch.nn.functional.softmax(output, dim=1)
-        probability_values, indices = probabilities.max(dim=1)
-        return [{
-            "class": self.vectorizer.target_vocab.lookup_index(index=int(res[1])),
-            "probability": float(res[0])} for res in zip(probability_values, indices)]
+        return self.decode_classes(output, vocabulary=self.vectorizer.target_vocab)
 
 
 #### Surnames CNN ####
 @register_plugin
 class SurnamesVectorizerCNN(Vectorizer):
 
-    def __init__(self, data_file: str):
+    # Vectorizers saved before the sparse encoding are dense
+    sparse: bool = False
+
+    def __init__(self, data_file: str, sparse: bool = False):
+        """
+        :param data_file: the surnames csv file
+        :param sparse: encode surnames as the indices of their characters, the one-hot matrix being built per batch
+        """
 
         super().__init__(data_file=data_file)
+        self.sparse = sparse
 
         self.tokenizer = CharacterTokenizer()
-        df = pd.read_csv(data_file)
-        data_vocab = Vocabulary(unk_token='@')
-        target_vocab = Vocabulary(add_unk=False)
-        max_surname = 0
+        df = read_csv_cached(data_file, usecols=list(SURNAMES_COLUMNS), dtype=SURNAMES_COLUMNS)
 
         # Add surnames and nationalities to vocabulary
-        for index, row in df.iterrows():
-            surname = row.surname
-            nationality = row.nationality
-            data_vocab.add_many(tokens=self.tokenizer.tokenize(text=surname))
-            target_vocab.add_token(token=nationality)
-            max_surname = max(max_surname, len(surname))
+        builder = VocabularyBuilder(tokenizer=self.tokenizer).update(df.surname)
+        data_vocab = builder.build(Vocabulary(unk_token='@'))
+        target_vocab = Vocabulary(add_unk=False)
+        target_vocab.add_many(tokens=df.nationality.unique())
+
         self.data_vocab = data_vocab
         self.target_vocab = target_vocab
-        self._max_surname = max_surname
+        self._max_surname = builder.max_length
 
     def vectorize(self, input_string: str) -> np.array:
 
-        encoding = np.zeros(shape=(len(self.data_vocab), self._max_surname), dtype=np.float32)
         tokens = self.tokenizer.tokenize(text=input_string)
-        for char_index, character in enumerate(tokens):
-            encoding[self.data_vocab.lookup_token(token=character)][char_index] = 1
+        if self.sparse:
+            return self.data_vocab.lookup_tokens(tokens=tokens[:self._max_surname])
+
+        encoding = np.zeros(shape=(len(self.data_vocab), self._max_surname), dtype=np.float32)
+        encoding[self.data_vocab.lookup_tokens(tokens=tokens), np.arange(len(tokens))] = 1
 
         return encoding
 
@@ -168,7 +191,7 @@ class SurnamesVectorizerCNN(Vectorizer):
 class SurnamesCNN(DatasetSplits):
 
     def __init__(self, data_file: str, batch_size: int, vectorizer: Vectorizer):
-        self.df = pd.read_csv(data_file)
+        self.df = read_csv_cached(data_file, usecols=list(SURNAMES_COLUMNS), dtype=SURNAMES_COLUMNS)
 
         # preprocessing
         self.vectorizer: Vectorizer = vectorizer
@@ -180,9 +203,27 @@ class SurnamesCNN(DatasetSplits):
         val_df = self.df[self.df.split == 'val'][['x_in', 'y_target']]
         test_df = self.df[self.df.split == 'test'][['x_in', 'y_target']]
 
+        # Sparse surnames are stored as character indices, and only one-hot encoded per batch
+        collate_fn = None
+        if self.vectorizer.sparse:
+            collate_fn = partial(one_hot_collate, num_channels=len(self.vectorizer.data_vocab), length=self.vectorizer._max_surname)
         super().__init__(train_set=DataFrameDataset(train_df), train_batch_size=batch_size,
                          val_set=DataFrameDataset(val_df), val_batch_size=batch_size,
-                         test_set=DataFrameDataset(test_df), test_batch_size=batch_size)
+                         test_set=DataFrameDataset(test_df), test_batch_size=batch_size,
+                         collate_fn=collate_fn)
+
+
+def one_hot_collate(batch: List[Dict[str, Any]], num_channels: int, length: int) -> Dict[str, Any]:
+    """
+    Collate examples whose x_in are character indices into the (batch, num_channels, length) one-hot tensor of the CNN
+    """
+    collated = default_collate([{key: value for key, value in example.items() if key != 'x_in'} for example in batch])
+    x_in = torch.zeros(len(batch), num_channels, length)
+    for row, example in enumerate(batch):
+        indices = torch.as_tensor(example['x_in'], dtype=torch.long)
+        x_in[row, indices, torch.arange(len(indices))] = 1
+    collated['x_in'] = x_in
+    return collated
 
 
 @register_plugin
@@ -238,19 +279,17 @@ class SurnameCNNPredictor(PredictorABC):
         super().__init__(vectorizer=data.vectorizer, model=model)
 
     def json_to_data(self, input_json: Dict) -> Dict:
-        return {
-            'x_in': torch.Tensor([self.vectorizer.vectorize(input_string=input_string) for input_string in input_json['inputs']])}
+        if self.vectorizer.sparse:
+            return one_hot_collate([{'x_in': self.vectorizer.vectorize(input_string)} for input_string in input_json['inputs']],
+                                   num_channels=len(self.vectorizer.data_vocab), length=self.vectorizer._max_surname)
+        return self.vectorize_batch(input_json['inputs'], dtypes={'x_in': np.float32})
 
     def output_to_json(self, outputs: List[Dict[str, Any]]) -> Dict[str, Any]:
         return {
             "outputs": outputs}
 
     def decode(self, output: torch.tensor) -> List[Dict[str, Any]]:
-        probabilities = torch.nn.functional.softmax(output, dim=1)
-        probability_values, indices = probabilities.max(dim=1)
-        return [{
-            "class": self.vectorizer.target_vocab.lookup_index(index=int(res[1])),
-            "probability": float(res[0])} for res in zip(probability_values, indices)]
+        return self.decode_classes(output, vocabulary=self.vectorizer.target_vocab)
 
 #### Surnames RNN ####
 @register_plugin
@@ -259,41 +298,34 @@ class SurnameVectorizerRNN(Vectorizer):
     def __init__(self, data_file: str):
         super().__init__(data_file=data_file)
         self.tokenizer = CharacterTokenizer()
-        df = pd.read_csv(data_file)
+        df = read_csv_cached(data_file, usecols=list(SURNAMES_COLUMNS), dtype=SURNAMES_COLUMNS)
 
-        data_vocab = SequenceVocabulary()
+        builder = VocabularyBuilder(tokenizer=self.tokenizer).update(df.surname)
+        data_vocab = builder.build(SequenceVocabulary())
         target_vocab = Vocabulary(add_unk=False)
-
-        max_surname = 0
-        for index, row in df.iterrows():
-            data_vocab.add_many(tokens=self.tokenizer.tokenize(text=row.surname))
-            target_vocab.add_token(row.nationality)
-            max_surname = max(max_surname, len(row.surname))
+        target_vocab.add_many(tokens=df.nationality.unique())
 
         self.data_vocab = data_vocab
         self.target_vocab = target_vocab
-        self._max_surname = max_surname + 2
+        self._max_surname = builder.max_length + 2
 
     def vectorize(self, surname: str) -> Tuple[np.array, int]:
         tokens = self.tokenizer.tokenize(text=surname)
-        indices = [self.data_vocab.begin_seq_index]
-        indices.extend(self.data_vocab.lookup_token(token)
-                       for token in tokens)
-        indices.append(self.data_vocab.end_seq_index)
         vector_length = self._max_surname
 
-        out_vector = np.zeros(vector_length, dtype=np.int64)
-        out_vector[:len(indices)] = indices
-        out_vector[len(indices):] = self.data_vocab.mask_index
+        out_vector = np.full(vector_length, self.data_vocab.mask_index, dtype=np.int64)
+        out_vector[0] = self.data_vocab.begin_seq_index
+        out_vector[1:len(tokens) + 1] = self.data_vocab.lookup_tokens(tokens)
+        out_vector[len(tokens) + 1] = self.data_vocab.end_seq_index
 
-        return out_vector, len(indices)
+        return out_vector, len(tokens) + 2
 
 
 @register_plugin
 class SurnamesRNNDataset(DatasetSplits):
 
     def __init__(self, data_file: str, batch_size: int, vectorizer: Vectorizer):
-        self.df = pd.read_csv(data_file)
+        self.df = read_csv_cached(data_file, usecols=list(SURNAMES_COLUMNS), dtype=SURNAMES_COLUMNS)
 
         # preprocessing
         self.vectorizer: Vectorizer = vectorizer
@@ -439,23 +471,14 @@ class SurnameRNNPredictor(PredictorABC):
         super().__init__(vectorizer=data.vectorizer, model=model)
 
     def json_to_data(self, input_json: Dict) -> Dict:
-        # vector_length = 30
-
-        return {
-            'x_in': torch.LongTensor([self.vectorizer.vectorize(surname=input_string)[0] for input_string in input_json['inputs']]),
-            'x_lengths': torch.Tensor([self.vectorizer.vectorize(surname=input_string)[1] for input_string in input_json['inputs']])
-        }
+        return self.vectorize_batch(input_json['inputs'], keys=('x_in', 'x_lengths'), dtypes={'x_in': np.int64})
 
     def output_to_json(self, outputs: List[Dict[str, Any]]) -> Dict[str, Any]:
         return {
             "outputs": outputs}
 
     def decode(self, output):
-        probabilities = torch.nn.functional.softmax(output, dim=1)
-        probability_values, indices = probabilities.max(dim=1)
-        return [{
-            "class": self.vectorizer.target_vocab.lookup_index(index=int(res[1])),
-            "probability": float(res[0])} for res in zip(probability_values, indices)]
+        return self.decode_classes(output, vocabulary=self.vectorizer.target_vocab)
 
 
 #### Surnames Generation ####
@@ -465,29 +488,24 @@ class SurnameVectorizerGeneration(Vectorizer):
     def __init__(self, data_file: str):
         super().__init__(data_file=data_file)
         self.tokenizer = CharacterTokenizer()
-        df = pd.read_csv(data_file)
+        df = read_csv_cached(data_file, usecols=list(SURNAMES_COLUMNS), dtype=SURNAMES_COLUMNS)
 
-        data_vocab = SequenceVocabulary()
+        builder = VocabularyBuilder(tokenizer=self.tokenizer).update(df.surname)
+        data_vocab = builder.build(SequenceVocabulary())
         target_vocab = Vocabulary(add_unk=False)
-
-        max_surname = 0
-        for index, row in df.iterrows():
-            tokens = self.tokenizer.tokenize(row.surname)
-            max_surname = max(max_surname, len(tokens))
-            data_vocab.add_many(tokens=tokens)
-            target_vocab.add_token(row.nationality)
+        target_vocab.add_many(tokens=df.nationality.unique())
 
         self.data_vocab = data_vocab
         self.target_vocab = target_vocab
-        self._max_surname = max_surname + 2
+        self._max_surname = builder.max_length + 2
 
     def vectorize(self, surname: str) -> Tuple[np.array, np.array]:
         tokens = self.tokenizer.tokenize(text=surname)
 
-        indices = [self.data_vocab.begin_seq_index]
-        indices.extend(self.data_vocab.lookup_token(token)
-                       for token in tokens)
-        indices.append(self.data_vocab.end_seq_index)
+        indices = np.empty(shape=len(tokens) + 2, dtype=np.int64)
+        indices[0] = self.data_vocab.begin_seq_index
+        indices[1:-1] = self.data_vocab.lookup_tokens(tokens)
+        indices[-1] = self.data_vocab.end_seq_index
 
         vector_length = self._max_surname
 
@@ -508,7 +526,7 @@ class SurnameVectorizerGeneration(Vectorizer):
 class SurnameDatasetGeneration(DatasetSplits):
 
     def __init__(self, data_file: str, batch_size: int, vectorizer: Vectorizer):
-        self.df = pd.read_csv(data_file)
+        self.df = read_csv_cached(data_file, usecols=list(SURNAMES_COLUMNS), dtype=SURNAMES_COLUMNS)
 
         # preprocessing
         self.vectorizer: Vectorizer = vectorizer
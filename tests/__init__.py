@@ -0,0 +1,10 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+# Keep the plugin index built by the tests out of the home directory
+if 'TRANSFER_NLP_PLUGIN_INDEX' not in os.environ:
+    _plugin_index_dir = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, _plugin_index_dir, ignore_errors=True)
+    os.environ['TRANSFER_NLP_PLUGIN_INDEX'] = os.path.join(_plugin_index_dir, 'plugin_index.json')
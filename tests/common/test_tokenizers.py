@@ -0,0 +1,69 @@
+import pickle
+import re
+import tempfile
+import unittest
+from pathlib import Path
+
+from transfer_nlp.common.tokenizers import BPETokenizer, CachedTokenizer, CharacterTokenizer, CustomTokenizer
+
+TEXTS = ["Hello world!", "", "  ", "!What?? a day, isn't it...", "Straße\tKELVIN K 42", "İstanbul\nend."]
+
+
+def regex_tokenize(text: str):
+    # Reference implementation of CustomTokenizer.tokenize
+    text = text.lower()
+    text = re.sub(r"([.,!?])", r" \1 ", text)
+    text = re.sub(r"[^a-zA-Z.,!?]+", r" ", text)
+    tokens = text.split(" ")
+    if not tokens[-1]:
+        tokens = tokens[:-1]
+    return tokens
+
+
+class TokenizersTest(unittest.TestCase):
+
+    def test_custom_tokenizer(self):
+        tokenizer = CustomTokenizer()
+        self.assertEqual(tokenizer.tokenize(text="Hello world!"), ['hello', 'world', '!'])
+        for text in TEXTS:
+            self.assertEqual(tokenizer.tokenize(text=text), regex_tokenize(text))
+        self.assertEqual(tokenizer.tokenize_batch(TEXTS), [regex_tokenize(text) for text in TEXTS])
+        self.assertEqual(tokenizer.tokenize_batch(iter(TEXTS), num_workers=2, shard_size=2), [regex_tokenize(text) for text in TEXTS])
+
+    def test_character_tokenizer(self):
+        tokenizer = CharacterTokenizer()
+        self.assertEqual(tokenizer.tokenize(text="Abc"), ['a', 'b', 'c'])
+        expected = [[char for char in text.lower()] for text in TEXTS]
+        self.assertEqual(tokenizer.tokenize_batch(TEXTS), expected)
+        self.assertEqual(tokenizer.tokenize_batch(TEXTS, num_workers=2, shard_size=4), expected)
+
+    def test_cached_tokenizer(self):
+        tokenizer = CachedTokenizer(tokenizer=CustomTokenizer(), maxsize=10)
+        tokens = tokenizer.tokenize(text="Hello world!")
+        tokens.append('changed')
+        self.assertEqual(tokenizer.tokenize(text="Hello world!"), ['hello', 'world', '!'])
+        self.assertEqual(tokenizer.tokenize_batch(TEXTS), [regex_tokenize(text) for text in TEXTS])
+        info = tokenizer.cache_info()
+        self.assertEqual((info.hits, info.misses), (2, len(TEXTS)))
+
+    def test_bpe_tokenizer(self):
+        texts = ['low lower lowest', 'newer wider', 'low newest'] * 5
+        tokenizer = BPETokenizer().train(texts, vocab_size=20)
+        self.assertEqual(tokenizer.merges[:2], [('##o', '##w'), ('l', '##ow')])
+        self.assertEqual(len(tokenizer.units), 20)
+        self.assertEqual(tokenizer.tokenize(text='Lowest!'), ['low', '##est', '!'])
+
+        tokens = tokenizer.tokenize(text='lowers news')
+        self.assertEqual(tokens, ['low', '##er', '##s', 'new', '##s'])
+        self.assertEqual(tokenizer.tokenize_batch(['lowers news', 'low']), [tokens, ['low']])
+
+        vocabulary = tokenizer.build_vocabulary()
+        self.assertEqual(len(vocabulary), 4 + len(tokenizer.units))
+        self.assertNotIn(vocabulary.unk_index, vocabulary.lookup_tokens(tokens=tokens).tolist())
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'tokenizer.bpe'
+            tokenizer.save(path)
+            loaded = BPETokenizer.load(path)
+        self.assertEqual(loaded.merges, tokenizer.merges)
+        self.assertEqual(pickle.loads(pickle.dumps(loaded)).tokenize(text='lowers news'), tokens)
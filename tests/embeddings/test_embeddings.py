@@ -0,0 +1,216 @@
+import os
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+
+from transfer_nlp.embeddings.embeddings import Embedding, QuantizedEmbedding, clear_embeddings_cache, load_glove_for_vocabulary, \
+    load_glove_from_file, quantize_embeddings
+from transfer_nlp.loaders.vocabulary import Vocabulary
+
+
+class LoadGloveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = Path(tempfile.mkdtemp())
+        self.glove_file = self.test_dir / 'glove.txt'
+        # A word with spaces, a duplicated word, a blank line and no final new line
+        self.glove_file.write_text('the 0.1 0.2 0.3\n. . . 1 2 3\nthe 4 5 6\n\nnlp -1e-3 0 1.5', encoding='utf-8')
+
+    def check(self, w2i, embeddings):
+        self.assertEqual(embeddings.dtype, np.float32)
+        self.assertEqual(embeddings.shape, (4, 3))
+        self.assertEqual(w2i['the'], 2)
+        self.assertEqual(embeddings[w2i['. . .']].tolist(), [1, 2, 3])
+        np.testing.assert_allclose(embeddings[w2i['nlp']], [-1e-3, 0, 1.5])
+        self.assertNotIn('unknown', w2i)
+
+    def test_load_without_cache(self):
+        w2i, embeddings = load_glove_from_file(self.glove_file, cache=False)
+        self.check(w2i, embeddings)
+        self.assertEqual(sorted(path.name for path in self.test_dir.iterdir()), ['glove.txt'])
+
+    def test_load_with_cache(self):
+        self.check(*load_glove_from_file(self.glove_file))
+        cache_files = sorted(path.name for path in self.test_dir.iterdir() if path.name != 'glove.txt')
+        self.assertEqual([name.rpartition('.')[2] for name in cache_files], ['npy', 'words'])
+        self.assertTrue(all(name.startswith('glove.txt.') for name in cache_files))
+
+        w2i, embeddings = load_glove_from_file(self.glove_file)
+        self.check(w2i, embeddings)
+        self.assertIsInstance(embeddings, np.memmap)
+
+        cache_dir = self.test_dir / 'cache'
+        self.check(*load_glove_from_file(self.glove_file, cache_dir=cache_dir))
+        self.assertEqual(sorted(path.name for path in cache_dir.iterdir()), cache_files)
+
+    def test_cache_invalidation(self):
+        cache_dir = self.test_dir / 'cache'
+        load_glove_from_file(self.glove_file, cache_dir=cache_dir)
+
+        # Another file with the same name gets its own cache
+        other_file = self.test_dir / 'other' / 'glove.txt'
+        other_file.parent.mkdir()
+        other_file.write_text('nlp 7 8 9\n', encoding='utf-8')
+        w2i, embeddings = load_glove_from_file(other_file, cache_dir=cache_dir)
+        self.assertEqual(embeddings[w2i['nlp']].tolist(), [7, 8, 9])
+        self.assertEqual(len(list(cache_dir.iterdir())), 4)
+        self.check(*load_glove_from_file(self.glove_file, cache_dir=cache_dir))
+
+        # A modified file of the same size and modification time isn't detected, another size is
+        stat = other_file.stat()
+        other_file.write_text('nlp 7 8 10\n', encoding='utf-8')
+        os.utime(str(other_file), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        w2i, embeddings = load_glove_from_file(other_file, cache_dir=cache_dir)
+        self.assertEqual(embeddings[w2i['nlp']].tolist(), [7, 8, 10])
+        self.assertEqual(len(list(cache_dir.iterdir())), 4)
+
+    def test_concurrent_conversions(self):
+        cache_dir = self.test_dir / 'cache'
+        threads = [threading.Thread(target=load_glove_from_file, args=(self.glove_file,), kwargs={'cache_dir': cache_dir})
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.check(*load_glove_from_file(self.glove_file, cache_dir=cache_dir))
+        self.assertEqual(len(list(cache_dir.iterdir())), 2)
+
+        # Temporary files are removed when a conversion fails
+        bad_file = self.test_dir / 'bad.txt'
+        bad_file.write_text('the 1 2 3\nnlp 1 2\n', encoding='utf-8')
+        with self.assertRaises(ValueError):
+            load_glove_from_file(bad_file, cache_dir=cache_dir)
+        self.assertEqual(len(list(cache_dir.iterdir())), 2)
+
+    def test_remote_file_not_cached(self):
+        remote = 'file://' + str(self.glove_file)
+        self.check(*load_glove_from_file(remote))
+        self.assertEqual(sorted(path.name for path in self.test_dir.iterdir()), ['glove.txt'])
+
+    def test_word2vec_header(self):
+        w2v_file = self.test_dir / 'w2v.txt'
+        w2v_file.write_text('2 3\nx 1 2 3\ny 4 5 6\n', encoding='utf-8')
+        w2i, embeddings = load_glove_from_file(w2v_file, cache=False)
+        self.assertEqual(w2i, {'x': 0, 'y': 1})
+        self.assertEqual(embeddings.tolist(), [[1, 2, 3], [4, 5, 6]])
+
+    def test_load_for_vocabulary(self):
+        words = ['<UNK>', 'nlp', 'the', 'missing']
+        embeddings, found = load_glove_for_vocabulary(self.glove_file, words=words)
+        self.assertEqual(embeddings.dtype, np.float32)
+        self.assertEqual(found.tolist(), [False, True, True, False])
+        np.testing.assert_allclose(embeddings[1:3], [[-1e-3, 0, 1.5], [4, 5, 6]])
+        self.assertTrue((np.abs(embeddings[[0, 3]]) <= 3 ** 0.5).all())
+        self.assertEqual(sorted(path.name for path in self.test_dir.iterdir()), ['glove.txt'])
+
+        # Rows are read from the cache when there is one
+        load_glove_from_file(self.glove_file)
+        cached, cached_found = load_glove_for_vocabulary(self.glove_file, words=words + ['. . .'])
+        self.assertEqual(cached_found.tolist(), [False, True, True, False, True])
+        np.testing.assert_allclose(cached[[1, 2, 4]], [[-1e-3, 0, 1.5], [4, 5, 6], [1, 2, 3]])
+
+    def test_shared_embedding(self):
+        clear_embeddings_cache()
+        vocabulary = Vocabulary()
+        vocabulary.add_many(tokens=['the', 'nlp'])
+        data = SimpleNamespace(vectorizer=SimpleNamespace(data_vocab=vocabulary))
+
+        embedding = Embedding(glove_filepath=self.glove_file, data=data)
+        self.assertEqual(embedding.embeddings.shape, (3, 3))
+        self.assertFalse(embedding.embeddings.flags.writeable)
+        # Loaded once per file and vocabulary
+        self.assertIs(Embedding(glove_filepath=self.glove_file, data=data).embeddings, embedding.embeddings)
+
+        tensor = embedding.to_tensor()
+        tensor[1] = 0
+        self.assertEqual(embedding.embeddings[1].tolist(), [4, 5, 6])
+
+        vocabulary.add_token('missing')
+        self.assertEqual(Embedding(glove_filepath=self.glove_file, data=data).embeddings.shape, (4, 3))
+        clear_embeddings_cache()
+        self.assertIsNot(Embedding(glove_filepath=self.glove_file, data=data).embeddings, embedding.embeddings)
+
+    def test_quantized_embedding(self):
+        rng = np.random.RandomState(0)
+        embeddings = rng.normal(size=(50, 8)).astype(np.float32)
+        embeddings[3] = 0
+        x_in = torch.tensor([[0, 3, 7], [49, 1, 1]])
+
+        for quantization, bytes_per_value, tolerance in [('int8', 1, 0.02), ('float16', 2, 1e-3)]:
+            module = QuantizedEmbedding(embeddings, quantization=quantization)
+            self.assertEqual(module.weight.element_size(), bytes_per_value)
+            embedded = module(x_in)
+            self.assertEqual(embedded.dtype, torch.float32)
+            self.assertEqual(embedded.shape, (2, 3, 8))
+            np.testing.assert_allclose(embedded.numpy(), embeddings[x_in.numpy()], atol=tolerance)
+            self.assertEqual(embedded[0, 1].tolist(), [0] * 8)
+            self.assertEqual(len(list(module.parameters())), 0)
+
+        values, scales = quantize_embeddings(embeddings, 'int8')
+        self.assertEqual(np.abs(values).max(axis=1)[[0, 1, 2, 4]].tolist(), [127] * 4)
+        with self.assertRaises(ValueError):
+            quantize_embeddings(embeddings, 'int4')
+
+    def test_quantized_checkpoint(self):
+        torch.manual_seed(0)
+        trained = torch.nn.Sequential(torch.nn.Embedding(20, 8, padding_idx=0), torch.nn.Linear(8, 2))
+        optimizer = torch.optim.SGD(trained.parameters(), lr=0.1)
+        x_in = torch.tensor([[0, 3, 7], [19, 1, 1]])
+        for _ in range(5):
+            optimizer.zero_grad()
+            trained(x_in).sum().backward()
+            optimizer.step()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            checkpoint = Path(tmp) / 'model.pth'
+            torch.save(trained.state_dict(), str(checkpoint))
+
+            for quantization, tolerance in [('int8', 0.01), ('float16', 1e-3)]:
+                # The serving model is built with other embeddings, then loads the trained ones
+                served = torch.nn.Sequential(QuantizedEmbedding(np.zeros((20, 8), dtype=np.float32),
+                                                                quantization=quantization, padding_idx=0),
+                                             torch.nn.Linear(8, 2))
+                served.load_state_dict(torch.load(str(checkpoint)))
+                np.testing.assert_allclose(served(x_in).detach().numpy(), trained(x_in).detach().numpy(),
+                                           rtol=tolerance)
+                self.assertEqual(served[0](x_in)[0, 0].tolist(), [0] * 8)
+
+        converted = QuantizedEmbedding.from_embedding(trained[0])
+        self.assertEqual(converted.padding_idx, 0)
+        self.assertEqual(converted.weight.dtype, torch.int8)
+        np.testing.assert_allclose(converted(x_in).numpy(), trained[0](x_in).detach().numpy(), atol=0.05)
+        with self.assertRaises(ValueError):
+            QuantizedEmbedding(np.ones((3, 2)), padding_idx=3)
+
+    def test_embedding_module(self):
+        clear_embeddings_cache()
+        vocabulary = Vocabulary()
+        vocabulary.add_many(tokens=['the', 'nlp'])
+        embedding = Embedding(glove_filepath=self.glove_file,
+                              data=SimpleNamespace(vectorizer=SimpleNamespace(data_vocab=vocabulary)))
+
+        module = embedding.to_module(padding_idx=0)
+        self.assertIsInstance(module, torch.nn.Embedding)
+        self.assertEqual(module.padding_idx, 0)
+        np.testing.assert_array_equal(module.weight.detach().numpy(), embedding.embeddings)
+        self.assertNotEqual(module.weight.data_ptr(), embedding.embeddings.ctypes.data)
+
+        # Frozen layers share the cached matrix
+        frozen = embedding.to_module(padding_idx=0, freeze=True)
+        self.assertFalse(frozen.weight.requires_grad)
+        self.assertEqual(frozen.weight.data_ptr(), embedding.embeddings.ctypes.data)
+        np.testing.assert_array_equal(frozen(torch.tensor([1, 2])).numpy(), embedding.embeddings[1:])
+
+        quantized = embedding.to_module(quantization='int8')
+        self.assertIsInstance(quantized, QuantizedEmbedding)
+        np.testing.assert_allclose(quantized(torch.tensor([1, 2])).numpy(), embedding.embeddings[1:], atol=0.05)
+        self.assertEqual(embedding.to_module(padding_idx=0, quantization='int8')(torch.tensor([0])).tolist(), [[0] * 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
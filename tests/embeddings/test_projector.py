@@ -0,0 +1,94 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from transfer_nlp.embeddings.projector import EmbeddingExporter
+
+
+class EmbeddingExporterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.log_dir = Path(tempfile.mkdtemp())
+        self.embeddings = torch.randn(100, 4)
+        self.tokens = [f'token{i}' for i in range(99)] + ['new\nline']
+
+    def test_export_tsv(self):
+        exporter = EmbeddingExporter(log_dir=self.log_dir)
+        exporter.export(embeddings=self.embeddings, tokens=self.tokens, tag='emb', global_step=3).result()
+        exporter.close()
+
+        directory = self.log_dir / '00003' / 'emb'
+        np.testing.assert_allclose(np.loadtxt(directory / 'tensors.tsv', delimiter='\t'), self.embeddings.numpy(),
+                                   rtol=1e-5)
+        metadata = (directory / 'metadata.tsv').read_text(encoding='utf-8').splitlines()
+        self.assertEqual(metadata, self.tokens[:99] + ['new line'])
+        config = (self.log_dir / 'projector_config.pbtxt').read_text()
+        self.assertIn('tensor_name: "emb:00003"', config)
+        self.assertIn('tensor_path: "00003/emb/tensors.tsv"', config)
+        self.assertIn('metadata_path: "00003/emb/metadata.tsv"', config)
+
+    def test_export_bytes(self):
+        exporter = EmbeddingExporter(log_dir=self.log_dir, format='bytes')
+        exporter.export(embeddings=self.embeddings.numpy(), tokens=self.tokens, tag='emb')
+        exporter.export(embeddings=self.embeddings.numpy(), tokens=self.tokens, tag='emb', global_step=1)
+        exporter.close()
+
+        tensors = np.fromfile(str(self.log_dir / '00000' / 'emb' / 'tensors.bytes'), dtype='<f4').reshape(100, 4)
+        np.testing.assert_array_equal(tensors, self.embeddings.numpy())
+        config = (self.log_dir / 'projector_config.pbtxt').read_text()
+        self.assertEqual(config.count('embeddings {'), 2)
+        self.assertIn('tensor_shape: 100\n  tensor_shape: 4', config)
+
+    def test_sampling(self):
+        exporter = EmbeddingExporter(log_dir=self.log_dir, max_points=10)
+        self.assertEqual(exporter.select(100).tolist(), list(range(10)))
+        self.assertEqual(exporter.select(5).tolist(), list(range(5)))
+        counts = np.arange(100)
+        self.assertEqual(exporter.select(100, counts=counts).tolist(), list(range(90, 100)))
+
+        exporter.sampling = 'random'
+        indices = exporter.select(100)
+        self.assertEqual(len(set(indices.tolist())), 10)
+        self.assertEqual(indices.tolist(), sorted(indices.tolist()))
+
+        exporter.export(embeddings=self.embeddings, tokens=self.tokens, tag='sample').result()
+        metadata = (self.log_dir / '00000' / 'sample' / 'metadata.tsv').read_text(encoding='utf-8').splitlines()
+        self.assertEqual(metadata, [self.tokens[i] for i in indices])
+        exporter.close()
+
+        with self.assertRaises(ValueError):
+            EmbeddingExporter(log_dir=self.log_dir, sampling='bottom')
+
+    def test_close(self):
+        # The log directory is a file, the write fails in the background thread
+        log_file = self.log_dir / 'file'
+        log_file.touch()
+        exporter = EmbeddingExporter(log_dir=log_file)
+        future = exporter.export(embeddings=self.embeddings, tokens=self.tokens, tag='emb')
+        with self.assertRaises(OSError):
+            exporter.close()
+        self.assertIsInstance(future.exception(), OSError)
+
+        # A closed exporter starts a new thread
+        exporter.log_dir = self.log_dir
+        exporter.export(embeddings=self.embeddings, tokens=self.tokens, tag='emb', global_step=1)
+        exporter.close()
+        self.assertTrue((self.log_dir / '00001' / 'emb' / 'tensors.tsv').exists())
+
+    def test_close_at_exit(self):
+        log_file = self.log_dir / 'file'
+        log_file.touch()
+        exporter = EmbeddingExporter(log_dir=log_file)
+        # Errors are logged, pending exports are waited for at interpreter exit
+        with self.assertLogs('transfer_nlp.embeddings.projector', level='ERROR') as logs:
+            exporter.export(embeddings=self.embeddings, tokens=self.tokens, tag='emb')
+            exporter._close_at_exit()
+        self.assertEqual(len(logs.records), 1)
+        self.assertIsNone(exporter._executor)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from transfer_nlp.embeddings.search import ExactIndex, IVFIndex, evaluate_index
+from transfer_nlp.embeddings.utils import get_closest, get_closest_batch
+
+
+def reference_get_closest(target_word, word_to_idx, embeddings, n=5):
+    word_embedding = embeddings[word_to_idx[target_word.lower()]]
+    distances = []
+    for word, index in word_to_idx.items():
+        if word == "<MASK>" or word == target_word:
+            continue
+        distances.append((word, torch.dist(word_embedding, embeddings[index])))
+    return sorted(distances, key=lambda x: x[1])[1:n + 2]
+
+
+class SearchTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        # Clustered vectors, so that the IVF lists are meaningful
+        centers = rng.normal(size=(20, 16)) * 5
+        self.vectors = (centers[rng.randint(20, size=2000)] + rng.normal(size=(2000, 16))).astype(np.float32)
+        self.queries = self.vectors[:50] + 0.1
+
+    def test_exact_index(self):
+        for metric in ['euclidean', 'cosine']:
+            distances, indices = ExactIndex(self.vectors, metric=metric).search(self.queries, k=5)
+            vectors, queries = torch.tensor(self.vectors), torch.tensor(self.queries)
+            if metric == 'euclidean':
+                expected = torch.cdist(queries, vectors)
+            else:
+                expected = 1 - torch.nn.functional.normalize(queries) @ torch.nn.functional.normalize(vectors).t()
+            values, positions = expected.topk(5, largest=False)
+            self.assertEqual(indices.tolist(), positions.tolist())
+            np.testing.assert_allclose(distances, values.numpy(), atol=1e-3)
+
+    def test_ivf_index(self):
+        index = IVFIndex(num_lists=20, num_probes=3).build(self.vectors)
+        self.assertEqual(len(index), 2000)
+        self.assertEqual(sorted(index.ids.tolist()), list(range(2000)))
+
+        results = evaluate_index(index, ExactIndex(self.vectors), self.queries, k=10)
+        self.assertGreater(results['recall'], 0.9)
+        # Probing every list is an exact search
+        self.assertEqual(evaluate_index(index, ExactIndex(self.vectors), self.queries, k=10, num_probes=20)['recall'], 1)
+
+        path = Path(tempfile.mkdtemp()) / 'index.npz'
+        index.save(path)
+        loaded = IVFIndex.load(path)
+        self.assertEqual(loaded.num_probes, 3)
+        for expected, found in zip(index.search(self.queries, k=10), loaded.search(self.queries, k=10)):
+            np.testing.assert_array_equal(expected, found)
+
+    def test_ivf_missing_neighbours(self):
+        index = IVFIndex(num_lists=10, num_probes=1).build(self.vectors[:20])
+        distances, indices = index.search(self.queries[:1], k=20)
+        self.assertTrue(np.all(indices[np.isinf(distances)] == -1))
+
+    def test_get_closest(self):
+        words = ['<MASK>'] + [f'word{i}' for i in range(199)]
+        word_to_idx = {word: i for i, word in enumerate(words)}
+        embeddings = torch.tensor(self.vectors[:200])
+
+        for target in ['word3', 'Word7']:
+            expected = reference_get_closest(target, word_to_idx, embeddings, n=4)
+            results = get_closest(target, word_to_idx, embeddings, n=4)
+            self.assertEqual([word for word, _ in results], [word for word, _ in expected])
+            np.testing.assert_allclose([d.item() for _, d in results], [d.item() for _, d in expected], rtol=1e-4)
+
+        batch = get_closest_batch(['word3', 'word7'], word_to_idx, embeddings, n=3)
+        self.assertEqual(len(batch), 2)
+        self.assertEqual([word for word, _ in batch[0]],
+                         [word for word, _ in reference_get_closest('Word3', word_to_idx, embeddings, n=3)][:3])
+        index = IVFIndex(num_lists=5, num_probes=5).build(embeddings)
+        approximate = get_closest_batch(['word3', 'word7'], word_to_idx, embeddings, n=3, index=index)
+        self.assertEqual([[word for word, _ in words] for words in approximate],
+                         [[word for word, _ in words] for words in batch])
+
+        # The target word is excluded whatever its case, and the inverse mapping can be computed once
+        index_to_word = {idx: word for word, idx in word_to_idx.items()}
+        for words in [['Word3'], ['word3']]:
+            results = get_closest_batch(words, word_to_idx, embeddings, n=3, index_to_word=index_to_word)
+            self.assertEqual([word for word, _ in results[0]], [word for word, _ in batch[0]])
+            self.assertNotIn('word3', [word for word, _ in results[0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from transfer_nlp.loaders.loaders import DataFrameDataset, DatasetSplits, bag_collate, clear_csv_cache, read_csv_cached
+
+SAMPLE_DATA = Path(__file__).parent.parent / 'plugins' / 'sample_data.csv'
+
+
+class ReadCsvCachedTest(unittest.TestCase):
+
+    def setUp(self):
+        clear_csv_cache()
+        self.test_dir = tempfile.mkdtemp()
+        self.data_file = Path(self.test_dir) / 'data.csv'
+        shutil.copy(str(SAMPLE_DATA), str(self.data_file))
+
+    def tearDown(self):
+        clear_csv_cache()
+        shutil.rmtree(self.test_dir)
+
+    def test_read_csv_cached(self):
+        with mock.patch('pandas.read_csv', wraps=pd.read_csv) as read_csv:
+            df = read_csv_cached(self.data_file, usecols=['surname', 'split'], dtype={'surname': str})
+            self.assertEqual(df.columns.tolist(), ['surname', 'split'])
+            df['x_in'] = 1
+
+            df = read_csv_cached(str(self.data_file), usecols=['split', 'surname'])
+            self.assertEqual(df.columns.tolist(), ['split', 'surname'])
+            self.assertEqual(read_csv.call_count, 1)
+
+            # A missing column triggers a new parse, keeping the previous columns
+            df = read_csv_cached(self.data_file, usecols=['nationality'])
+            self.assertEqual(df.columns.tolist(), ['nationality'])
+            read_csv_cached(self.data_file, usecols=['surname', 'nationality', 'split'])
+            self.assertEqual(read_csv.call_count, 2)
+
+            # So does a modified file
+            with self.data_file.open('a') as f:
+                f.write('0,English,0,train,Feedly,,0\n')
+            df = read_csv_cached(self.data_file)
+            self.assertEqual(df.surname.iloc[-1], 'Feedly')
+            self.assertEqual(read_csv.call_count, 3)
+
+    def test_read_csv_cached_dtype(self):
+        with mock.patch('pandas.read_csv', wraps=pd.read_csv) as read_csv:
+            df = read_csv_cached(self.data_file, usecols=['nationality_index', 'split'])
+            self.assertEqual(df.nationality_index.dtype, np.int64)
+
+            # Another dtype triggers a new parse, keeping the dtypes asked for by the previous callers
+            df = read_csv_cached(self.data_file, usecols=['nationality_index'], dtype={'nationality_index': np.float32})
+            self.assertEqual(df.nationality_index.dtype, np.float32)
+            read_csv_cached(self.data_file, usecols=['split', 'surname'], dtype={'surname': str})
+            df = read_csv_cached(self.data_file, usecols=['nationality_index'], dtype={'nationality_index': np.float32})
+            self.assertEqual(df.nationality_index.dtype, np.float32)
+            self.assertEqual(read_csv.call_count, 3)
+
+
+
+class BagCollateTest(unittest.TestCase):
+
+    def test_bag_collate(self):
+        df = pd.DataFrame({'x_in': [np.array([1, 4]), np.array([], dtype=np.int64), np.array([2, 3, 0])], 'y_target': [0, 1, 2]})
+        splits = DatasetSplits(train_set=DataFrameDataset(df), train_batch_size=3,
+                               val_set=DataFrameDataset(df), val_batch_size=3, collate_fn=bag_collate)
+
+        batch = next(iter(splits.val_data_loader()))
+        self.assertEqual(batch['x_in'].tolist(), [1, 4, 2, 3, 0])
+        self.assertEqual(batch['x_in_offsets'].tolist(), [0, 2, 2])
+        self.assertEqual(batch['y_target'].tolist(), [0, 1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import pickle
+import tempfile
+import unittest
+from pathlib import Path
+
+from transfer_nlp.common.tokenizers import CharacterTokenizer
+from transfer_nlp.loaders.vectorizers import CachedVectorizer, Vectorizer
+from transfer_nlp.loaders.vocabulary import MappedTokenIndex, SequenceVocabulary, Vocabulary
+
+
+class DemoVectorizer(Vectorizer):
+
+    def __init__(self, data_file: str):
+        super().__init__(data_file=data_file)
+        self.tokenizer = CharacterTokenizer()
+        self.data_vocab = SequenceVocabulary()
+        self.data_vocab.add_many(tokens=self.tokenizer.tokenize(text='feedly'))
+        self.target_vocab = self.data_vocab
+        self.label_vocab = Vocabulary(add_unk=False)
+        self.label_vocab.add_token(token='en')
+        self.max_length = 8
+
+    def vectorize(self, input_string: str):
+        return self.data_vocab.lookup_tokens(tokens=self.tokenizer.tokenize(text=input_string))
+
+
+class SequenceDemoVectorizer(DemoVectorizer):
+
+    def vectorize(self, surname: str):
+        indices = super().vectorize(input_string=surname)
+        return indices, len(indices)
+
+
+class VectorizerTest(unittest.TestCase):
+
+    def test_save_load(self):
+        vectorizer = DemoVectorizer(data_file='data.csv')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            vectorizer.save(tmp)
+            self.assertEqual(sorted(path.name for path in Path(tmp).iterdir()), ['data_vocab.vocab', 'label_vocab.vocab', 'vectorizer.pkl'])
+
+            loaded = Vectorizer.load(tmp)
+            self.assertIsInstance(loaded, DemoVectorizer)
+            self.assertEqual(loaded.data_file, 'data.csv')
+            self.assertEqual(loaded.max_length, 8)
+            self.assertIs(loaded.target_vocab, loaded.data_vocab)
+            self.assertEqual(loaded.vectorize('lyfe').tolist(), vectorizer.vectorize('lyfe').tolist())
+            self.assertEqual(loaded.label_vocab.lookup_index(index=0), 'en')
+
+            shared = CachedVectorizer(vectorizer=vectorizer).share(Path(tmp) / 'shared')
+            self.assertIsInstance(shared.vectorizer, DemoVectorizer)
+            self.assertEqual(shared.vectorize('lyfe').tolist(), vectorizer.vectorize('lyfe').tolist())
+            self.assertIsInstance(shared.data_vocab._token2id, MappedTokenIndex)
+
+    def test_cached_vectorizer(self):
+        vectorizer = CachedVectorizer(vectorizer=DemoVectorizer(data_file='data.csv'), maxsize=2)
+        self.assertIsInstance(vectorizer, Vectorizer)
+        self.assertEqual(vectorizer.max_length, 8)
+
+        first = vectorizer.vectorize('feed')
+        self.assertIs(vectorizer.vectorize('feed'), first)
+        self.assertFalse(first.flags.writeable)
+        vectorizer.vectorize('fly')
+        vectorizer.vectorize('lyfe')
+        info = vectorizer.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 3, 2))
+        self.assertIsNot(vectorizer.vectorize('feed'), first)
+
+        unpickled = pickle.loads(pickle.dumps(vectorizer))
+        self.assertEqual(unpickled.vectorize('feed').tolist(), first.tolist())
+        self.assertEqual(unpickled.cache_info().hits, 0)
+
+    def test_cached_vectorizer_arguments(self):
+        vectorizer = CachedVectorizer(vectorizer=SequenceDemoVectorizer(data_file='data.csv'))
+
+        indices, length = vectorizer.vectorize(surname='feed')
+        self.assertEqual(length, 4)
+        self.assertFalse(indices.flags.writeable)
+        self.assertIs(vectorizer.vectorize(surname='feed')[0], indices)
+        self.assertEqual(vectorizer.vectorize('feed')[0].tolist(), indices.tolist())
+        self.assertEqual(vectorizer.cache_info().hits, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
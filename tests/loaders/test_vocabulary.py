@@ -1,7 +1,13 @@
 import logging
+import pickle
+import tempfile
 import unittest
+from pathlib import Path
 
-from transfer_nlp.loaders.vocabulary import Vocabulary
+import numpy as np
+
+from transfer_nlp.common.tokenizers import CustomTokenizer
+from transfer_nlp.loaders.vocabulary import CBOWVocabulary, HashingVocabulary, MappedTokenIndex, SequenceVocabulary, Vocabulary, VocabularyBuilder
 
 
 class VocabularyTest(unittest.TestCase):
@@ -52,6 +58,159 @@ class VocabularyTest(unittest.TestCase):
 
         self.assertEqual(first=len(voc), second=3)
 
+    def test_bulk_lookups(self):
+        voc = Vocabulary()
+        voc.add_many(tokens=['Feedly', 'NLP'])
+
+        ids = voc.lookup_tokens(tokens=['NLP', 'unknown', 'Feedly'])
+        self.assertEqual(ids.dtype, np.int64)
+        self.assertEqual(ids.tolist(), [2, 0, 1])
+        self.assertEqual(voc.lookup_tokens(tokens=[]).tolist(), [])
+        self.assertEqual(voc.lookup_indices(indices=ids), ['NLP', '<UNK>', 'Feedly'])
+
+        # The reverse lookup is kept up to date with added tokens
+        voc.add_token(token='PyTorch')
+        self.assertEqual(voc.lookup_indices(indices=[3, 2]), ['PyTorch', 'NLP'])
+        self.assertRaises(ValueError, lambda: voc.lookup_indices(indices=[4]))
+        self.assertRaises(ValueError, lambda: voc.lookup_index(index=-1))
+
+        voc = Vocabulary(add_unk=False)
+        voc.add_token(token='Feedly')
+        self.assertEqual(voc.lookup_tokens(tokens=['Feedly']).tolist(), [0])
+        self.assertRaises(KeyError, lambda: voc.lookup_tokens(tokens=['unknown']))
+
+        for voc in [SequenceVocabulary(), CBOWVocabulary()]:
+            voc.add_token(token='Feedly')
+            self.assertEqual(voc.lookup_tokens(tokens=['Feedly', '<MASK>', 'unknown']).tolist(),
+                             [voc.lookup_token('Feedly'), voc.mask_index, voc.unk_index])
+
+
+    def test_vocabulary_builder(self):
+        texts = ['b a c', 'a b, d', 'a e']
+
+        builder = VocabularyBuilder(tokenizer=CustomTokenizer()).update(texts)
+        self.assertEqual(builder.max_length, 4)
+        self.assertEqual(builder.tokens(), ['b', 'a', 'c', ',', 'd', 'e'])
+
+        builder = VocabularyBuilder(tokenizer=CustomTokenizer(), min_count=2, exclude=[',']).update(texts)
+        voc = builder.build(SequenceVocabulary())
+        self.assertEqual(voc.lookup_indices(indices=range(4, len(voc))), ['b', 'a'])
+        self.assertEqual(voc.mask_index, 1)
+
+        builder = VocabularyBuilder(tokenizer=CustomTokenizer(), by_frequency=True).update(texts)
+        self.assertEqual(builder.tokens(), ['a', 'b', 'c', ',', 'd', 'e'])
+        builder.max_size = 3
+        self.assertEqual(builder.tokens(), ['a', 'b', 'c'])
+        builder.by_frequency = False
+        self.assertEqual(builder.tokens(), ['b', 'a', 'c'])
+
+        # Sharded and parallel counts give the same vocabulary
+        parallel = VocabularyBuilder(tokenizer=CustomTokenizer()).update(texts, num_workers=2, shard_size=1)
+        self.assertEqual(parallel.tokens(), VocabularyBuilder(tokenizer=CustomTokenizer()).update(texts).tokens())
+        merged = VocabularyBuilder(tokenizer=CustomTokenizer()).update(texts[:1]).merge(VocabularyBuilder(tokenizer=CustomTokenizer()).update(texts[1:]))
+        self.assertEqual(merged.counts, parallel.counts)
+        self.assertEqual(merged.max_length, parallel.max_length)
+
+        voc = VocabularyBuilder().update_tokens(['x', 'y', 'x']).build()
+        self.assertEqual(voc.lookup_tokens(tokens=['<UNK>', 'x', 'y']).tolist(), [0, 1, 2])
+
+
+    def test_binary_serialization(self):
+        voc = SequenceVocabulary()
+        voc.add_many(tokens=['Feedly', 'NLP', 'é', ''])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'data.vocab'
+            voc.save(path)
+
+            loaded = Vocabulary.load(path)
+            self.assertIsInstance(loaded, SequenceVocabulary)
+            self.assertEqual(len(loaded), len(voc))
+            self.assertEqual(loaded.lookup_index(index=5), 'NLP')
+            self.assertEqual(loaded.lookup_indices(indices=[4, 6, 7]), ['Feedly', 'é', ''])
+            # The token to id mapping is only built on the first lookup
+            self.assertNotIn('_token2id', vars(loaded))
+            self.assertEqual(loaded.lookup_token(token='NLP'), 5)
+            self.assertIsInstance(vars(loaded)['_token2id'], MappedTokenIndex)
+            self.assertEqual(loaded.lookup_tokens(tokens=['é', 'unknown']).tolist(), [6, loaded.unk_index])
+            self.assertEqual(loaded.to_serializable(), voc.to_serializable())
+            self.assertEqual((loaded.mask_index, loaded.begin_seq_index, loaded.end_seq_index), (1, 2, 3))
+
+            unpickled = pickle.loads(pickle.dumps(loaded))
+            self.assertEqual(unpickled.lookup_index(index=4), 'Feedly')
+
+            # Loaded vocabularies can still grow
+            self.assertEqual(loaded.add_token(token='PyTorch'), 8)
+            self.assertEqual(loaded.lookup_index(index=8), 'PyTorch')
+            self.assertEqual(loaded.lookup_token(token='NLP'), 5)
+
+            self.assertRaises(ValueError, lambda: CBOWVocabulary.load(path))
+
+    def test_mapped_token_index(self):
+        voc = Vocabulary()
+        tokens = [f'token{i}' for i in range(1000)] + ['', 'é', '漢字']
+        voc.add_many(tokens=tokens)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'data.vocab'
+            voc.save(path)
+            loaded = Vocabulary.load(path)
+
+            self.assertEqual(loaded.lookup_tokens(tokens=tokens + ['unknown', 'token1000']).tolist(),
+                             voc.lookup_tokens(tokens=tokens + ['unknown', 'token1000']).tolist())
+            index = loaded._token2id
+            self.assertIsInstance(index, MappedTokenIndex)
+            self.assertEqual(len(index), len(voc))
+            self.assertIn('漢字', index)
+            self.assertNotIn('unknown', index)
+            self.assertRaises(KeyError, lambda: index['unknown'])
+            self.assertEqual(dict(index), voc._token2id)
+            # The tokens keep the Sequence semantics of index
+            self.assertEqual(index.tokens.find('unknown'), -1)
+            self.assertEqual(index.tokens.index('é'), index.tokens.find('é'))
+            self.assertRaises(ValueError, lambda: index.tokens.index('unknown'))
+
+            unpickled = pickle.loads(pickle.dumps(loaded))
+            self.assertIsInstance(unpickled._token2id, MappedTokenIndex)
+            self.assertEqual(unpickled.lookup_token(token='token999'), voc.lookup_token(token='token999'))
+
+    def test_hashing_vocabulary(self):
+        voc = HashingVocabulary(num_buckets=16, reserved_tokens=['[CLS]'], track_collisions=True)
+        self.assertEqual(len(voc), 5 + 16)
+        self.assertEqual((voc.unk_index, voc.mask_index, voc.begin_seq_index, voc.end_seq_index), (0, 1, 2, 3))
+        self.assertEqual(voc.lookup_token('[CLS]'), 4)
+
+        tokens = ['feedly', 'nlp', 'feedly', '<MASK>'] + [f'token{i}' for i in range(20)]
+        ids = voc.lookup_tokens(tokens=tokens)
+        self.assertEqual(ids[0], ids[2])
+        self.assertEqual(ids[3], voc.mask_index)
+        self.assertTrue(((ids[4:] >= 5) & (ids[4:] < len(voc))).all())
+        self.assertEqual(voc.add_token('nlp'), ids[1])
+        self.assertEqual(len(voc), 5 + 16)
+        self.assertEqual(voc.lookup_index(index=int(ids[0])), 'feedly')
+        self.assertEqual(voc.hash_tokens(tokens=['feedly']).tolist(), [ids[0]])
+
+        # 22 distinct hashed tokens in 16 buckets
+        stats = voc.collision_stats()
+        self.assertEqual(stats['tokens'], 22)
+        self.assertEqual(stats['collisions'], 22 - stats['buckets'])
+
+        # The hash doesn't depend on the process or on collision tracking
+        other = pickle.loads(pickle.dumps(HashingVocabulary(num_buckets=16, reserved_tokens=['[CLS]'])))
+        self.assertEqual(other.lookup_tokens(tokens=tokens).tolist(), ids.tolist())
+        self.assertTrue(other.lookup_index(index=int(ids[0])).startswith('<BUCKET_'))
+        self.assertRaises(ValueError, other.collision_stats)
+        self.assertEqual(HashingVocabulary.from_serializable(voc.to_serializable()).lookup_tokens(tokens=tokens).tolist(), ids.tolist())
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'data.vocab'
+            voc.save(path)
+            loaded = Vocabulary.load(path)
+            self.assertIsInstance(loaded, HashingVocabulary)
+            self.assertEqual(len(loaded), len(voc))
+            self.assertEqual(loaded.lookup_tokens(tokens=tokens).tolist(), ids.tolist())
+            self.assertEqual(loaded.collision_stats()['tokens'], 22)
+
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
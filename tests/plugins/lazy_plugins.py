@@ -0,0 +1,17 @@
+"""
+Plugins only imported through the plugin index, see `RegistryTest.test_plugin_index`
+"""
+from transfer_nlp.plugins.config import register_plugin
+
+
+@register_plugin
+class DemoLazyPlugin:
+
+    def __init__(self, val: int):
+        self.val = val
+
+
+class DemoUnregisteredLazyPlugin:
+
+    def __init__(self, val: int):
+        self.val = val
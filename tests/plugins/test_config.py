@@ -1,8 +1,15 @@
+import copy
+import json
+import sys
+import tempfile
 import unittest
 from pathlib import Path
 from typing import Any, Dict, List
+from unittest import mock
 
-from transfer_nlp.plugins.config import CallableInstantiationError, ExperimentConfig, LoopInConfigError, UnknownPluginException, UnknownReferenceError, register_plugin
+from transfer_nlp.plugins import config
+from transfer_nlp.plugins.config import CallableInstantiationError, ExperimentConfig, LoopInConfigError, PluginIndex, UnknownPluginException, \
+    UnknownReferenceError, register_plugin
 
 
 @register_plugin
@@ -845,3 +852,161 @@ class RegistryTest(unittest.TestCase):
 
         self.assertRaises(LoopInConfigError, lambda: ExperimentConfig(experiment1))
         self.assertRaises(LoopInConfigError, lambda: ExperimentConfig(experiment2))
+
+    def test_plugin_index(self):
+
+        with tempfile.TemporaryDirectory() as tmp:
+            index_path = Path(tmp) / 'plugin_index.json'
+            with index_path.open('w') as f:
+                json.dump({
+                    'DemoLazyPlugin': 'tests.plugins.lazy_plugins:DemoLazyPlugin',
+                    'DemoUnregistered': 'tests.plugins.lazy_plugins:DemoUnregisteredLazyPlugin'}, f)
+
+            experiment = {
+                'registered': {
+                    '_name': 'DemoLazyPlugin',
+                    'val': 1
+                },
+                'unregistered': {
+                    '_name': 'DemoUnregistered',
+                    'val': 2
+                },
+                'reference': '$DemoUnregistered'
+            }
+
+            self.assertNotIn('tests.plugins.lazy_plugins', sys.modules)
+            with mock.patch.object(config, 'PLUGIN_INDEX', PluginIndex(index_path)):
+                e = ExperimentConfig(experiment)
+
+            self.assertIn('tests.plugins.lazy_plugins', sys.modules)
+            self.assertEqual(e['registered'].val, 1)
+            self.assertEqual(e['unregistered'].val, 2)
+            self.assertIs(e['reference'], config.REGISTRY['DemoUnregistered'])
+
+    def test_plugin_index_rebuild(self):
+
+        with tempfile.TemporaryDirectory() as tmp:
+            index = PluginIndex(Path(tmp) / 'plugin_index.json')
+            with mock.patch.object(config, 'PLUGIN_INDEX', index):
+                self.assertRaises(UnknownPluginException, lambda: ExperimentConfig({'item': {'_name': 'DemoNotInstalled'}}))
+
+            # The index has been rebuilt from the installed entry points and written to disk
+            self.assertTrue(index.rebuilt)
+            self.assertTrue(index.index_path.exists())
+
+    def test_plugin_index_invalid(self):
+
+        with tempfile.TemporaryDirectory() as tmp:
+            index_path = Path(tmp) / 'plugin_index.json'
+            index_path.write_text('{"DemoLazyPlugin": "tests.plugins.lazy_')
+            index = PluginIndex(index_path)
+            # A partially written index is rebuilt instead of crashing
+            self.assertIsInstance(index.load(), dict)
+            self.assertTrue(index.rebuilt)
+            self.assertIsInstance(json.loads(index_path.read_text()), dict)
+            self.assertEqual([path.name for path in Path(tmp).iterdir()], ['plugin_index.json'])
+
+            # Stale entries are rebuilt, and reported as unknown plugins if they are still missing
+            index_path.write_text(json.dumps({'DemoStale': 'tests.plugins.lazy_plugins:DemoRemoved',
+                                              'DemoStaleModule': 'tests.plugins.removed_module:DemoRemoved'}))
+            for name in ['DemoStale', 'DemoStaleModule']:
+                with mock.patch.object(config, 'PLUGIN_INDEX', PluginIndex(index_path)):
+                    self.assertRaises(UnknownPluginException, lambda: ExperimentConfig({'item': {'_name': name}}))
+
+    def test_plugin_index_experiment_keys(self):
+
+        index = PluginIndex()
+        experiment = {
+            'demo': {
+                '_name': 'DemoWithVal',
+                'val': '$HOME'
+            },
+            'reference': '$demo'
+        }
+        with mock.patch.object(config, 'PLUGIN_INDEX', index), mock.patch.object(index, 'load') as load:
+            e = ExperimentConfig(experiment, HOME='/home')
+            # References to experiment objects and environment variables never consult the index
+            load.assert_not_called()
+        self.assertIs(e['reference'], e['demo'])
+        self.assertEqual(e['demo'].val, '/home')
+
+    def test_build_trace(self):
+
+        experiment = {
+            'demo': {
+                '_name': 'DemoWithVal',
+                'val': [1, 2]
+            },
+            'reference': '$demo'
+        }
+
+        e = ExperimentConfig(experiment, trace_build=True)
+        traced = [name for name, _ in e.builder.build_trace]
+        self.assertEqual(traced, ['demo.val.0', 'demo.val.1', 'demo.val', 'demo', 'reference'])
+        self.assertTrue(all(elapsed >= 0 for _, elapsed in e.builder.build_trace))
+
+        table = e.builder.format_build_trace().split('\n')
+        self.assertEqual(len(table), 6)
+        self.assertTrue(table[0].startswith('node'))
+
+        e = ExperimentConfig(experiment)
+        self.assertEqual(e.builder.build_trace, [])
+
+    def test_apply_diff(self):
+
+        experiment = {
+            'demoa': {
+                '_name': 'DemoA',
+                'simple_int': 1
+            },
+            'demob': {
+                '_name': 'DemoB',
+                'demoa': '$demoa',
+                'attrb': 2
+            },
+            'democ': {
+                '_name': 'DemoC',
+                'demob': '$demob',
+                'attrc': 3
+            },
+            'other': {
+                '_name': 'DemoWithList',
+                'children': [1, 2]
+            }
+        }
+
+        e = ExperimentConfig(experiment)
+        demoa, demob, other = e['demoa'], e['demob'], e['other']
+        self.assertEqual(e.dependencies['democ'], {'demob'})
+
+        rebuilt = e.apply_diff({'demob.attrb': 5})
+        self.assertEqual(rebuilt, {'demob', 'democ'})
+        self.assertIs(e['demoa'], demoa)
+        self.assertIs(e['other'], other)
+        self.assertIsNot(e['demob'], demob)
+        self.assertEqual(e['demob'].attrb, 5)
+        self.assertIs(e['democ'].demob, e['demob'])
+        self.assertIs(e['demob'].demoa, demoa)
+        # The original config is left untouched
+        self.assertEqual(experiment['demob']['attrb'], 2)
+
+        rebuilt = e.apply_diff({'demoa.simple_int': 4, 'other.children.1': 3})
+        self.assertEqual(rebuilt, {'demoa', 'demob', 'democ', 'other'})
+        self.assertEqual(e['democ'].demob.demoa.simple_int, 4)
+        self.assertEqual(e['other'].children, [1, 3])
+
+        rebuilt = e.apply_diff({'new_object': {'_name': 'DemoWithVal', 'val': '$demoa'}})
+        self.assertEqual(rebuilt, {'new_object'})
+        self.assertIs(e['new_object'].val, e['demoa'])
+
+        # A failed update leaves the config and the objects unchanged
+        config, objects, dependencies = copy.deepcopy(e.config), dict(e.experiment), copy.deepcopy(e.dependencies)
+        with self.assertRaises(KeyError):
+            e.apply_diff({'demoa.simple_int': 5, 'unknown.attr': 1})
+        with self.assertRaises(CallableInstantiationError):
+            e.apply_diff({'demob.unknown_param': 1})
+        self.assertEqual(e.config, config)
+        self.assertEqual(e.experiment, objects)
+        self.assertTrue(all(e.experiment[key] is value for key, value in objects.items()))
+        self.assertEqual(e.dependencies, dependencies)
+        self.assertEqual(e['democ'].demob.demoa.simple_int, 4)
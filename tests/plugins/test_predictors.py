@@ -0,0 +1,282 @@
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+from typing import Any, Dict, List
+
+import numpy as np
+import torch
+
+from transfer_nlp.loaders.vectorizers import Vectorizer
+from transfer_nlp.loaders.vocabulary import Vocabulary
+from transfer_nlp.plugins.predictors import MicroBatchingPredictor, PredictorABC
+
+
+def run(coroutine):
+    # asyncio.run needs python 3.7
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class DemoVectorizer(Vectorizer):
+
+    def __init__(self):
+        self.target_vocab = Vocabulary(add_unk=False)
+        self.target_vocab.add_many(['short', 'long'])
+
+    def vectorize(self, text: str) -> np.ndarray:
+        if text == 'fail':
+            raise ValueError("Cannot vectorize")
+        return np.array([len(text)], dtype=np.float32)
+
+
+class DemoModel(torch.nn.Module):
+
+    def __init__(self):
+        super().__init__()
+        self.batch_sizes = []
+
+    def forward(self, x_in: torch.Tensor) -> torch.Tensor:
+        self.batch_sizes.append(len(x_in))
+        return torch.cat([10 - x_in, x_in - 10], dim=1)
+
+
+class DemoPredictor(PredictorABC):
+
+    def json_to_data(self, input_json: Dict) -> Dict:
+        return {'x_in': torch.tensor(np.stack([self.vectorizer.vectorize(text) for text in input_json['inputs']]))}
+
+    def output_to_json(self, outputs: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {'outputs': outputs}
+
+    def decode(self, output: torch.Tensor) -> List[Dict[str, Any]]:
+        return [{'class': self.vectorizer.target_vocab.lookup_index(int(index))} for index in output.argmax(dim=1)]
+
+
+class PairVectorizer(DemoVectorizer):
+
+    def vectorize(self, text: str):
+        return np.array([ord(c) for c in text.ljust(4)[:4]]), len(text)
+
+
+class VectorizeBatchTest(unittest.TestCase):
+
+    def test_vectorize_batch(self):
+        predictor = DemoPredictor(vectorizer=DemoVectorizer(), model=DemoModel())
+        batch = predictor.vectorize_batch(['a', 'abc'])
+        self.assertEqual(list(batch), ['x_in'])
+        self.assertEqual(batch['x_in'].dtype, torch.float32)
+        self.assertEqual(batch['x_in'].tolist(), [[1], [3]])
+
+        predictor.vectorizer = PairVectorizer()
+        batch = predictor.vectorize_batch(['ab', 'abcdef'], keys=('x_in', 'x_lengths'), dtypes={'x_lengths': np.float32})
+        self.assertEqual(batch['x_in'].dtype, torch.int64)
+        self.assertEqual(batch['x_in'].tolist(), [[97, 98, 32, 32], [97, 98, 99, 100]])
+        self.assertEqual(batch['x_lengths'].dtype, torch.float32)
+        self.assertEqual(batch['x_lengths'].tolist(), [2, 6])
+
+        with self.assertRaises(ValueError):
+            predictor.vectorize_batch([])
+
+
+class DecodeClassesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.predictor = DemoPredictor(vectorizer=DemoVectorizer(), model=DemoModel())
+        self.vocabulary = Vocabulary(add_unk=False)
+        self.vocabulary.add_many(['a', 'b', 'c'])
+        self.output = torch.log(torch.tensor([[0.2, 0.5, 0.3], [0.7, 0.1, 0.2]]))
+
+    def test_default(self):
+        decoded = self.predictor.decode_classes(self.output, vocabulary=self.vocabulary)
+        probabilities = torch.nn.functional.softmax(self.output, dim=1)
+        probability_values, indices = probabilities.max(dim=1)
+        expected = [{"class": self.vocabulary.lookup_index(index=int(res[1])), "probability": float(res[0])}
+                    for res in zip(probability_values, indices)]
+        self.assertEqual(decoded, expected)
+
+    def test_top_k_and_threshold(self):
+        self.predictor.configure_decoding(top_k=2)
+        decoded = self.predictor.decode_classes(self.output, vocabulary=self.vocabulary)
+        self.assertEqual([row['class'] for row in decoded], [['b', 'c'], ['a', 'c']])
+        np.testing.assert_allclose(decoded[0]['probability'], [0.5, 0.3], rtol=1e-5)
+
+        self.predictor.configure_decoding(top_k=5, threshold=0.25)
+        decoded = self.predictor.decode_classes(self.output, vocabulary=self.vocabulary)
+        self.assertEqual([row['class'] for row in decoded], [['b', 'c'], ['a']])
+
+        self.predictor.configure_decoding(threshold=0.6, columnar=True)
+        decoded = self.predictor.decode_classes(self.output, vocabulary=self.vocabulary)
+        self.assertEqual(decoded['class'], [None, 'a'])
+        np.testing.assert_allclose(decoded['probability'], [0.5, 0.7], rtol=1e-5)
+
+    def test_columnar_micro_batching(self):
+        self.predictor.decode = lambda output: self.predictor.decode_classes(output, self.predictor.vectorizer.target_vocab)
+        self.predictor.configure_decoding(columnar=True)
+        server = MicroBatchingPredictor(predictor=self.predictor, max_latency_ms=100)
+        futures = [server.submit({'inputs': ['x', 'y' * 20]}), server.submit({'inputs': ['z']})]
+        server.close()
+        self.assertEqual(futures[0].result()['outputs']['class'], ['short', 'long'])
+        self.assertEqual(futures[1].result()['outputs']['class'], ['short'])
+
+
+class MicroBatchingPredictorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.model = DemoModel()
+        self.predictor = DemoPredictor(vectorizer=DemoVectorizer(), model=self.model)
+
+    def test_batching(self):
+        server = MicroBatchingPredictor(predictor=self.predictor, max_batch_size=100, max_latency_ms=200)
+        requests = [{'inputs': ['a' * i, 'b' * (20 - i)]} for i in range(20)]
+        futures = [server.submit(request) for request in requests]
+        results = [future.result() for future in futures]
+        server.close()
+
+        for i, result in enumerate(results):
+            self.assertEqual(result, self.predictor.json_to_json(requests[i]))
+        # The 20 requests are run in a single forward pass
+        self.assertEqual(self.model.batch_sizes[0], 40)
+
+    def test_concurrent_callers(self):
+        server = MicroBatchingPredictor(predictor=self.predictor, max_batch_size=8, max_latency_ms=50)
+        results = {}
+
+        def call(i: int):
+            results[i] = server.json_to_json({'inputs': ['x' * i]})
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(30)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        server.close()
+
+        self.assertEqual(results, {i: {'outputs': [{'class': 'short' if i <= 10 else 'long'}]} for i in range(30)})
+        self.assertLess(len(self.model.batch_sizes), 30)
+        self.assertLessEqual(max(self.model.batch_sizes), 8)
+
+    def test_errors(self):
+        server = MicroBatchingPredictor(predictor=self.predictor, max_latency_ms=100)
+        futures = [server.submit({'inputs': ['ok']}), server.submit({'inputs': ['fail']}), server.submit({'inputs': []})]
+        # Malformed requests are rejected by submit
+        with self.assertRaises(KeyError):
+            server.submit({})
+        for request in [{'inputs': None}, ['ok'], {'inputs': 3}, {'inputs': 'ok'}]:
+            with self.assertRaises(ValueError):
+                server.submit(request)
+        # and the server keeps serving
+        self.assertEqual(server.json_to_json({'inputs': ['ok']}), {'outputs': [{'class': 'short'}]})
+        server.close()
+
+        self.assertEqual(futures[0].result(), {'outputs': [{'class': 'short'}]})
+        with self.assertRaises(ValueError):
+            futures[1].result()
+        self.assertEqual(futures[2].result(), {'outputs': []})
+        with self.assertRaises(RuntimeError):
+            server.submit({'inputs': ['ok']})
+
+
+    def test_worker_errors(self):
+        server = MicroBatchingPredictor(predictor=self.predictor, max_latency_ms=1)
+        # Requests bypassing the validation of submit, or a failing output conversion, only fail their own callers
+        future = Future()
+        server._queue.put(({'inputs': None}, future))
+        self.assertRaises(ValueError, future.result)
+
+        output_to_json = self.predictor.output_to_json
+        self.predictor.output_to_json = lambda outputs: 1 / 0
+        self.assertRaises(ZeroDivisionError, lambda: server.json_to_json({'inputs': ['ok']}))
+        self.predictor.output_to_json = output_to_json
+        self.assertEqual(server.json_to_json({'inputs': ['ok']}), {'outputs': [{'class': 'short'}]})
+        server.close()
+
+    def test_close_while_submitting(self):
+        server = MicroBatchingPredictor(predictor=self.predictor, max_latency_ms=1)
+        futures = []
+
+        def submit():
+            try:
+                while True:
+                    futures.append(server.submit({'inputs': ['x']}))
+            except RuntimeError:
+                pass
+
+        threads = [threading.Thread(target=submit) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        server.close()
+        for thread in threads:
+            thread.join()
+
+        # Every accepted request is processed
+        self.assertTrue(futures)
+        self.assertTrue(all(future.result(timeout=1) == {'outputs': [{'class': 'short'}]} for future in futures))
+
+
+class SlowPredictor(DemoPredictor):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def predict(self, batch: Dict[str, Any]) -> List[Dict]:
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.02)
+        with self.lock:
+            self.running -= 1
+        return super().predict(batch)
+
+
+class AsyncPredictorTest(unittest.TestCase):
+
+    def test_ajson_to_json(self):
+        predictor = SlowPredictor(vectorizer=DemoVectorizer(), model=DemoModel()).enable_async(max_workers=4,
+                                                                                               max_pending=2)
+        ticks = []
+
+        async def tick():
+            for _ in range(5):
+                ticks.append(time.perf_counter())
+                await asyncio.sleep(0.01)
+
+        async def main():
+            requests = [predictor.ajson_to_json({'inputs': ['x' * i]}) for i in range(8)]
+            results = await asyncio.gather(tick(), *requests)
+            return results[1:], time.perf_counter()
+
+        results, finished = run(main())
+        self.assertEqual(results, [predictor.json_to_json({'inputs': ['x' * i]}) for i in range(8)])
+        # The event loop is not blocked by the predictions, which are bounded by max_pending
+        self.assertLess(ticks[-1], finished - 0.02)
+        self.assertEqual(predictor.max_running, 2)
+
+        batch = predictor.json_to_data({'inputs': ['x', 'xxxxxxxxxxxxxxxxxxxxx']})
+        self.assertEqual(run(predictor.apredict(batch)), [{'class': 'short'}, {'class': 'long'}])
+
+    def test_micro_batching(self):
+        model = DemoModel()
+        server = MicroBatchingPredictor(predictor=DemoPredictor(vectorizer=DemoVectorizer(), model=model),
+                                        max_batch_size=100, max_latency_ms=50, max_pending=10)
+
+        async def main():
+            return await asyncio.gather(*[server.ajson_to_json({'inputs': ['x' * i]}) for i in range(30)])
+
+        results = run(main())
+        server.close()
+        self.assertEqual(results, [{'outputs': [{'class': 'short' if i <= 10 else 'long'}]} for i in range(30)])
+        self.assertLessEqual(max(model.batch_sizes), 10)
+        self.assertLess(len(model.batch_sizes), 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import json
+import unittest
+
+from transfer_nlp.plugins.config import ExperimentConfig, register_plugin
+from transfer_nlp.plugins.profiling import BuildProfiler
+
+
+@register_plugin
+class DemoAllocating:
+
+    def __init__(self, size: int, child=None):
+        self.data = bytearray(size)
+        self.child = child
+
+
+EXPERIMENT = {
+    'small': {
+        '_name': 'DemoAllocating',
+        'size': 1000
+    },
+    'big': {
+        '_name': 'DemoAllocating',
+        'size': 1000000,
+        'child': '$small'
+    }
+}
+
+
+class BuildProfilerTest(unittest.TestCase):
+
+    def test_profile(self):
+        profiler = BuildProfiler(memory=True)
+        e = ExperimentConfig(EXPERIMENT, profiler=profiler)
+        self.assertIs(e.profiler, profiler)
+
+        records = {node.name: node for node in profiler.records}
+        self.assertEqual(set(records), {'small', 'small.size', 'big', 'big.size', 'big.child'})
+        for node in profiler.records:
+            self.assertGreaterEqual(node.wall_time, 0)
+            self.assertIsNotNone(node.cpu_time)
+            self.assertIsNotNone(node.memory_peak)
+
+        self.assertGreaterEqual(records['big'].memory_delta, 1000000)
+        self.assertGreaterEqual(records['big'].memory_peak, records['big'].memory_delta)
+        self.assertLess(records['small'].memory_delta, 1000000)
+        self.assertEqual([child.name for child in records['big'].children], ['big.size', 'big.child'])
+        self.assertEqual(records['big.child'].depth, 1)
+
+    def test_reports(self):
+        profiler = BuildProfiler()
+        ExperimentConfig(EXPERIMENT, profiler=profiler)
+
+        report = json.loads(profiler.to_json())
+        self.assertEqual(len(report), 5)
+        self.assertIsNone(report[0]['memory_delta'])
+
+        table = profiler.format_table(sort_by='wall_time').split('\n')
+        self.assertEqual(len(table), 6)
+        self.assertIn('cpu (ms)', table[0])
+        self.assertNotIn('mem (KiB)', table[0])
+
+        hierarchy = profiler.to_hierarchy()
+        self.assertEqual([child['name'] for child in hierarchy['children']], ['small', 'big'])
+        self.assertEqual([child['name'] for child in hierarchy['children'][1]['children']], ['big.size', 'big.child'])
+
+        folded = profiler.to_folded().split('\n')
+        self.assertIn('big;big.child', [line.split(' ')[0] for line in folded])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,6 @@
 import copy
+import importlib.util
+import tempfile
 import unittest
 from pathlib import Path
 
@@ -56,6 +58,8 @@ PLUGINS = {
 for plugin_name, plugin in PLUGINS.items():
     register_plugin(registrable=plugin, alias=plugin_name)
 
+TENSORBOARD = any(importlib.util.find_spec(module) for module in ('tensorboard', 'tensorboardX'))
+
 
 def fbeta(r, p, beta, average):
     if average:
@@ -168,6 +172,23 @@ class RegistryTest(unittest.TestCase):
         self.assertEqual(len(trainer.trainer._event_handlers[ignite.engine.Events.EPOCH_STARTED]), 8)
         self.assertEqual(len(trainer.trainer._event_handlers[ignite.engine.Events.ITERATION_STARTED]), 0)
 
+    @unittest.skipUnless(TENSORBOARD, "tensorboard is not installed")
+    def test_log_embeddings(self):
+        e = copy.deepcopy(EXPERIMENT)
+        with tempfile.TemporaryDirectory() as tmp:
+            e['trainer'].update({'num_epochs': 1, 'tensorboard_logs': tmp, 'embeddings_name': 'emb'})
+            e = ExperimentConfig(e)
+            trainer = e.experiment['trainer']
+            data_vocab = trainer.dataset_splits.vectorizer.data_vocab
+            trainer.model.emb = nn.Embedding(len(data_vocab), 4)
+            trainer.train()
+
+            # The export runs in the background, after the training
+            trainer.embeddings_exporter.close()
+            self.assertIsNone(trainer.embeddings_exporter._executor)
+            metadata = (Path(tmp) / '00001' / 'emb' / 'metadata.tsv').read_text(encoding='utf-8').splitlines()
+            self.assertEqual(metadata, data_vocab.lookup_indices(range(len(data_vocab))))
+
     def test_forward(self):
         e = copy.deepcopy(EXPERIMENT)
         e = ExperimentConfig(e)
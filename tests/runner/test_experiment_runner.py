@@ -1,3 +1,4 @@
+import gc
 import io
 import json
 import logging
@@ -7,12 +8,15 @@ from pathlib import Path
 from typing import Dict, Any
 from unittest import TestCase
 
+import numpy as np
+import pandas as pd
 import toml
+import torch
 
 from transfer_nlp.plugins.config import register_plugin, ExperimentConfig
 from transfer_nlp.plugins.reporters import ReporterABC
 from transfer_nlp.plugins.trainer_abc import TrainerABC
-from transfer_nlp.runner.experiment_runner import ExperimentRunner
+from transfer_nlp.runner.experiment_runner import ExperimentRunner, freeze_read_only_objects
 
 logger = logging.getLogger(__name__)
 logger.setLevel(level=logging.INFO)
@@ -138,3 +142,28 @@ class ExperimentRunnerTest(TestCase):
 
             self.assertEqual(ExperimentConfig.load_experiment_config(pkg_dir / 'test_experiment.yml'),
                              ExperimentConfig.load_experiment_config(f'{self.test_dir}/reports/global-reporting/test_experiment.yml'))
+
+    def test_freeze_read_only_objects(self):
+
+        class Holder:
+            def __init__(self):
+                self.array = np.zeros(10)
+                self.tensors = {'weights': torch.zeros(10)}
+                self.words = ['a', 'b']
+
+        holder = Holder()
+        # Vectorized dataframes hold an array per row in object columns
+        df = pd.DataFrame({'x_in': [np.ones(3), np.zeros(3)], 'y_target': [0, 1], 'split': ['train', 'val']})
+        objects = [holder, [holder.array], torch.nn.Linear(2, 2), {'df': df}]
+        try:
+            frozen = freeze_read_only_objects(objects)
+            # The objects are out of reach of the collections in forked workers
+            self.assertGreater(gc.get_freeze_count(), 0)
+        finally:
+            gc.unfreeze()
+
+        self.assertEqual(frozen, 5)
+        self.assertFalse(any(row.flags.writeable for row in df['x_in']))
+        self.assertFalse(holder.array.flags.writeable)
+        self.assertTrue(holder.tensors['weights'].is_shared())
+        self.assertTrue(objects[2].weight.is_shared())
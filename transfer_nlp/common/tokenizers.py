@@ -1,10 +1,23 @@
+import heapq
+import json
 import logging
 import re
-from typing import List
+from collections import Counter, defaultdict
+from functools import lru_cache
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, Iterable, List, Set, Tuple, Union
+
+from transfer_nlp.common.utils import shards
 
 logger = logging.getLogger(__name__)
 
 
+def _tokenize_shard(args: Tuple['TokenizerABC', List[str]]) -> List[List[str]]:
+    tokenizer, texts = args
+    return tokenizer._tokenize_many(texts)
+
+
 class TokenizerABC:
 
     def __init__(self):
@@ -13,8 +26,35 @@ class TokenizerABC:
     def tokenize(self, text: str):
         raise NotImplementedError
 
+    def tokenize_batch(self, texts: Iterable[str], num_workers: int = 1, shard_size: int = 10000) -> List[List[str]]:
+        """
+        Tokenize many texts at once, giving the same tokens as `tokenize` on every text
+        :param texts: an iterable of texts, consumed once
+        :param num_workers: number of processes used to tokenize the texts. The tokenizer must be picklable.
+        :param shard_size: number of texts tokenized by a worker at once
+        :return: the tokens of every text, in order
+        """
+        if num_workers <= 1:
+            return self._tokenize_many(texts)
+
+        tokenized = []
+        with Pool(processes=num_workers) as pool:
+            for tokens in pool.imap(_tokenize_shard, ((self, shard) for shard in shards(texts, shard_size))):
+                tokenized.extend(tokens)
+        return tokenized
+
+    def _tokenize_many(self, texts: Iterable[str]) -> List[List[str]]:
+        return [self.tokenize(text=text) for text in texts]
+
 
 class CustomTokenizer(TokenizerABC):
+    """
+    Lower case words and .,!? punctuation, everything else is a separator
+    """
+
+    # Lower cased text only has lower case ascii letters
+    TOKEN_PATTERN = re.compile(r"[a-z]+|[.,!?]")
+    LETTERS = frozenset('abcdefghijklmnopqrstuvwxyz')
 
     def __init__(self):
         super().__init__()
@@ -27,14 +67,25 @@ class CustomTokenizer(TokenizerABC):
         """
 
         text = text.lower()
-        text = re.sub(r"([.,!?])", r" \1 ", text)
-        text = re.sub(r"[^a-zA-Z.,!?]+", r" ", text)
-        tokens = text.split(" ")
-        if not tokens[-1]:
-            tokens = tokens[:-1]
+        tokens = self.TOKEN_PATTERN.findall(text)
+        # Splitting the text on separators used to give an empty first token when the text doesn't start with a letter
+        if text and text[0] not in self.LETTERS:
+            tokens.insert(0, '')
 
         return tokens
 
+    def _tokenize_many(self, texts: Iterable[str]) -> List[List[str]]:
+        findall = self.TOKEN_PATTERN.findall
+        letters = self.LETTERS
+        tokenized = []
+        for text in texts:
+            text = text.lower()
+            tokens = findall(text)
+            if text and text[0] not in letters:
+                tokens.insert(0, '')
+            tokenized.append(tokens)
+        return tokenized
+
 
 class CharacterTokenizer(TokenizerABC):
 
@@ -48,7 +99,233 @@ class CharacterTokenizer(TokenizerABC):
         :return:
         """
 
-        return [char for char in text.lower()]
+        return list(text.lower())
+
+    def _tokenize_many(self, texts: Iterable[str]) -> List[List[str]]:
+        return [list(text.lower()) for text in texts]
+
+
+class CachedTokenizer(TokenizerABC):
+    """
+    Bounded LRU cache in front of a tokenizer, for inputs that come again and again
+    """
+
+    def __init__(self, tokenizer: TokenizerABC, maxsize: int = 10000):
+        """
+        :param tokenizer: the tokenizer to cache
+        :param maxsize: maximum number of cached texts
+        """
+        super().__init__()
+        self.tokenizer: TokenizerABC = tokenizer
+        self.maxsize: int = maxsize
+        self._tokenize = lru_cache(maxsize=maxsize)(self._tokenize_tuple)
+
+    def __reduce__(self):
+        return self.__class__, (self.tokenizer, self.maxsize)
+
+    def _tokenize_tuple(self, text: str) -> Tuple[str, ...]:
+        return tuple(self.tokenizer.tokenize(text=text))
+
+    def tokenize(self, text: str) -> List[str]:
+        # Cached tokens are immutable, callers get their own list
+        return list(self._tokenize(text))
+
+    def cache_info(self):
+        """
+        :return: hits, misses, maxsize and current size of the cache
+        """
+        return self._tokenize.cache_info()
+
+    def cache_clear(self):
+        self._tokenize.cache_clear()
+
+
+class BPETokenizer(TokenizerABC):
+    """
+    Subword tokenizer learning byte pair encoding merges from a corpus, for bounded vocabularies without unknown words.
+
+    Texts are split into words by a word-level tokenizer, then words into subwords by applying the learnt merges. As in
+    WordPiece, subwords which don't start a word are prefixed with `##`, so that tokens can be joined back into words.
+
+    Usage:
+
+        tokenizer = BPETokenizer().train(df.title, vocab_size=8000)
+        vocabulary = tokenizer.build_vocabulary()
+        tokenizer.save('news.bpe')
+    """
+
+    def __init__(self, pre_tokenizer: TokenizerABC = None, merges: List[Tuple[str, str]] = None,
+                 alphabet: Iterable[str] = None, continuation_prefix: str = '##', cache_size: int = 100000):
+        """
+        :param pre_tokenizer: the tokenizer splitting texts into words, CustomTokenizer by default
+        :param merges: the learnt merges, in order
+        :param alphabet: the initial subwords, usually learnt with the merges
+        :param continuation_prefix: prefix of the subwords which don't start a word
+        :param cache_size: number of word encodings kept in memory
+        """
+        super().__init__()
+        self.pre_tokenizer: TokenizerABC = pre_tokenizer or CustomTokenizer()
+        self.continuation_prefix: str = continuation_prefix
+        self.alphabet: List[str] = list(alphabet or [])
+        self.merges: List[Tuple[str, str]] = [tuple(merge) for merge in merges or []]
+        self.cache_size: int = cache_size
+        self._init_merge_table()
+
+    def _init_merge_table(self):
+        self._ranks: Dict[Tuple[str, str], int] = {merge: rank for rank, merge in enumerate(self.merges)}
+        self._encode_word = lru_cache(maxsize=self.cache_size)(self._merge_word)
+
+    def __getstate__(self):
+        # The merge table and the word cache are rebuilt on unpickling
+        return {key: value for key, value in vars(self).items() if key not in ('_ranks', '_encode_word')}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_merge_table()
+
+    @property
+    def units(self) -> List[str]:
+        """
+        :return: all the subwords the tokenizer can output: the alphabet, then the result of every merge
+        """
+        return self.alphabet + [self._join(first, second) for first, second in self.merges]
+
+    def _symbols(self, word: str) -> List[str]:
+        return [word[0]] + [self.continuation_prefix + char for char in word[1:]]
+
+    def _join(self, first: str, second: str) -> str:
+        return first + second[len(self.continuation_prefix):]
+
+    def train(self, texts: Iterable[str], vocab_size: int, min_frequency: int = 2) -> 'BPETokenizer':
+        """
+        Learn merges from a corpus, replacing the current ones
+        :param texts: an iterable of texts, consumed once
+        :param vocab_size: maximum number of subwords, alphabet included
+        :param min_frequency: minimum number of occurrences of a pair to merge it
+        :return: the tokenizer
+        """
+        word_counts = Counter()
+        for tokens in self.pre_tokenizer.tokenize_batch(texts):
+            word_counts.update(token for token in tokens if token)
+
+        words = [self._symbols(word) for word in word_counts]
+        counts = list(word_counts.values())
+        self.alphabet = sorted({symbol for word in words for symbol in word})
+        self.merges = []
+
+        pair_counts = Counter()
+        pair_words: Dict[Tuple[str, str], Set[int]] = defaultdict(set)
+        for index, word in enumerate(words):
+            for pair in zip(word, word[1:]):
+                pair_counts[pair] += counts[index]
+                pair_words[pair].add(index)
+
+        # Max heap of pair counts, with stale entries skipped when popped. Ties are broken by the pair order.
+        heap = [(-count, pair) for pair, count in pair_counts.items()]
+        heapq.heapify(heap)
+        while heap and len(self.alphabet) + len(self.merges) < vocab_size:
+            count, pair = heapq.heappop(heap)
+            if -count != pair_counts.get(pair, 0):
+                continue
+            if -count < min_frequency:
+                break
+            self.merges.append(pair)
+            merged = self._join(*pair)
+
+            changed = set()
+            for index in pair_words.pop(pair):
+                word = words[index]
+                for old in zip(word, word[1:]):
+                    pair_counts[old] -= counts[index]
+                    changed.add(old)
+                word = words[index] = self._merge_pair(word, pair, merged)
+                for new in zip(word, word[1:]):
+                    pair_counts[new] += counts[index]
+                    pair_words[new].add(index)
+                    changed.add(new)
+
+            for changed_pair in changed:
+                changed_count = pair_counts[changed_pair]
+                if changed_count > 0:
+                    heapq.heappush(heap, (-changed_count, changed_pair))
+                else:
+                    del pair_counts[changed_pair]
+
+        self._init_merge_table()
+        return self
+
+    @staticmethod
+    def _merge_pair(word: List[str], pair: Tuple[str, str], merged: str) -> List[str]:
+        result = []
+        i = 0
+        while i < len(word):
+            if i < len(word) - 1 and (word[i], word[i + 1]) == pair:
+                result.append(merged)
+                i += 2
+            else:
+                result.append(word[i])
+                i += 1
+        return result
+
+    def _merge_word(self, word: str) -> Tuple[str, ...]:
+        symbols = self._symbols(word)
+        ranks = self._ranks
+        while len(symbols) > 1:
+            # Apply the earliest learnt merge first, as during training
+            rank, pair = min((ranks.get(pair, len(ranks)), pair) for pair in zip(symbols, symbols[1:]))
+            if rank == len(ranks):
+                break
+            symbols = self._merge_pair(symbols, pair, self._join(*pair))
+        return tuple(symbols)
+
+    def tokenize(self, text: str) -> List[str]:
+        """
+        :param text: the text to tokenize
+        :return: its subwords
+        """
+        return [subword for word in self.pre_tokenizer.tokenize(text=text) if word for subword in self._encode_word(word)]
+
+    def _tokenize_many(self, texts: Iterable[str]) -> List[List[str]]:
+        encode_word = self._encode_word
+        return [[subword for word in words if word for subword in encode_word(word)]
+                for words in self.pre_tokenizer.tokenize_batch(texts)]
+
+    def build_vocabulary(self, vocabulary=None):
+        """
+        :param vocabulary: the vocabulary to add the subwords to, a new `SequenceVocabulary` by default
+        :return: the vocabulary, with every subword of the tokenizer
+        """
+        from transfer_nlp.loaders.vocabulary import SequenceVocabulary
+
+        if vocabulary is None:
+            vocabulary = SequenceVocabulary()
+        vocabulary.add_many(tokens=self.units)
+        return vocabulary
+
+    def save(self, path: Union[str, Path]):
+        """
+        Write the alphabet and merges, the pre-tokenizer is not saved
+        :param path: the json file to write
+        """
+        with Path(str(path)).open('w', encoding='utf-8') as f:
+            json.dump({
+                'continuation_prefix': self.continuation_prefix,
+                'alphabet': self.alphabet,
+                'merges': [list(merge) for merge in self.merges]}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: Union[str, Path], pre_tokenizer: TokenizerABC = None, cache_size: int = 100000) -> 'BPETokenizer':
+        """
+        Load a tokenizer written by `save`
+        :param path: the json file
+        :param pre_tokenizer: the tokenizer splitting texts into words, CustomTokenizer by default
+        :param cache_size: number of word encodings kept in memory
+        :return: the tokenizer
+        """
+        with Path(str(path)).open('r', encoding='utf-8') as f:
+            contents = json.load(f)
+        return cls(pre_tokenizer=pre_tokenizer, merges=contents['merges'],
+                   alphabet=contents['alphabet'], continuation_prefix=contents['continuation_prefix'], cache_size=cache_size)
 
 
 if __name__ == "__main__":
@@ -1,9 +1,26 @@
 import logging
+from itertools import islice
+from typing import Iterable, Iterator, List, TypeVar
 
-import torch
+T = TypeVar('T')
 
 
-def describe(x: torch.Tensor):
+def shards(items: Iterable[T], shard_size: int) -> Iterator[List[T]]:
+    """
+    Split an iterable in lists of shard_size items, e.g. to send texts to worker processes
+    :param items: the items, consumed once
+    :param shard_size: number of items in a shard, the last one can be smaller
+    :return: the shards, in order
+    """
+    items = iter(items)
+    while True:
+        shard = list(islice(items, shard_size))
+        if not shard:
+            return
+        yield shard
+
+
+def describe(x: 'torch.Tensor'):
 
     print("Type: {}".format(x.type()))
     print("Shape/size: {}".format(x.shape))
@@ -11,6 +28,7 @@ def describe(x: torch.Tensor):
 
 
 if __name__ == "__main__":
+    import torch
 
     tensor = torch.rand(size=(3, 4), dtype=torch.float64)
     describe(x=tensor)
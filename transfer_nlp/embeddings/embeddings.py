@@ -1,12 +1,18 @@
+import hashlib
 import logging
+import os
+import tempfile
+import warnings
+from itertools import islice
 from pathlib import Path
-from typing import Dict, Tuple, Union
+from typing import Callable, Dict, List, Mapping, Sequence, Tuple, Union
 
 import numpy as np
 import torch
 from smart_open import open
 
 from transfer_nlp.loaders.loaders import DatasetSplits
+from transfer_nlp.loaders.vocabulary import HashingVocabulary, MappedTokenIndex, MappedTokens, Vocabulary, save_tokens
 from transfer_nlp.plugins.config import register_plugin
 from transfer_nlp.plugins.helpers import ObjectHyperParams
 
@@ -21,19 +27,393 @@ except ImportError:
     TQDM = False
 
 
-def load_glove_from_file(glove_filepath: Path) -> Tuple[Dict[str, int], np.array]:
-    w2i = {}
-    embeddings = []
+# Number of lines parsed at once by the embeddings loader
+CHUNK_LINES = 10000
 
-    with open(glove_filepath, "r") as fp:
-        iterator = tqdm(enumerate(fp), "Embeddings") if TQDM else enumerate(fp)
-        for index, line in iterator:
-            line = line.split(" ")  # each line: word num1 num2 ...
-            w2i[line[0]] = index  # word = line[0]
-            embedding_i = np.array([float(val) for val in line[1:]])
-            embeddings.append(embedding_i)
 
-    return w2i, np.stack(embeddings)
+def load_glove_from_file(glove_filepath: Path, cache: bool = True,
+                         cache_dir: Union[Path, str] = None) -> Tuple[Mapping[str, int], np.array]:
+    """
+    Load pre-trained embeddings in the GloVe or word2vec text format (one `word num1 num2 ...` line per word, with an
+    optional `count size` header line) as a float32 matrix.
+
+    With `cache`, the first load converts the file into a `.npy` matrix and a binary vocabulary next to it (or in
+    `cache_dir`), and later loads memory-map them: loading is then almost instant, and the embeddings are shared by the
+    processes using them. The cache files are named after a hash of the full path of the embeddings file, and are
+    rebuilt when its size or modification time changes. Remote files are only cached in an explicit `cache_dir`, and
+    their cache is never invalidated.
+
+    :param glove_filepath: the embeddings file, local or remote (see smart_open)
+    :param cache: use and create the cache
+    :param cache_dir: directory of the cache files, the directory of the embeddings file by default
+    :return: the index of every word in the embeddings (the last one for words present several times), and the embeddings
+    """
+    if not cache or (_is_remote(glove_filepath) and not cache_dir):
+        return _index_words(*_parse_embeddings(glove_filepath))
+
+    matrix_path, words_path = _cache_paths(glove_filepath, cache_dir)
+    if _has_cache(glove_filepath, matrix_path, words_path):
+        logger.info("Loading cached embeddings %s", matrix_path)
+    else:
+        try:
+            _convert_embeddings(glove_filepath, matrix_path=matrix_path, words_path=words_path)
+        except OSError as e:
+            logger.warning("Could not cache the embeddings in %s (%s), loading them in memory", matrix_path.parent, e)
+            return _index_words(*_parse_embeddings(glove_filepath))
+
+    return MappedTokenIndex(MappedTokens(words_path)), np.load(str(matrix_path), mmap_mode='r')
+
+
+def _is_remote(glove_filepath: Path) -> bool:
+    return '://' in str(glove_filepath)
+
+
+def _source(glove_filepath: Path) -> Dict[str, Union[str, int]]:
+    """
+    :return: the full path of an embeddings file, with its size and modification time for local files
+    """
+    if _is_remote(glove_filepath):
+        return {'source': str(glove_filepath)}
+    path = Path(str(glove_filepath)).expanduser().resolve()
+    stat = path.stat()
+    return {'source': str(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _cache_paths(glove_filepath: Path, cache_dir: Union[Path, str] = None) -> Tuple[Path, Path]:
+    source = _source(glove_filepath)['source']
+    cache_dir = Path(str(cache_dir)).expanduser() if cache_dir else Path(source).parent
+    # Different files with the same name, e.g. several glove.txt, can share a cache directory
+    name = f"{source.rstrip('/').rpartition('/')[2]}.{hashlib.sha1(source.encode('utf-8')).hexdigest()[:12]}"
+    return cache_dir / f'{name}.npy', cache_dir / f'{name}.words'
+
+
+def _has_cache(glove_filepath: Path, matrix_path: Path, words_path: Path) -> bool:
+    if not matrix_path.exists():
+        return False
+    try:
+        metadata = MappedTokens(words_path).metadata
+    except (OSError, ValueError):
+        return False
+    return all(metadata.get(key) == value for key, value in _source(glove_filepath).items())
+
+
+def _index_words(words: List[str], embeddings: np.array) -> Tuple[Dict[str, int], np.array]:
+    return {word: row for row, word in enumerate(words)}, embeddings
+
+
+def _parse_embeddings(glove_filepath: Path, out_factory: Callable[[Tuple[int, int]], np.array] = None) -> Tuple[List[str], np.array]:
+    """
+    Parse an embeddings text file chunk by chunk into a preallocated float32 matrix
+    :param out_factory: allocates the matrix given its shape, `np.empty` by default
+    :return: the word of every row and the embeddings
+    """
+    num_lines, has_header, embedding_size = _scan_embeddings(glove_filepath)
+    num_words = num_lines - has_header
+    out = (out_factory or (lambda shape: np.empty(shape, dtype=np.float32)))((num_words, embedding_size))
+
+    all_words = []
+    with open(str(glove_filepath), 'rb') as fp:
+        if has_header:
+            next(fp)
+        progress = tqdm(total=num_words, desc="Embeddings") if TQDM else None
+        while True:
+            lines = [line for line in islice(fp, CHUNK_LINES) if line.strip()]
+            if not lines:
+                break
+            words, vectors = _parse_lines(lines, embedding_size)
+            out[len(all_words):len(all_words) + len(words)] = vectors
+            all_words.extend(words)
+            if progress is not None:
+                progress.update(len(words))
+        if progress is not None:
+            progress.close()
+
+    # Blank lines were counted but not parsed
+    return all_words, out[:len(all_words)]
+
+
+def _scan_embeddings(glove_filepath: Path) -> Tuple[int, bool, int]:
+    """
+    :return: the number of lines of the file, whether it starts with a word2vec header, and the embedding size
+    """
+    with open(str(glove_filepath), 'rb') as fp:
+        first = fp.readline()
+        num_lines = first.count(b'\n')
+        last = first[-1:]
+        for block in iter(lambda: fp.read(1 << 20), b''):
+            num_lines += block.count(b'\n')
+            last = block[-1:]
+    # The last line may not end with a new line
+    if last and last != b'\n':
+        num_lines += 1
+
+    fields = first.split()
+    has_header = len(fields) == 2 and all(field.isdigit() for field in fields)
+    embedding_size = int(fields[1]) if has_header else len(fields) - 1
+    return num_lines, has_header, embedding_size
+
+
+def _parse_lines(lines: List[bytes], embedding_size: int) -> Tuple[List[str], np.array]:
+    words, vectors = [], []
+    for line in lines:
+        word, _, vector = line.partition(b' ')
+        words.append(word)
+        vectors.append(vector)
+    try:
+        values = np.fromstring(b' '.join(vectors), dtype=np.float32, sep=' ')
+    except ValueError:
+        # Recent numpy versions raise instead of stopping at the first unparsable value
+        values = None
+
+    if values is None or values.size != len(lines) * embedding_size:
+        # Some words contain spaces (e.g. in glove.840B), split the vectors from the end of the lines instead
+        words, values = [], []
+        for line in lines:
+            fields = line.rstrip().rsplit(b' ', embedding_size)
+            if len(fields) != embedding_size + 1:
+                raise ValueError(f"Expected {embedding_size} values, got line {line[:100]!r}")
+            words.append(fields[0])
+            values.append(b' '.join(fields[1:]))
+        values = np.fromstring(b' '.join(values), dtype=np.float32, sep=' ')
+
+    return [word.decode('utf-8') for word in words], values.reshape(len(lines), embedding_size)
+
+
+def _temporary_path(path: Path) -> Path:
+    """
+    :return: a new empty file next to path, with a unique name so that concurrent writers never share it
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), prefix=f'.{path.name}.', suffix=f'.tmp{path.suffix}')
+    os.close(fd)
+    return Path(tmp_path)
+
+
+def _convert_embeddings(glove_filepath: Path, matrix_path: Path, words_path: Path):
+    """
+    Parse an embeddings text file directly into a `.npy` file, and write its words in the binary vocabulary format.
+    Files are written under unique temporary names and renamed when complete, so that concurrent loads never see partial
+    files. The words file, which holds the version of the embeddings file, is renamed last.
+    """
+    # Read before parsing, so that a file modified meanwhile is converted again by the next load
+    source = _source(glove_filepath)
+    matrix_path.parent.mkdir(parents=True, exist_ok=True)
+    logger.info("Converting embeddings %s to %s", glove_filepath, matrix_path)
+
+    tmp_paths = []
+    try:
+        tmp_matrix = _temporary_path(matrix_path)
+        tmp_paths.append(tmp_matrix)
+        matrices = []
+
+        def allocate(shape: Tuple[int, int]) -> np.array:
+            matrices.append(np.lib.format.open_memmap(str(tmp_matrix), mode='w+', dtype=np.float32, shape=shape))
+            return matrices[0]
+
+        words, embeddings = _parse_embeddings(glove_filepath, out_factory=allocate)
+        matrix = matrices.pop()
+        if len(words) < len(matrix):
+            # The file has blank lines, the matrix is smaller than allocated
+            trimmed = _temporary_path(matrix_path)
+            tmp_paths.append(trimmed)
+            np.save(str(trimmed), embeddings)
+            del matrix, embeddings
+            os.replace(str(trimmed), str(tmp_matrix))
+        else:
+            matrix.flush()
+            del matrix, embeddings
+
+        tmp_words = _temporary_path(words_path)
+        tmp_paths.append(tmp_words)
+        save_tokens(tmp_words, tokens=words, metadata=source)
+        os.replace(str(tmp_matrix), str(matrix_path))
+        os.replace(str(tmp_words), str(words_path))
+    finally:
+        for tmp_path in tmp_paths:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+
+def load_glove_for_vocabulary(glove_filepath: Path, words: Sequence[str],
+                              cache_dir: Union[Path, str] = None) -> Tuple[np.array, np.array]:
+    """
+    Load the pre-trained embeddings of a vocabulary only: the embeddings file is streamed, and only the lines of the
+    vocabulary words are parsed, straight into the final float32 matrix. Memory therefore depends on the size of the
+    vocabulary, not of the pre-trained embeddings. If `load_glove_from_file` has cached the embeddings, the rows are read
+    from the memory-mapped cache instead.
+
+    Words missing from the pre-trained embeddings are initialized randomly, as with `xavier_uniform_` on every row.
+
+    :param glove_filepath: the embeddings file, local or remote (see smart_open)
+    :param words: the vocabulary words, in id order. Words containing spaces are only found in the cache.
+    :param cache_dir: directory of the cache files, the directory of the embeddings file by default
+    :return: the embeddings of the words, and whether every word has been found in the pre-trained embeddings
+    """
+    cached = False
+    if cache_dir or not _is_remote(glove_filepath):
+        matrix_path, words_path = _cache_paths(glove_filepath, cache_dir)
+        cached = _has_cache(glove_filepath, matrix_path, words_path)
+    if cached:
+        w2i = MappedTokenIndex(MappedTokens(words_path))
+        glove_embeddings = np.load(str(matrix_path), mmap_mode='r')
+        rows = np.fromiter((w2i.get(word, -1) for word in words), dtype=np.int64, count=len(words))
+        found = rows >= 0
+        embeddings = np.empty((len(words), glove_embeddings.shape[1]), dtype=np.float32)
+        embeddings[found] = glove_embeddings[rows[found]]
+    else:
+        embeddings, found = _stream_embeddings(glove_filepath, words)
+
+    missing = ~found
+    embeddings[missing] = random_embeddings(int(missing.sum()), embeddings.shape[1])
+    logger.info("Found %d words out of %d in the pre-trained embeddings", int(found.sum()), len(words))
+    return embeddings, found
+
+
+def _stream_embeddings(glove_filepath: Path, words: Sequence[str]) -> Tuple[np.array, np.array]:
+    positions = {word.encode('utf-8'): index for index, word in enumerate(words)}
+    with open(str(glove_filepath), 'rb') as fp:
+        first = fp.readline()
+        fields = first.split()
+        has_header = len(fields) == 2 and all(field.isdigit() for field in fields)
+        embedding_size = int(fields[1]) if has_header else len(fields) - 1
+
+        embeddings = np.empty((len(words), embedding_size), dtype=np.float32)
+        found = np.zeros(len(words), dtype=bool)
+        lines = [] if has_header else [first]
+        while True:
+            lines.extend(islice(fp, CHUNK_LINES))
+            if not lines:
+                break
+            # Only the lines of the vocabulary words are parsed
+            kept = [line for line in lines if line.partition(b' ')[0] in positions]
+            if kept:
+                kept_words, vectors = _parse_lines(kept, embedding_size)
+                indices = [positions[word.encode('utf-8')] for word in kept_words]
+                embeddings[indices] = vectors
+                found[indices] = True
+            lines = []
+
+    return embeddings, found
+
+
+def random_embeddings(num_embeddings: int, embedding_size: int) -> np.array:
+    """
+    :return: randomly initialized embeddings, drawn as `xavier_uniform_` would draw every embedding separately
+    """
+    bound = (6 / (embedding_size + 1)) ** 0.5
+    return torch.empty(num_embeddings, embedding_size).uniform_(-bound, bound).numpy()
+
+
+def hashed_embeddings(vocabulary: HashingVocabulary, w2i: Mapping[str, int], embeddings: np.array) -> np.array:
+    """
+    Embeddings of a hashing vocabulary: every bucket gets the mean of the pre-trained embeddings of the words hashed
+    into it, special tokens and empty buckets are initialized randomly
+    :param vocabulary: the hashing vocabulary
+    :param w2i: index of every pre-trained word in embeddings
+    :param embeddings: the pre-trained embeddings
+    :return: the array of bucket embeddings, of size len(vocabulary) x embedding size
+    """
+    embedding_size = embeddings.shape[1]
+    words = sorted(w2i, key=w2i.get)
+    ids = vocabulary.hash_tokens(words)
+
+    sums = np.zeros((len(vocabulary), embedding_size), dtype=np.float32)
+    np.add.at(sums, ids, embeddings[[w2i[word] for word in words]])
+    counts = np.bincount(ids, minlength=len(vocabulary))
+
+    empty = counts == 0
+    final_embeddings = sums / np.maximum(counts, 1)[:, None]
+    final_embeddings[empty] = random_embeddings(int(empty.sum()), embedding_size)
+    return final_embeddings
+
+
+QUANTIZATIONS = ('int8', 'float16')
+
+
+def quantize_embeddings(embeddings: np.array, quantization: str) -> Tuple[np.array, np.array]:
+    """
+    Compress an embeddings matrix for storage
+    :param embeddings: the float embeddings
+    :param quantization: `int8`, symmetric quantization with one scale per row, or `float16`
+    :return: the quantized embeddings and their per-row scales (None for float16)
+    """
+    if quantization == 'float16':
+        return np.asarray(embeddings).astype(np.float16), None
+    if quantization != 'int8':
+        raise ValueError(f"Unknown quantization {quantization}, available quantizations: {QUANTIZATIONS}")
+
+    values = np.empty(embeddings.shape, dtype=np.int8)
+    scales = np.empty(len(embeddings), dtype=np.float32)
+    # By chunks, to avoid a float copy of the whole matrix
+    for start in range(0, len(embeddings), CHUNK_LINES):
+        chunk = np.asarray(embeddings[start:start + CHUNK_LINES], dtype=np.float32)
+        chunk_scales = np.abs(chunk).max(axis=1, initial=0) / 127
+        chunk_scales[chunk_scales == 0] = 1
+        values[start:start + CHUNK_LINES] = np.rint(chunk / chunk_scales[:, None])
+        scales[start:start + CHUNK_LINES] = chunk_scales
+    return values, scales
+
+
+class QuantizedEmbedding(torch.nn.Module):
+    """
+    Frozen embedding layer storing int8 or float16 embeddings, dequantized to float32 for the looked up tokens only.
+    It takes 4 (int8) or 2 (float16) times less memory than a `torch.nn.Embedding`, e.g. to serve models with large
+    pre-trained vocabularies.
+
+    Float weights loaded from a state dict, e.g. the checkpoint of a model trained with a `torch.nn.Embedding`, are
+    quantized on the fly.
+    """
+
+    def __init__(self, embeddings: np.array, quantization: str = 'int8', padding_idx: int = None):
+        """
+        :param embeddings: the float embeddings
+        :param quantization: `int8` or `float16`
+        :param padding_idx: index of the padding embedding, which is set to zeros
+        """
+        super().__init__()
+        values, scales = quantize_embeddings(embeddings, quantization)
+        self.num_embeddings, self.embedding_dim = values.shape
+        if padding_idx is not None:
+            if not -self.num_embeddings <= padding_idx < self.num_embeddings:
+                raise ValueError(f"padding_idx {padding_idx} out of range for {self.num_embeddings} embeddings")
+            padding_idx %= self.num_embeddings
+            values[padding_idx] = 0
+        self.quantization: str = quantization
+        self.padding_idx: int = padding_idx
+        self.register_buffer('weight', torch.from_numpy(values))
+        self.register_buffer('scales', torch.from_numpy(scales) if scales is not None else None)
+
+    @classmethod
+    def from_embedding(cls, module: torch.nn.Embedding, quantization: str = 'int8') -> 'QuantizedEmbedding':
+        """
+        :param module: a trained embedding layer
+        :param quantization: `int8` or `float16`
+        :return: the quantized embedding layer
+        """
+        return cls(embeddings=module.weight.detach().cpu().numpy(), quantization=quantization,
+                   padding_idx=module.padding_idx)
+
+    def _load_from_state_dict(self, state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys,
+                              error_msgs):
+        weight = state_dict.get(prefix + 'weight')
+        if isinstance(weight, torch.Tensor) and weight.is_floating_point() and weight.dtype != self.weight.dtype:
+            values, scales = quantize_embeddings(weight.detach().cpu().float().numpy(), self.quantization)
+            if self.padding_idx is not None:
+                values[self.padding_idx] = 0
+            state_dict[prefix + 'weight'] = torch.from_numpy(values)
+            if scales is not None:
+                state_dict[prefix + 'scales'] = torch.from_numpy(scales)
+        super()._load_from_state_dict(state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys,
+                                      error_msgs)
+
+    def forward(self, x_in: torch.Tensor) -> torch.Tensor:
+        embedded = torch.nn.functional.embedding(x_in, self.weight).float()
+        if self.scales is not None:
+            embedded = embedded * self.scales[x_in].unsqueeze(-1)
+        return embedded
+
+    def extra_repr(self) -> str:
+        padding = f', padding_idx={self.padding_idx}' if self.padding_idx is not None else ''
+        return f'{self.num_embeddings}, {self.embedding_dim}{padding}, quantization={self.quantization}'
 
 
 @register_plugin
@@ -44,24 +424,93 @@ class EmbeddingsHyperParams(ObjectHyperParams):
         self.words = dataset_splits.vectorizer.data_vocab._token2id.keys()
 
 
+# Embeddings loaded by `Embedding`, by embeddings file (path, modification time and size) and vocabulary fingerprint
+_EMBEDDINGS_CACHE: Dict[Tuple[str, Tuple[int, int], str], np.array] = {}
+
+
+def _embeddings_key(glove_filepath: Union[Path, str], vocabulary: Vocabulary) -> Tuple[str, Tuple[int, int], str]:
+    path = Path(str(glove_filepath)).expanduser()
+    version = None
+    if path.exists():
+        path = path.resolve()
+        stat = path.stat()
+        version = (stat.st_mtime_ns, stat.st_size)
+
+    digest = hashlib.sha1(vocabulary.__class__.__name__.encode('utf-8'))
+    if isinstance(vocabulary, HashingVocabulary):
+        digest.update(f'{vocabulary.num_buckets} {vocabulary.seed}'.encode('utf-8'))
+    for token in vocabulary._id2token:
+        digest.update(token.encode('utf-8'))
+        digest.update(b'\0')
+    return str(path), version, digest.hexdigest()
+
+
+def clear_embeddings_cache():
+    """
+    Release the embeddings cached by `Embedding`
+    """
+    _EMBEDDINGS_CACHE.clear()
+
+
 @register_plugin
 class Embedding:
+    """
+    Pre-trained embeddings of the data vocabulary of a dataset. Embeddings are loaded once per process for a given
+    embeddings file and vocabulary, so models and experiments using the same ones share a single read-only matrix.
+    Trainable embedding layers get their own copy, frozen ones (`to_module(freeze=True)`) use the shared matrix. Call
+    `clear_embeddings_cache` once trainable models are built to release the cached matrix.
+
+    Usage in an experiment file, to share the embeddings between models:
+
+        "embedding": {"_name": "Embedding", "glove_filepath": "$HOME/glove/glove.6B.100d.txt", "data": "$my_dataset"},
+        "model": {"_name": "NewsClassifier", "embeddings": "$embedding", ...}
+    """
 
     def __init__(self, glove_filepath: Union[Path, str], data: DatasetSplits):
 
-        words = data.vectorizer.data_vocab._token2id.keys()
+        vocabulary = data.vectorizer.data_vocab
+        key = _embeddings_key(glove_filepath, vocabulary)
+        embeddings = _EMBEDDINGS_CACHE.get(key)
 
-        w2i, glove_embeddings = load_glove_from_file(glove_filepath=glove_filepath)
-        embedding_size = glove_embeddings.shape[1]
+        if embeddings is not None:
+            logger.info("Using already loaded embeddings %s", glove_filepath)
+        elif isinstance(vocabulary, HashingVocabulary):
+            # Every pre-trained word contributes to the embedding of its bucket
+            w2i, glove_embeddings = load_glove_from_file(glove_filepath=glove_filepath)
+            embeddings = hashed_embeddings(vocabulary=vocabulary, w2i=w2i, embeddings=glove_embeddings)
+        else:
+            embeddings, _ = load_glove_for_vocabulary(glove_filepath=glove_filepath, words=vocabulary._id2token)
 
-        final_embeddings = np.zeros((len(words), embedding_size))
+        # float32, so that frozen embedding layers can use the matrix without copying it
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        embeddings.setflags(write=False)
+        _EMBEDDINGS_CACHE[key] = embeddings
+        self.embeddings: np.array = embeddings
 
-        for i, word in tqdm(enumerate(words), total=len(words), desc='Loading pre-trained word embeddings'):
-            if word in w2i:
-                final_embeddings[i, :] = glove_embeddings[w2i[word]]
-            else:
-                embedding_i = torch.ones(1, embedding_size)
-                torch.nn.init.xavier_uniform_(embedding_i)
-                final_embeddings[i, :] = embedding_i
+    def to_tensor(self, share: bool = False) -> torch.Tensor:
+        """
+        :param share: return a tensor using the shared read-only matrix instead of a copy. It must never be modified in
+        place, e.g. only used by a frozen layer.
+        :return: a float32 copy of the embeddings, e.g. to initialize a trainable embedding layer
+        """
+        if not share:
+            return torch.tensor(self.embeddings, dtype=torch.float32)
+        with warnings.catch_warnings():
+            # torch warns that it doesn't support read-only arrays, the tensor is not written to
+            warnings.simplefilter('ignore', UserWarning)
+            return torch.from_numpy(self.embeddings)
 
-        self.embeddings = final_embeddings
+    def to_module(self, padding_idx: int = None, quantization: str = None, freeze: bool = False) -> torch.nn.Module:
+        """
+        :param padding_idx: padding index of the embedding layer
+        :param quantization: None for a `torch.nn.Embedding`, `int8` or `float16` for a frozen `QuantizedEmbedding`
+        :param freeze: freeze the `torch.nn.Embedding`, which then uses the shared matrix instead of a copy
+        :return: an embedding layer initialized with the embeddings
+        """
+        if quantization:
+            return QuantizedEmbedding(embeddings=self.embeddings, quantization=quantization, padding_idx=padding_idx)
+        if freeze:
+            return torch.nn.Embedding.from_pretrained(self.to_tensor(share=True), freeze=True, padding_idx=padding_idx)
+        weight = self.to_tensor()
+        return torch.nn.Embedding(num_embeddings=weight.shape[0], embedding_dim=weight.shape[1],
+                                  padding_idx=padding_idx, _weight=weight)
@@ -0,0 +1,174 @@
+"""
+Export of embeddings to the TensorBoard projector.
+
+The embeddings and their metadata are written in bulk, in a background thread, in the layout of
+`SummaryWriter.add_embedding`: `<log_dir>/<step>/<tag>/tensors.tsv` and `metadata.tsv`, registered in
+`<log_dir>/projector_config.pbtxt`. Huge vocabularies can be subsampled.
+
+Usage:
+
+    exporter = EmbeddingExporter(log_dir='runs/news', max_points=50000)
+    exporter.export(embeddings=model.emb.weight, tokens=vocabulary, tag='emb', global_step=10)
+    exporter.close()  # wait for the pending exports
+
+The errors of the exports are logged as soon as they happen, exports still pending when the interpreter exits are
+waited for.
+"""
+import atexit
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Sequence, Union
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+SAMPLINGS = ('top', 'random')
+FORMATS = ('tsv', 'bytes')
+
+# Number of rows written at once
+CHUNK_ROWS = 10000
+
+
+def _log_error(future: Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Could not export the embeddings to Tensorboard", exc_info=future.exception())
+
+
+class EmbeddingExporter:
+    """
+    Write embeddings for the TensorBoard projector without blocking the caller
+    """
+
+    def __init__(self, log_dir: Union[str, Path], max_points: int = None, sampling: str = 'top', format: str = 'tsv',
+                 seed: int = 0):
+        """
+        :param log_dir: the TensorBoard log directory
+        :param max_points: maximum number of embeddings exported, all of them by default
+        :param sampling: how embeddings are selected when there are more than max_points: `top` keeps the most
+        frequent tokens (the first ones of a vocabulary built by frequency, unless counts are given), `random` draws
+        them uniformly
+        :param format: `tsv`, the text format of `SummaryWriter.add_embedding`, or `bytes`, raw float32 values with
+        their shape in the projector config
+        :param seed: seed of the random sampling
+        """
+        if sampling not in SAMPLINGS:
+            raise ValueError(f"Unknown sampling {sampling}, available samplings: {SAMPLINGS}")
+        if format not in FORMATS:
+            raise ValueError(f"Unknown format {format}, available formats: {FORMATS}")
+        self.log_dir: Path = Path(log_dir)
+        self.max_points: int = max_points
+        self.sampling: str = sampling
+        self.format: str = format
+        self.seed: int = seed
+
+        self._executor: ThreadPoolExecutor = None
+        self._config_lock: threading.Lock = threading.Lock()
+        self._pending: List[Future] = []
+
+    def select(self, num_embeddings: int, counts: Sequence[int] = None) -> np.ndarray:
+        """
+        :param num_embeddings: number of embeddings
+        :param counts: frequency of every token, used by the `top` sampling
+        :return: the sorted indices of the exported embeddings
+        """
+        if not self.max_points or num_embeddings <= self.max_points:
+            return np.arange(num_embeddings)
+        if self.sampling == 'random':
+            indices = np.random.RandomState(self.seed).choice(num_embeddings, self.max_points, replace=False)
+        elif counts is not None:
+            indices = np.argpartition(-np.asarray(counts), self.max_points - 1)[:self.max_points]
+        else:
+            indices = np.arange(self.max_points)
+        return np.sort(indices)
+
+    def export(self, embeddings: Union[np.ndarray, torch.Tensor], tokens: Sequence[str], tag: str = 'default',
+               global_step: int = 0, counts: Sequence[int] = None) -> Future:
+        """
+        Snapshot the selected embeddings and write them in the background
+        :param embeddings: the (num_embeddings, size) matrix
+        :param tokens: the token of every embedding, e.g. a vocabulary `_id2token`
+        :param tag: name of the embeddings in the projector
+        :param global_step: training step of the embeddings
+        :param counts: frequency of every token, used by the `top` sampling
+        :return: a future, done when the files are written, its error is also logged
+        """
+        indices = self.select(len(embeddings), counts=counts)
+        if isinstance(embeddings, torch.Tensor):
+            embeddings = embeddings.detach()
+            matrix = embeddings[torch.from_numpy(indices).to(embeddings.device)].cpu().float().numpy()
+        else:
+            matrix = np.asarray(embeddings)[indices].astype(np.float32)
+        if len(indices) == len(tokens):
+            metadata = list(tokens)
+        else:
+            metadata = [tokens[index] for index in indices.tolist()]
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='embedding-export')
+            atexit.register(self._close_at_exit)
+        future = self._executor.submit(self._write, matrix, metadata, tag, global_step)
+        future.add_done_callback(_log_error)
+        self._pending.append(future)
+        return future
+
+    def _write(self, matrix: np.ndarray, metadata: List[str], tag: str, global_step: int):
+        subdir = Path(str(global_step).zfill(5)) / tag
+        directory = self.log_dir / subdir
+        directory.mkdir(parents=True, exist_ok=True)
+
+        text = '\n'.join(map(str, metadata))
+        if text.count('\n') != len(metadata) - 1:
+            text = '\n'.join(str(token).replace('\n', ' ') for token in metadata)
+        (directory / 'metadata.tsv').write_text(text + '\n', encoding='utf-8')
+
+        if self.format == 'tsv':
+            tensor_file = 'tensors.tsv'
+            with open(directory / tensor_file, 'wb') as f:
+                for start in range(0, len(matrix), CHUNK_ROWS):
+                    np.savetxt(f, matrix[start:start + CHUNK_ROWS], fmt='%.6g', delimiter='\t')
+            shape = ''
+        else:
+            tensor_file = 'tensors.bytes'
+            matrix.astype('<f4').tofile(str(directory / tensor_file))
+            shape = ''.join(f'  tensor_shape: {size}\n' for size in matrix.shape)
+
+        entry = (f'embeddings {{\n'
+                 f'  tensor_name: "{tag}:{str(global_step).zfill(5)}"\n'
+                 f'  tensor_path: "{(subdir / tensor_file).as_posix()}"\n'
+                 f'  metadata_path: "{(subdir / "metadata.tsv").as_posix()}"\n'
+                 f'{shape}'
+                 f'}}\n\n')
+        with self._config_lock, open(self.log_dir / 'projector_config.pbtxt', 'a', encoding='utf-8') as f:
+            f.write(entry)
+        logger.info(f"Exported {len(matrix)} embeddings ({tag}) to {directory}")
+
+    def wait(self):
+        """
+        Wait for the pending exports, raising their errors
+        """
+        pending, self._pending = self._pending, []
+        for future in pending:
+            future.result()
+
+    def close(self):
+        """
+        Wait for the pending exports and stop the background thread, raising the errors of the exports. The exporter
+        can still be used, a new thread is started by the next export.
+        """
+        try:
+            self.wait()
+        finally:
+            if self._executor is not None:
+                atexit.unregister(self._close_at_exit)
+                self._executor.shutdown()
+                self._executor = None
+
+    def _close_at_exit(self):
+        try:
+            self.close()
+        except Exception:
+            logger.debug("Embeddings export failed, see the error logged above")
@@ -0,0 +1,285 @@
+"""
+Nearest neighbour search over embedding matrices.
+
+`ExactIndex` compares the queries with every vector at once (one matrix multiply and a partial sort per chunk of
+queries), `IVFIndex` is an approximate inverted file index for large vocabularies: vectors are clustered with k-means
+and a query is only compared with the vectors of its closest clusters.
+
+Usage:
+
+    index = IVFIndex(num_lists=1024).build(embeddings)
+    index.save('embeddings.ivf.npz')
+    distances, indices = IVFIndex.load('embeddings.ivf.npz').search(queries, k=10)
+    evaluate_index(index, ExactIndex(embeddings), queries, k=10)  # recall and latency against the exact search
+"""
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Dict, Tuple, Union
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+METRICS = ('euclidean', 'cosine')
+
+# Size of the distance matrix computed at once (number of floats)
+CHUNK_SIZE = 2 ** 24
+
+
+def _as_matrix(vectors: Union[np.ndarray, torch.Tensor]) -> np.ndarray:
+    if isinstance(vectors, torch.Tensor):
+        vectors = vectors.detach().cpu().numpy()
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    return vectors
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _distances(queries: np.ndarray, vectors: np.ndarray, metric: str, squared_norms: np.ndarray = None) -> np.ndarray:
+    """
+    Distance matrix between the queries and the vectors. Vectors and queries are expected to be normalized for the
+    cosine metric.
+    """
+    products = queries @ vectors.T
+    if metric == 'cosine':
+        return 1. - products
+    if squared_norms is None:
+        squared_norms = np.einsum('ij,ij->i', vectors, vectors)
+    squared = np.einsum('ij,ij->i', queries, queries)[:, None] - 2 * products + squared_norms[None, :]
+    return np.sqrt(np.maximum(squared, 0.))
+
+
+def _top_k(distances: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Indices and values of the k smallest distances of every row, sorted
+    """
+    k = min(k, distances.shape[1])
+    if k < distances.shape[1]:
+        indices = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    else:
+        indices = np.tile(np.arange(distances.shape[1]), (len(distances), 1))
+    values = np.take_along_axis(distances, indices, axis=1)
+    order = np.argsort(values, axis=1, kind='stable')
+    return np.take_along_axis(values, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+
+def _check_metric(metric: str):
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric {metric}, available metrics: {METRICS}")
+
+
+class ExactIndex:
+    """
+    Brute force nearest neighbour search
+    """
+
+    def __init__(self, embeddings: Union[np.ndarray, torch.Tensor], metric: str = 'euclidean'):
+        """
+        :param embeddings: the (num_vectors, size) matrix to search into
+        :param metric: `euclidean` or `cosine` (1 - cosine similarity)
+        """
+        _check_metric(metric)
+        self.metric: str = metric
+        self.vectors: np.ndarray = _as_matrix(embeddings)
+        if metric == 'cosine':
+            self.vectors = _normalize(self.vectors)
+        self.squared_norms: np.ndarray = np.einsum('ij,ij->i', self.vectors, self.vectors)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def search(self, queries: Union[np.ndarray, torch.Tensor], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param queries: a (num_queries, size) matrix, or a single vector
+        :param k: number of neighbours
+        :return: the (num_queries, k) distances and indices of the closest vectors, closest first
+        """
+        queries = _as_matrix(queries)
+        if self.metric == 'cosine':
+            queries = _normalize(queries)
+        k = min(k, len(self))
+        all_distances = np.empty((len(queries), k), dtype=np.float32)
+        all_indices = np.empty((len(queries), k), dtype=np.int64)
+
+        step = max(1, CHUNK_SIZE // max(len(self), 1))
+        for start in range(0, len(queries), step):
+            distances = _distances(queries[start:start + step], self.vectors, self.metric, self.squared_norms)
+            all_distances[start:start + step], all_indices[start:start + step] = _top_k(distances, k)
+        return all_distances, all_indices
+
+
+class IVFIndex:
+    """
+    Approximate nearest neighbour search with an inverted file index.
+
+    The vectors are clustered into `num_lists` lists with k-means, and a query is compared with the vectors of its
+    `num_probes` closest lists only. More probes give a better recall for a slower search.
+    """
+
+    def __init__(self, num_lists: int = 256, num_probes: int = 8, metric: str = 'euclidean',
+                 num_iterations: int = 10, seed: int = 0):
+        """
+        :param num_lists: number of k-means clusters, around sqrt(num_vectors) is a good start
+        :param num_probes: default number of lists searched per query
+        :param metric: `euclidean` or `cosine` (1 - cosine similarity)
+        :param num_iterations: k-means iterations
+        :param seed: seed of the k-means initialization and sampling
+        """
+        _check_metric(metric)
+        self.num_lists: int = num_lists
+        self.num_probes: int = num_probes
+        self.metric: str = metric
+        self.num_iterations: int = num_iterations
+        self.seed: int = seed
+
+        self.centroids: np.ndarray = None
+        # Vectors sorted by list, their original indices and the start of every list
+        self.vectors: np.ndarray = None
+        self.ids: np.ndarray = None
+        self.offsets: np.ndarray = None
+        self.squared_norms: np.ndarray = None
+
+    def __len__(self):
+        return 0 if self.ids is None else len(self.ids)
+
+    def build(self, embeddings: Union[np.ndarray, torch.Tensor], sample_size: int = None) -> 'IVFIndex':
+        """
+        Cluster the vectors and fill the lists
+        :param embeddings: the (num_vectors, size) matrix to index
+        :param sample_size: number of vectors the k-means is trained on, 256 per list by default
+        :return: the index itself
+        """
+        vectors = _as_matrix(embeddings)
+        if self.metric == 'cosine':
+            vectors = _normalize(vectors)
+        self.num_lists = min(self.num_lists, len(vectors))
+        rng = np.random.RandomState(self.seed)
+
+        sample_size = min(len(vectors), sample_size or 256 * self.num_lists)
+        sample = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+        self.centroids = self._kmeans(sample, rng)
+
+        assignments = self._assign(vectors)
+        order = np.argsort(assignments, kind='stable')
+        self.ids = order.astype(np.int64)
+        self.vectors = vectors[order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=self.num_lists))])
+        self.squared_norms = np.einsum('ij,ij->i', self.vectors, self.vectors)
+        return self
+
+    def _kmeans(self, sample: np.ndarray, rng: np.random.RandomState) -> np.ndarray:
+        centroids = sample[rng.choice(len(sample), self.num_lists, replace=False)].copy()
+        for _ in range(self.num_iterations):
+            self.centroids = centroids
+            assignments = self._assign(sample)
+            counts = np.bincount(assignments, minlength=self.num_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+            # Restart the empty clusters from random vectors
+            empty = np.flatnonzero(~filled)
+            if len(empty):
+                centroids[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+            if self.metric == 'cosine':
+                centroids = _normalize(centroids)
+        return centroids
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        squared_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        step = max(1, CHUNK_SIZE // self.num_lists)
+        return np.concatenate([
+            _distances(vectors[start:start + step], self.centroids, self.metric, squared_norms).argmin(axis=1)
+            for start in range(0, len(vectors), step)])
+
+    def search(self, queries: Union[np.ndarray, torch.Tensor], k: int,
+               num_probes: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param queries: a (num_queries, size) matrix, or a single vector
+        :param k: number of neighbours
+        :param num_probes: number of lists searched per query, `self.num_probes` by default
+        :return: the (num_queries, k) distances and indices of the closest vectors, closest first. When the probed
+        lists hold less than k vectors, the missing neighbours have an infinite distance and a -1 index.
+        """
+        if self.centroids is None:
+            raise ValueError("The index must be built or loaded before searching")
+        queries = _as_matrix(queries)
+        if self.metric == 'cosine':
+            queries = _normalize(queries)
+        num_probes = min(num_probes or self.num_probes, self.num_lists)
+
+        all_distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        all_indices = np.full((len(queries), k), -1, dtype=np.int64)
+        _, probes = _top_k(_distances(queries, self.centroids, self.metric), num_probes)
+        for row, (query, lists) in enumerate(zip(queries, probes)):
+            candidates = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in lists])
+            if not len(candidates):
+                continue
+            distances = _distances(query[None, :], self.vectors[candidates], self.metric, self.squared_norms[candidates])
+            distances, positions = _top_k(distances, k)
+            found = positions.shape[1]
+            all_distances[row, :found] = distances[0]
+            all_indices[row, :found] = self.ids[candidates[positions[0]]]
+        return all_distances, all_indices
+
+    def save(self, path: Union[str, Path]):
+        """
+        Persist the index in a numpy `.npz` archive
+        """
+        if self.centroids is None:
+            raise ValueError("The index must be built before saving")
+        params = {'num_lists': self.num_lists, 'num_probes': self.num_probes, 'metric': self.metric,
+                  'num_iterations': self.num_iterations, 'seed': self.seed}
+        with open(path, 'wb') as f:
+            np.savez(f, params=np.array(json.dumps(params)), centroids=self.centroids, vectors=self.vectors,
+                     ids=self.ids, offsets=self.offsets)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> 'IVFIndex':
+        with np.load(path, allow_pickle=False) as archive:
+            index = cls(**json.loads(str(archive['params'])))
+            index.centroids = archive['centroids']
+            index.vectors = archive['vectors']
+            index.ids = archive['ids']
+            index.offsets = archive['offsets']
+        index.squared_norms = np.einsum('ij,ij->i', index.vectors, index.vectors)
+        return index
+
+
+def evaluate_index(index, reference: ExactIndex, queries: Union[np.ndarray, torch.Tensor], k: int = 10,
+                   **search_kwargs) -> Dict[str, float]:
+    """
+    Benchmark an approximate index against the exact search
+    :param index: the index to evaluate
+    :param reference: the exact index over the same vectors
+    :param queries: the query vectors
+    :param k: number of neighbours
+    :param search_kwargs: extra arguments of `index.search`, e.g. `num_probes`
+    :return: the recall@k of the index, and the latency per query (in ms) of both searches
+    """
+    queries = _as_matrix(queries)
+
+    start = time.perf_counter()
+    _, expected = reference.search(queries, k)
+    reference_latency = 1000 * (time.perf_counter() - start) / len(queries)
+
+    start = time.perf_counter()
+    _, found = index.search(queries, k, **search_kwargs)
+    latency = 1000 * (time.perf_counter() - start) / len(queries)
+
+    hits = sum(len(np.intersect1d(e, f[f >= 0])) for e, f in zip(expected, found))
+    results = {
+        'recall': hits / expected.size,
+        'latency_ms': latency,
+        'exact_latency_ms': reference_latency}
+    logger.info("recall@%d: %.3f, %.3fms per query (exact search: %.3fms)", k, results['recall'], latency,
+                reference_latency)
+    return results
@@ -1,7 +1,9 @@
-from typing import Dict, List, Tuple
+from typing import Dict, List, Mapping, Sequence, Tuple, Union
 
 import torch
 
+from transfer_nlp.embeddings.search import ExactIndex, IVFIndex
+
 
 def pretty_print(results: List[Tuple[str, torch.Tensor]]):
     """
@@ -11,20 +13,56 @@ def pretty_print(results: List[Tuple[str, torch.Tensor]]):
         print("...[%.2f] - %s" % (item[1], item[0]))
 
 
-def get_closest(target_word: str, word_to_idx: Dict, embeddings: torch.Tensor, n: int = 5) -> List[Tuple[str, torch.Tensor]]:
+def get_closest_batch(target_words: Sequence[str], word_to_idx: Dict, embeddings: torch.Tensor, n: int = 5,
+                      index: Union[ExactIndex, IVFIndex] = None, exclude: Sequence[str] = ("<MASK>",),
+                      index_to_word: Mapping[int, str] = None) -> List[List[Tuple[str, float]]]:
     """
-    Get the n closest
-    words to your word.
+    Get the n closest words to every target word, in a single search. Target words are lower cased.
+    :param index: an index over the embeddings matrix, e.g. an approximate `IVFIndex` for large vocabularies. An
+    exact euclidean search is run by default.
+    :param exclude: words never returned, in any case, besides the target word itself
+    :param index_to_word: the inverse of word_to_idx, computed by every call by default. Pass it to search the same
+    vocabulary repeatedly.
+    :return: the (word, distance) pairs of every target word, closest first
     """
+    excluded = {*exclude, *(word.lower() for word in exclude)}
+    queries = [word.lower() for word in target_words]
+    return _search(queries=queries, excluded=[{word, *excluded} for word in queries], word_to_idx=word_to_idx,
+                   embeddings=embeddings, n=n, index=index, index_to_word=index_to_word)
 
-    # Calculate distances to all other words
 
-    word_embedding = embeddings[word_to_idx[target_word.lower()]]
-    distances = []
-    for word, index in word_to_idx.items():
-        if word == "<MASK>" or word == target_word:
-            continue
-        distances.append((word, torch.dist(word_embedding, embeddings[index])))
+def _search(queries: List[str], excluded: List[Sequence[str]], word_to_idx: Dict, embeddings: torch.Tensor, n: int,
+            index: Union[ExactIndex, IVFIndex],
+            index_to_word: Mapping[int, str] = None) -> List[List[Tuple[str, float]]]:
+    if index is None:
+        index = ExactIndex(embeddings)
+    if index_to_word is None:
+        index_to_word = {idx: word for word, idx in word_to_idx.items()}
+    # Ask for enough neighbours to fill n results once the excluded and unknown rows are removed
+    k = n + max(len(words) for words in excluded) + max(len(index) - len(index_to_word), 0)
+    distances, indices = index.search(embeddings[[word_to_idx[word] for word in queries]], k)
 
-    results = sorted(distances, key=lambda x: x[1])[1:n + 2]
+    results = []
+    for row_distances, row_indices, words in zip(distances.tolist(), indices.tolist(), excluded):
+        neighbours = []
+        for distance, idx in zip(row_distances, row_indices):
+            word = index_to_word.get(idx)
+            if word is None or word in words:
+                continue
+            neighbours.append((word, distance))
+            if len(neighbours) == n:
+                break
+        results.append(neighbours)
     return results
+
+
+def get_closest(target_word: str, word_to_idx: Dict, embeddings: torch.Tensor, n: int = 5) -> List[Tuple[str, torch.Tensor]]:
+    """
+    Get the n closest
+    words to your word.
+    """
+
+    # The closest word is skipped and n + 1 words are returned, as the original implementation did
+    results = _search(queries=[target_word.lower()], excluded=[["<MASK>", target_word]],
+                      word_to_idx=word_to_idx, embeddings=embeddings, n=n + 2, index=None)[0]
+    return [(word, torch.tensor(distance)) for word, distance in results[1:n + 2]]
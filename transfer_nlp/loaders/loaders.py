@@ -1,11 +1,21 @@
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Tuple, Union
+
+import torch
 from torch.utils.data import Dataset, DataLoader
+from torch.utils.data.dataloader import default_collate
 
 
 class DatasetSplits:
     def __init__(self,
                  train_set: Dataset, train_batch_size: int,
                  val_set: Dataset, val_batch_size: int,
-                 test_set: Dataset = None, test_batch_size: int = None):
+                 test_set: Dataset = None, test_batch_size: int = None,
+                 collate_fn: Callable = None):
+        """
+        :param collate_fn: merges examples into batches, e.g. `bag_collate` for sparse examples. Must be picklable to be
+        used with data loader workers. Default collate of the data loaders by default.
+        """
         self.train_set: Dataset = train_set
         self.train_batch_size: int = train_batch_size
 
@@ -15,14 +25,94 @@ class DatasetSplits:
         self.test_set: Dataset = test_set
         self.test_batch_size: int = test_batch_size
 
+        self.collate_fn: Callable = collate_fn
+
     def train_data_loader(self):
-        return DataLoader(self.train_set, self.train_batch_size, shuffle=True)
+        return DataLoader(self.train_set, self.train_batch_size, shuffle=True, collate_fn=self.collate_fn)
 
     def val_data_loader(self):
-        return DataLoader(self.val_set, self.val_batch_size, shuffle=False)
+        return DataLoader(self.val_set, self.val_batch_size, shuffle=False, collate_fn=self.collate_fn)
 
     def test_data_loader(self):
-        return DataLoader(self.test_set, self.test_batch_size, shuffle=False)
+        return DataLoader(self.test_set, self.test_batch_size, shuffle=False, collate_fn=self.collate_fn)
+
+
+def bag_collate(batch: List[Dict[str, Any]], bag_keys: Iterable[str] = ('x_in',)) -> Dict[str, Any]:
+    """
+    Collate examples whose `bag_keys` entries are variable length arrays of indices, e.g. multi-hot encodings stored as
+    the indices of their ones, into the flat indices and offsets used by `torch.nn.EmbeddingBag`: `batch[key]` is the
+    concatenation of the indices of all examples and `batch[key + '_offsets']` the start of every example in it.
+    Other entries are collated as usual.
+    :param batch: the examples
+    :param bag_keys: the entries holding indices
+    :return: the batch
+    """
+    bag_keys = set(bag_keys)
+    collated = default_collate([{key: value for key, value in example.items() if key not in bag_keys} for example in batch])
+    for key in bag_keys:
+        bags = [torch.as_tensor(example[key], dtype=torch.long) for example in batch]
+        lengths = torch.tensor([len(bag) for bag in bags], dtype=torch.long)
+        collated[key] = torch.cat(bags)
+        collated[f'{key}_offsets'] = torch.cumsum(lengths, dim=0) - lengths
+    return collated
+
+
+# Parsed csv files by path: (file modification time and size, parsed columns or None for all columns, dtypes of the
+# parsed columns, parsed dataframe)
+_CSV_CACHE: Dict[str, Tuple[Tuple[int, int], List[str], Dict[str, Any], Any]] = {}
+
+
+# To use this function you will need to manually install pandas
+def read_csv_cached(data_file: Union[str, Path], usecols: List[str] = None, dtype: Dict[str, Any] = None):
+    """
+    Memoized `pandas.read_csv`: a csv file used by several objects of an experiment, typically a vectorizer and a dataset,
+    is only parsed once. The cache is invalidated when the file changes.
+
+    To parse each file once, objects reading the same file should ask for the same columns and dtypes: if a column is
+    missing from the cached dataframe, or was parsed with another dtype, the file is parsed again with the union of
+    the columns and dtypes, the last dtype of a column taking precedence.
+
+    The returned dataframe shares its data with the cache: columns can be added or replaced (`df['x_in'] = ...`), but
+    values must not be modified in place (`df.loc[...] = ...`, `inplace=True`, ...) unless the dataframe is copied first
+    or pandas copy-on-write mode is enabled, which is the default from pandas 3.
+
+    :param data_file: the csv file
+    :param usecols: the columns to parse, all of them by default
+    :param dtype: dtypes of the columns, avoiding type inference, e.g. {'surname': str}
+    :return: a dataframe to which columns can be added without affecting the cache
+    """
+    import pandas as pd
+
+    path = Path(str(data_file)).expanduser().resolve()
+    stat = path.stat()
+    version = (stat.st_mtime_ns, stat.st_size)
+    dtype = dict(dtype or {})
+
+    cached_version, cached_columns, cached_dtype, df = _CSV_CACHE.get(str(path), (None, None, {}, None))
+    hit = (cached_version == version
+           and (cached_columns is None or (usecols is not None and set(usecols).issubset(cached_columns)))
+           and all(column in cached_dtype and cached_dtype[column] == value for column, value in dtype.items()))
+    if not hit:
+        columns = usecols
+        if cached_version == version:
+            if cached_columns is None or usecols is None:
+                columns = None
+            else:
+                columns = list(dict.fromkeys(list(cached_columns) + list(usecols)))
+            dtype = {**cached_dtype, **dtype}
+        df = pd.read_csv(path, usecols=columns, dtype=dtype or None)
+        _CSV_CACHE[str(path)] = version, columns, dtype, df
+
+    if usecols is not None:
+        return df[list(usecols)].copy(deep=False)
+    return df.copy(deep=False)
+
+
+def clear_csv_cache():
+    """
+    Release the dataframes cached by `read_csv_cached`
+    """
+    _CSV_CACHE.clear()
 
 
 # To use this class you will need to manually install pandas
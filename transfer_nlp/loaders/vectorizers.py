@@ -1,3 +1,12 @@
+import pickle
+from functools import lru_cache
+from pathlib import Path
+from typing import Union
+
+from transfer_nlp.loaders.vocabulary import Vocabulary
+from transfer_nlp.plugins.config import register_plugin
+
+
 class Vectorizer:
 
     def __init__(self, data_file: str):
@@ -5,3 +14,136 @@ class Vectorizer:
 
     def vectorize(self, input_string: str):
         raise NotImplementedError
+
+    def save(self, directory: Union[str, Path]):
+        """
+        Save the vectorizer: vocabularies are written in the binary vocabulary format, the rest of the state is pickled
+        :param directory: the directory in which to save the vectorizer, created if needed
+        """
+        directory = Path(str(directory))
+        directory.mkdir(parents=True, exist_ok=True)
+
+        state = {}
+        vocabularies = {}
+        for name, value in vars(self).items():
+            if isinstance(value, Vocabulary):
+                # Vocabularies shared between attributes (e.g. data and target vocabularies) are saved once
+                if id(value) not in vocabularies:
+                    vocabularies[id(value)] = name
+                    value.save(directory / f'{name}.vocab')
+                state[name] = _VocabularyFile(vocabularies[id(value)])
+            else:
+                state[name] = value
+
+        with (directory / 'vectorizer.pkl').open('wb') as f:
+            pickle.dump((self.__class__, state), f)
+
+    @classmethod
+    def load(cls, directory: Union[str, Path]) -> 'Vectorizer':
+        """
+        Load a vectorizer saved with `save`, without reading the data file again
+        :param directory: the directory in which the vectorizer has been saved
+        :return: the vectorizer
+        """
+        directory = Path(str(directory))
+        with (directory / 'vectorizer.pkl').open('rb') as f:
+            klass, state = pickle.load(f)
+        if not issubclass(klass, cls):
+            raise ValueError(f"{directory} contains a {klass.__name__}, which is not a {cls.__name__}")
+
+        vocabularies = {}
+        for name, value in state.items():
+            if isinstance(value, _VocabularyFile):
+                if value.name not in vocabularies:
+                    vocabularies[value.name] = Vocabulary.load(directory / f'{value.name}.vocab')
+                state[name] = vocabularies[value.name]
+
+        vectorizer = klass.__new__(klass)
+        vectorizer.__dict__.update(state)
+        return vectorizer
+
+    def share(self, directory: Union[str, Path]) -> 'Vectorizer':
+        """
+        Save the vectorizer and load it back, so that its vocabularies are memory-mapped: data loader or serving workers
+        using the returned vectorizer, or loading the directory, share one physical copy of the vocabularies instead of
+        turning inherited or unpickled dicts into private pages.
+        :param directory: the directory in which to save the vectorizer, created if needed
+        :return: the shared vectorizer
+        """
+        self.save(directory)
+        return self.load(directory)
+
+
+class _VocabularyFile:
+    """
+    Placeholder for a vocabulary saved in its own file
+    """
+
+    def __init__(self, name: str):
+        self.name: str = name
+
+
+@register_plugin
+def load_vectorizer(directory: str) -> Vectorizer:
+    """
+    Load a saved vectorizer from an experiment file, e.g. {"_name": "load_vectorizer", "directory": "$HOME/vectorizer"}
+    """
+    return Vectorizer.load(directory)
+
+
+@register_plugin
+class CachedVectorizer(Vectorizer):
+    """
+    Bounded LRU cache in front of a vectorizer, for serving traffic where the same inputs come again and again.
+    Other attributes (vocabularies, tokenizer...) are the ones of the wrapped vectorizer.
+
+    Cached arrays are shared between calls, so they are made read-only.
+
+    Usage in an experiment file: {"_name": "CachedVectorizer", "vectorizer": "$vectorizer", "maxsize": 10000}
+    """
+
+    def __init__(self, vectorizer: Vectorizer, maxsize: int = 10000):
+        """
+        :param vectorizer: the vectorizer to cache
+        :param maxsize: maximum number of cached inputs
+        """
+        self.vectorizer: Vectorizer = vectorizer
+        self.maxsize: int = maxsize
+        self._vectorize = lru_cache(maxsize=maxsize)(self._vectorize_read_only)
+
+    def __getattr__(self, item):
+        # Only called for attributes not found on the cache itself
+        if item == 'vectorizer':
+            raise AttributeError(item)
+        return getattr(self.vectorizer, item)
+
+    def __reduce__(self):
+        # The cache itself is not picklable, and is not worth sending to other processes
+        return self.__class__, (self.vectorizer, self.maxsize)
+
+    def _vectorize_read_only(self, *args, **kwargs):
+        encoding = self.vectorizer.vectorize(*args, **kwargs)
+        # Sequence vectorizers return a tuple, e.g. the indices and the length of the sequence
+        for array in encoding if isinstance(encoding, tuple) else (encoding,):
+            if hasattr(array, 'setflags'):
+                array.setflags(write=False)
+        return encoding
+
+    def vectorize(self, *args, **kwargs):
+        # Arguments are forwarded as given, as vectorizers name their input differently (title, surname, context...)
+        return self._vectorize(*args, **kwargs)
+
+    def cache_info(self):
+        """
+        :return: hits, misses, maxsize and current size of the cache
+        """
+        return self._vectorize.cache_info()
+
+    def cache_clear(self):
+        self._vectorize.cache_clear()
+
+    def save(self, directory: Union[str, Path]):
+        self.vectorizer.save(directory)
+
+    def share(self, directory: Union[str, Path]) -> 'CachedVectorizer':
+        return self.__class__(vectorizer=self.vectorizer.share(directory), maxsize=self.maxsize)
@@ -1,7 +1,191 @@
-from typing import Dict
+import json
+import mmap
+import sys
+import zlib
+from collections import Counter
+from collections.abc import Mapping
+from itertools import repeat
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Sequence, Set, Tuple, Union
+
+import numpy as np
+
+from transfer_nlp.common.tokenizers import TokenizerABC
+from transfer_nlp.common.utils import shards
+
+# Binary vocabulary format, all integers are little-endian uint64:
+# magic | metadata size | metadata json (padded to 8 bytes) | number of tokens n | n + 1 offsets | utf-8 string table
+# and optionally (padded to 8 bytes) | hash table size m | m slots
+# The hash table maps tokens to ids without building a dict: slots hold id + 1 (0 for empty slots), a token is looked up
+# from slot crc32(utf-8 token) % m, probing the next slots until an empty one.
+VOCABULARY_MAGIC = b'TNLPVOC1'
+
+
+class MappedTokens(Sequence[str]):
+    """
+    Read-only list of tokens backed by a memory-mapped binary vocabulary file. Tokens are decoded on access.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path: Path = Path(str(path))
+        with self.path.open('rb') as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._buffer[:8] != VOCABULARY_MAGIC:
+            raise ValueError(f"{self.path} is not a binary vocabulary file")
+        metadata_size = int(np.frombuffer(self._buffer, dtype='<u8', count=1, offset=8)[0])
+        self.metadata: Dict[str, Any] = json.loads(self._buffer[16:16 + metadata_size].decode('utf-8'))
+
+        offset = 16 + _pad(metadata_size)
+        size = int(np.frombuffer(self._buffer, dtype='<u8', count=1, offset=offset)[0])
+        self._offsets: np.ndarray = np.frombuffer(self._buffer, dtype='<u8', count=size + 1, offset=offset + 8)
+        self._strings_start: int = offset + 8 * (size + 2)
+
+        # Files written before the hash table have none, their token to id mapping is a dict
+        self._table: np.ndarray = None
+        self._slots: Sequence[int] = None
+        self._offset_values: Sequence[int] = None
+        table_start = _pad(self._strings_start + int(self._offsets[-1]))
+        if len(self._buffer) > table_start:
+            table_size = int(np.frombuffer(self._buffer, dtype='<u8', count=1, offset=table_start)[0])
+            self._table = np.frombuffer(self._buffer, dtype='<u8', count=table_size, offset=table_start + 8)
+
+    @property
+    def has_index(self) -> bool:
+        return self._table is not None
+
+    def find(self, token: str) -> int:
+        """
+        Look up a token in the hash table of the file. Unlike `index`, it doesn't scan the tokens nor raise ValueError.
+        :param token: the token
+        :return: its id, or -1 if it is not in the vocabulary
+        """
+        if self._slots is None:
+            # Indexing memoryviews gives python ints, much faster than numpy scalars
+            self._slots = _uint64_view(self._table)
+            self._offset_values = _uint64_view(self._offsets)
+
+        key = token.encode('utf-8')
+        table, offsets, start = self._slots, self._offset_values, self._strings_start
+        size = len(table)
+        slot = zlib.crc32(key) % size
+        while True:
+            entry = table[slot]
+            if not entry:
+                return -1
+            index = entry - 1
+            if self._buffer[start + offsets[index]:start + offsets[index + 1]] == key:
+                return index
+            slot = (slot + 1) % size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"token index {index} out of range")
+        start, end = self._offsets[index], self._offsets[index + 1]
+        return self._buffer[self._strings_start + start:self._strings_start + end].decode('utf-8')
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __reduce__(self):
+        # mmap objects can't be pickled, map the file again instead
+        return MappedTokens, (self.path,)
+
+
+class MappedTokenIndex(Mapping):
+    """
+    Read-only token to id mapping using the hash table of a memory-mapped binary vocabulary file. Nothing is copied in
+    the process memory, so processes using the same file (data loader or serving workers) share one physical copy.
+    """
+
+    def __init__(self, tokens: MappedTokens):
+        if not tokens.has_index:
+            raise ValueError(f"{tokens.path} has no token index, save the vocabulary again to add it")
+        self.tokens: MappedTokens = tokens
+
+    def __getitem__(self, token: str) -> int:
+        index = self.tokens.find(token)
+        if index < 0:
+            raise KeyError(token)
+        return index
+
+    def get(self, token: str, default=None):
+        index = self.tokens.find(token)
+        return default if index < 0 else index
+
+    def __contains__(self, token) -> bool:
+        return isinstance(token, str) and self.tokens.find(token) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.tokens)
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+
+def _uint64_view(array: np.ndarray) -> Sequence[int]:
+    if sys.byteorder == 'little':
+        return memoryview(array).cast('B').cast('Q')
+    return array.astype('=u8').tolist()
+
+
+def _pad(size: int) -> int:
+    return size + (-size % 8)
+
+
+def _hash_table(encoded: List[bytes]) -> np.ndarray:
+    # Load factor of at most 1/2, so that probes stay short. A token present several times is mapped to its last id.
+    table = [0] * max(8, 2 * len(encoded))
+    size = len(table)
+    for index in range(len(encoded) - 1, -1, -1):
+        key = encoded[index]
+        slot = zlib.crc32(key) % size
+        while table[slot] and encoded[table[slot] - 1] != key:
+            slot = (slot + 1) % size
+        if not table[slot]:
+            table[slot] = index + 1
+    return np.array(table, dtype='<u8')
+
+
+def save_tokens(path: Union[str, Path], tokens: Sequence[str], metadata: Dict[str, Any]):
+    """
+    Write tokens in the binary vocabulary format, to be memory-mapped with `MappedTokens` and `MappedTokenIndex`
+    :param path: the file to write
+    :param tokens: the tokens, in id order
+    :param metadata: json serializable metadata, available as `MappedTokens.metadata`
+    """
+    metadata = json.dumps(metadata).encode('utf-8')
+
+    encoded = [token.encode('utf-8') for token in tokens]
+    offsets = np.zeros(len(encoded) + 1, dtype='<u8')
+    np.cumsum([len(token) for token in encoded], out=offsets[1:])
+    table = _hash_table(encoded)
+
+    with Path(str(path)).open('wb') as f:
+        f.write(VOCABULARY_MAGIC)
+        f.write(np.array([len(metadata)], dtype='<u8').tobytes())
+        f.write(metadata.ljust(_pad(len(metadata)), b' '))
+        f.write(np.array([len(encoded)], dtype='<u8').tobytes())
+        f.write(offsets.tobytes())
+        strings = b''.join(encoded)
+        f.write(strings.ljust(_pad(len(strings)), b'\0'))
+        f.write(np.array([len(table)], dtype='<u8').tobytes())
+        f.write(table.tobytes())
 
 
 class Vocabulary:
+    """
+    Mapping between tokens and contiguous ids. Ids are stored in a dict, and tokens in a list indexed by id, so that both
+    single and bulk lookups (`lookup_tokens`, `lookup_indices`) avoid per-token Python overhead as much as possible.
+    """
+
+    # Attributes which are not part of the metadata of a saved vocabulary
+    _unsaved_attributes = ('_token2id', '_id2token', '_id2token_array')
 
     def __init__(self, token2id: Dict = None, add_unk: bool = True, unk_token: str = "<UNK>"):
 
@@ -9,7 +193,11 @@ class Vocabulary:
             token2id = {}
 
         self._token2id: Dict = token2id
-        self._id2token = {idx: token for token, idx in self._token2id.items()}
+        self._id2token: List[str] = [None] * (max(self._token2id.values()) + 1 if self._token2id else 0)
+        for token, idx in self._token2id.items():
+            self._id2token[idx] = token
+        # Object array view of _id2token, built lazily for bulk index lookups
+        self._id2token_array: np.ndarray = None
 
         self._add_unk: bool = add_unk
         self._unk_token: str = unk_token
@@ -25,18 +213,68 @@ class Vocabulary:
     def to_serializable(self):
 
         return {
-            'token2id': self._token2id,
+            'token2id': self._token2id if isinstance(self._token2id, dict) else dict(self._token2id),
             'add_unk': self._add_unk,
             'unk_token': self._unk_token}
 
+    def save(self, path: Union[str, Path]):
+        """
+        Write the vocabulary in a compact binary format: a string table with offsets, a hash table of the tokens, plus the
+        special tokens metadata
+        :param path: the file to write
+        """
+        metadata = {key: value for key, value in vars(self).items()
+                    if key not in self._unsaved_attributes}
+        metadata['class'] = self.__class__.__name__
+        save_tokens(path, tokens=self._id2token, metadata=metadata)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> 'Vocabulary':
+        """
+        Load a vocabulary written by `save`. The file is memory-mapped, so loading doesn't depend on the vocabulary size:
+        tokens are decoded on access, and tokens are looked up in the hash table of the file. The vocabulary is then shared
+        by all the processes loading the file, until a token is added to it.
+        :param path: the binary vocabulary file
+        :return: the vocabulary, of the class that saved it
+        """
+        tokens = MappedTokens(path)
+        attributes = dict(tokens.metadata)
+        class_name = attributes.pop('class')
+
+        klass = _find_subclass(cls, class_name)
+        if klass is None:
+            raise ValueError(f"{path} contains a {class_name}, which is not a {cls.__name__}")
+
+        vocabulary = klass.__new__(klass)
+        vocabulary.__dict__.update(attributes)
+        vocabulary._id2token = tokens
+        vocabulary._id2token_array = None
+        return vocabulary
+
+    def __getattr__(self, name: str):
+        # Only called when the attribute is missing: the token to id mapping of a loaded vocabulary is built lazily
+        if name == '_token2id' and '_id2token' in self.__dict__:
+            if isinstance(self._id2token, MappedTokens) and self._id2token.has_index:
+                self._token2id = MappedTokenIndex(self._id2token)
+            else:
+                self._token2id = {token: idx for idx, token in enumerate(self._id2token)}
+            return self._token2id
+        raise AttributeError(f"'{self.__class__.__name__}' object has no attribute '{name}'")
+
     def add_token(self, token: str):
 
         if token in self._token2id:
             index = self._token2id[token]
         else:
             index = len(self._token2id)
+            # A memory-mapped vocabulary is copied in the process memory to grow
+            if not isinstance(self._token2id, dict):
+                self._token2id = dict(self._token2id.items())
             self._token2id[token] = index
-            self._id2token[index] = token
+            if not isinstance(self._id2token, list):
+                self._id2token = list(self._id2token)
+            self._id2token.append(token)
+            self._id2token_array = None
         return index
 
     def add_many(self, tokens):
@@ -50,19 +288,57 @@ class Vocabulary:
         else:
             return self._token2id.get(token, None)
 
+    def lookup_tokens(self, tokens: Iterable[str]) -> np.ndarray:
+        """
+        Bulk version of `lookup_token`
+        :param tokens: the tokens to look up
+        :return: the int64 array of their ids, unknown tokens are mapped to the unk index
+        :raise KeyError: if a token is unknown and the vocabulary has no unk token
+        """
+        if self.unk_index >= 0:
+            ids = map(self._token2id.get, tokens, repeat(self.unk_index))
+        else:
+            ids = map(self._token2id.__getitem__, tokens)
+        return np.fromiter(ids, dtype=np.int64)
+
     def lookup_index(self, index: int):
 
-        if index not in self._id2token:
+        if not 0 <= index < len(self._id2token):
             raise ValueError(f"Index {index} is not present in the Vocabulary")
 
         else:
             return self._id2token[index]
 
+    def lookup_indices(self, indices: Sequence[int]) -> List[str]:
+        """
+        Bulk version of `lookup_index`
+        :param indices: an array or sequence of ids
+        :return: the corresponding tokens
+        :raise ValueError: if an index is not in the vocabulary
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if indices.size and (indices.min() < 0 or indices.max() >= len(self._id2token)):
+            raise ValueError(f"Indices {indices[(indices < 0) | (indices >= len(self._id2token))]} are not present in the Vocabulary")
+
+        if self._id2token_array is None:
+            self._id2token_array = np.array(self._id2token, dtype=object)
+        return self._id2token_array[indices].tolist()
+
     def __str__(self):
         return f"Vocabulary(size={len(self)})"
 
     def __len__(self):
-        return len(self._token2id)
+        return len(self._id2token)
+
+
+def _find_subclass(cls: type, name: str) -> type:
+    if cls.__name__ == name:
+        return cls
+    for subclass in cls.__subclasses__():
+        found = _find_subclass(subclass, name)
+        if found is not None:
+            return found
+    return None
 
 
 class CBOWVocabulary(Vocabulary):
@@ -117,3 +393,252 @@ class SequenceVocabulary(Vocabulary):
             return self._token2id.get(token, self.unk_index)
         else:
             return self._token2id[token]
+
+
+class HashingVocabulary(SequenceVocabulary):
+    """
+    Vocabulary of unbounded size with no stored dictionary, usable in place of a `SequenceVocabulary`: tokens are hashed
+    into a fixed number of buckets, and only the special tokens are stored.
+
+    Ids 0 to `len(reserved tokens) - 1` are the special tokens (unk, mask, begin and end of sequence, then the extra
+    reserved tokens), the following `num_buckets` ids are the hash buckets, so embedding layers of `len(vocabulary)` rows
+    work as with a regular vocabulary. Tokens are hashed with crc32, which is stable across processes and runs.
+
+    With `track_collisions`, tokens hashed so far are kept per bucket (this costs the memory the hashing saves), to
+    measure collisions with `collision_stats` and give a readable token for buckets in `lookup_index`.
+    """
+
+    _unsaved_attributes = Vocabulary._unsaved_attributes + ('_bucket_tokens',)
+
+    def __init__(self, num_buckets: int, unk_token: str = "<UNK>", mask_token: str = "<MASK>",
+                 begin_seq_token: str = "<BEGIN>", end_seq_token: str = "<END>", reserved_tokens: Iterable[str] = None,
+                 seed: int = 0, track_collisions: bool = False):
+        """
+        :param num_buckets: number of hash buckets, the vocabulary size is this plus the number of special tokens
+        :param reserved_tokens: extra special tokens, with their own ids
+        :param seed: starting value of the crc32 hash, changes the token to bucket assignment
+        :param track_collisions: keep the tokens hashed into every bucket
+        """
+        if num_buckets <= 0:
+            raise ValueError(f"The number of buckets must be positive, got {num_buckets}")
+        self.num_buckets: int = num_buckets
+        self.seed: int = seed
+        self.track_collisions: bool = track_collisions
+        self._bucket_tokens: Dict[int, List[str]] = {}
+        # Special tokens are stored until the end of the constructor, afterwards tokens are hashed
+        self._reserving: bool = True
+
+        super().__init__(unk_token=unk_token, mask_token=mask_token, begin_seq_token=begin_seq_token,
+                         end_seq_token=end_seq_token)
+        self._reserved_tokens: List[str] = list(reserved_tokens or [])
+        for token in self._reserved_tokens:
+            self.add_token(token)
+        self._reserving = False
+
+    def to_serializable(self):
+
+        contents = super(HashingVocabulary, self).to_serializable()
+        del contents['token2id']
+        contents.update({
+            'num_buckets': self.num_buckets,
+            'reserved_tokens': self._reserved_tokens,
+            'seed': self.seed,
+            'track_collisions': self.track_collisions})
+        return contents
+
+    def __getattr__(self, name: str):
+        # Collisions of a loaded vocabulary are tracked from scratch
+        if name == '_bucket_tokens':
+            self._bucket_tokens = {}
+            return self._bucket_tokens
+        return super().__getattr__(name)
+
+    def _hash(self, token: str) -> int:
+        bucket = zlib.crc32(token.encode('utf-8'), self.seed) % self.num_buckets
+        if self.track_collisions:
+            tokens = self._bucket_tokens.setdefault(bucket, [])
+            if token not in tokens:
+                tokens.append(token)
+        return len(self._id2token) + bucket
+
+    def add_token(self, token: str):
+
+        if self._reserving:
+            return super().add_token(token)
+        return self.lookup_token(token)
+
+    def lookup_token(self, token: str):
+
+        index = self._token2id.get(token)
+        return self._hash(token) if index is None else index
+
+    def lookup_tokens(self, tokens: Iterable[str]) -> np.ndarray:
+
+        specials = self._token2id
+        if self.track_collisions:
+            ids = (specials[token] if token in specials else self._hash(token) for token in tokens)
+        else:
+            crc32, seed, num_buckets, offset = zlib.crc32, self.seed, self.num_buckets, len(self._id2token)
+            ids = (specials[token] if token in specials else offset + crc32(token.encode('utf-8'), seed) % num_buckets
+                   for token in tokens)
+        return np.fromiter(ids, dtype=np.int64)
+
+    def hash_tokens(self, tokens: Iterable[str]) -> np.ndarray:
+        """
+        Ids of the buckets of tokens, without looking up special tokens or tracking collisions, e.g. to initialize bucket
+        embeddings from pre-trained word embeddings
+        :param tokens: the tokens to hash
+        :return: the int64 array of their bucket ids
+        """
+        crc32, seed = zlib.crc32, self.seed
+        buckets = np.fromiter((crc32(token.encode('utf-8'), seed) for token in tokens), dtype=np.int64)
+        return len(self._id2token) + buckets % self.num_buckets
+
+    def lookup_index(self, index: int):
+        """
+        :return: the special token, or for a bucket the first token hashed into it if collisions are tracked, else a
+        `<BUCKET_i>` placeholder
+        """
+        if not 0 <= index < len(self):
+            raise ValueError(f"Index {index} is not present in the Vocabulary")
+        if index < len(self._id2token):
+            return self._id2token[index]
+
+        bucket = index - len(self._id2token)
+        tokens = self._bucket_tokens.get(bucket)
+        return tokens[0] if tokens else f"<BUCKET_{bucket}>"
+
+    def lookup_indices(self, indices: Sequence[int]) -> List[str]:
+
+        return [self.lookup_index(index) for index in np.asarray(indices, dtype=np.int64).tolist()]
+
+    def collision_stats(self) -> Dict[str, int]:
+        """
+        :return: the number of distinct tokens hashed so far, of buckets used, and of tokens sharing a bucket with a
+        previous token
+        """
+        if not self.track_collisions:
+            raise ValueError("Collisions are only tracked with track_collisions=True")
+        tokens = sum(len(bucket_tokens) for bucket_tokens in self._bucket_tokens.values())
+        return {
+            'tokens': tokens,
+            'buckets': len(self._bucket_tokens),
+            'collisions': tokens - len(self._bucket_tokens)}
+
+    def __str__(self):
+        return f"HashingVocabulary(size={len(self)}, num_buckets={self.num_buckets})"
+
+    def __len__(self):
+        return len(self._id2token) + self.num_buckets
+
+
+def _count_tokens(args: Tuple[TokenizerABC, List[str]]) -> Tuple[Counter, int]:
+    tokenizer, texts = args
+    counts = Counter()
+    max_length = 0
+    for tokens in tokenizer.tokenize_batch(texts):
+        max_length = max(max_length, len(tokens))
+        counts.update(tokens)
+    return counts, max_length
+
+
+class VocabularyBuilder:
+    """
+    Count tokens over a stream of texts, then fill a vocabulary with the tokens passing the frequency filters.
+
+    Tokens are added in a deterministic order: order of first appearance in the stream (default) or decreasing count,
+    ties being broken by order of first appearance. Parallel counts are merged shard by shard, so the result doesn't
+    depend on the number of workers.
+
+    Usage:
+
+        builder = VocabularyBuilder(tokenizer=CustomTokenizer(), min_count=5)
+        builder.update(df.title)
+        data_vocab = builder.build(SequenceVocabulary())
+    """
+
+    def __init__(self, tokenizer: TokenizerABC = None, min_count: int = 1, max_size: int = None, exclude: Iterable[str] = None,
+                 by_frequency: bool = False):
+        """
+        :param tokenizer: the tokenizer used by `update`
+        :param min_count: minimum number of occurrences of a token to keep it
+        :param max_size: maximum number of tokens to keep, the most frequent ones, not counting tokens already in the vocabulary
+        :param exclude: tokens never added to the vocabulary, e.g. punctuation
+        :param by_frequency: add tokens by decreasing count instead of order of first appearance
+        """
+        self.tokenizer: TokenizerABC = tokenizer
+        self.min_count: int = min_count
+        self.max_size: int = max_size
+        self.exclude = set(exclude) if exclude else set()
+        self.by_frequency: bool = by_frequency
+
+        self.counts: Counter = Counter()
+        self.max_length: int = 0
+
+    def update(self, texts: Iterable[str], num_workers: int = 1, shard_size: int = 10000) -> 'VocabularyBuilder':
+        """
+        Tokenize and count the tokens of texts. `max_length` is updated with the maximum number of tokens in a text.
+        :param texts: an iterable of texts, consumed once
+        :param num_workers: number of processes used to tokenize the texts. The tokenizer must be picklable.
+        :param shard_size: number of texts tokenized by a worker at once
+        :return: the builder
+        """
+        if self.tokenizer is None:
+            raise ValueError("A tokenizer is needed to count tokens from texts, use update_tokens to count tokens directly")
+
+        tokenizer_shards = zip(repeat(self.tokenizer), shards(texts, shard_size))
+        if num_workers > 1:
+            with Pool(processes=num_workers) as pool:
+                for counts, max_length in pool.imap(_count_tokens, tokenizer_shards):
+                    self._merge(counts, max_length)
+        else:
+            for counts, max_length in map(_count_tokens, tokenizer_shards):
+                self._merge(counts, max_length)
+        return self
+
+    def update_tokens(self, tokens: Iterable[str]) -> 'VocabularyBuilder':
+        """
+        Count already tokenized tokens, e.g. labels
+        :param tokens: an iterable of tokens
+        :return: the builder
+        """
+        self.counts.update(tokens)
+        return self
+
+    def merge(self, other: 'VocabularyBuilder') -> 'VocabularyBuilder':
+        """
+        Add the counts of another builder, e.g. built on another shard of the corpus
+        :param other: the other builder
+        :return: the builder
+        """
+        self._merge(other.counts, other.max_length)
+        return self
+
+    def tokens(self) -> List[str]:
+        """
+        :return: the tokens passing the filters, in the order they are added to the vocabulary
+        """
+        tokens = [token for token, count in self.counts.items() if count >= self.min_count and token not in self.exclude]
+        if self.by_frequency or (self.max_size is not None and len(tokens) > self.max_size):
+            # sorted is stable, so ties keep their order of first appearance
+            by_count = sorted(tokens, key=self.counts.__getitem__, reverse=True)[:self.max_size]
+            if self.by_frequency:
+                return by_count
+            kept = set(by_count)
+            tokens = [token for token in tokens if token in kept]
+        return tokens
+
+    def build(self, vocabulary: Vocabulary = None) -> Vocabulary:
+        """
+        Add the counted tokens to a vocabulary. Special tokens already in the vocabulary (unk, mask...) keep their ids.
+        :param vocabulary: the vocabulary to fill, a new `Vocabulary` by default
+        :return: the vocabulary
+        """
+        if vocabulary is None:
+            vocabulary = Vocabulary()
+        vocabulary.add_many(tokens=self.tokens())
+        return vocabulary
+
+    def _merge(self, counts: Counter, max_length: int):
+        self.counts.update(counts)
+        self.max_length = max(self.max_length, max_length)
@@ -2,19 +2,41 @@
 This file contains all necessary plugins classes that the framework will use to let a user interact with custom models, data loaders, etc...
 The Registry pattern used here is inspired from this post: https://realpython.com/primer-on-python-decorators/
 """
+import importlib
+import json
 import logging
 import os
+import tempfile
 import traceback
 from abc import ABCMeta, abstractmethod
+from copy import deepcopy
 from pathlib import Path
-from typing import Any, Callable, Dict, List, Mapping, Type, Union
+from typing import Any, Callable, Container, Dict, Iterator, List, Mapping, Sequence, Set, Tuple, Type, Union
 
 import toml
 import yaml
 
+from transfer_nlp.plugins.profiling import BuildProfiler
+
 logger = logging.getLogger(__name__)
 REGISTRY = {}
 
+# Plugin packages can advertise their registrables through this entry point group, e.g. in setup.py:
+# entry_points={'transfer_nlp.plugins': ['MyModel = my_package.models:MyModel']}
+PLUGIN_ENTRY_POINT_GROUP = 'transfer_nlp.plugins'
+PLUGIN_INDEX_ENV = 'TRANSFER_NLP_PLUGIN_INDEX'
+DEFAULT_PLUGIN_INDEX_PATH = Path.home() / '.transfer_nlp' / 'plugin_index.json'
+
+ENTRY_POINTS = True
+try:
+    from importlib.metadata import entry_points
+except ImportError:
+    try:
+        from importlib_metadata import entry_points
+    except ImportError:
+        logger.debug("To discover plugins through entry points on python<3.8, pip install importlib_metadata")
+        ENTRY_POINTS = False
+
 
 def register_plugin(registrable: Any, alias: str = None):
     """
@@ -33,6 +55,151 @@ def register_plugin(registrable: Any, alias: str = None):
     return registrable
 
 
+class PluginIndex:
+    """
+    On-disk index mapping plugin aliases to the `module:attribute` path declared in the `transfer_nlp.plugins` entry points.
+    Using the index, only the modules referenced by a config get imported, instead of importing every plugin package up front.
+    """
+
+    def __init__(self, index_path: Union[str, Path] = None):
+        """
+        :param index_path: the json file storing the index, defaults to the `TRANSFER_NLP_PLUGIN_INDEX` environment
+        variable, or `DEFAULT_PLUGIN_INDEX_PATH`
+        """
+        self._index_path: Union[str, Path] = index_path
+        self.entries: Dict[str, str] = None
+        self.rebuilt: bool = False
+
+    @property
+    def index_path(self) -> Path:
+        # The environment variable is read lazily, so that it can be set after this module is imported, e.g. in tests
+        index_path = self._index_path or os.environ.get(PLUGIN_INDEX_ENV) or DEFAULT_PLUGIN_INDEX_PATH
+        return Path(str(index_path)).expanduser()
+
+    def build(self) -> Dict[str, str]:
+        """
+        Scan the installed entry points and write the resulting index to disk
+        :return: the alias to `module:attribute` mapping
+        """
+        self.entries = {}
+        if ENTRY_POINTS:
+            eps = entry_points()
+            group = eps.select(group=PLUGIN_ENTRY_POINT_GROUP) if hasattr(eps, 'select') else eps.get(PLUGIN_ENTRY_POINT_GROUP, [])
+            self.entries = {ep.name: ep.value for ep in group}
+        self.rebuilt = True
+
+        # Write to a temporary file first, so that concurrent processes never read a partially written index
+        index_path = self.index_path
+        try:
+            index_path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=str(index_path.parent), prefix=f'.{index_path.name}.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(self.entries, f, indent=2, sort_keys=True)
+                os.replace(tmp_path, str(index_path))
+            except OSError:
+                os.remove(tmp_path)
+                raise
+        except OSError:
+            logger.warning("Could not write the plugin index to %s", index_path)
+
+        return self.entries
+
+    def load(self) -> Dict[str, str]:
+        """
+        Read the index from disk, building it if it doesn't exist yet or can't be read
+        :return: the alias to `module:attribute` mapping
+        """
+        if self.entries is None:
+            try:
+                with self.index_path.open() as f:
+                    entries = json.load(f)
+                if not isinstance(entries, dict):
+                    raise ValueError(f"Expected a mapping, got {type(entries).__name__}")
+                self.entries = entries
+            except FileNotFoundError:
+                self.build()
+            except (OSError, ValueError) as e:
+                logger.warning("Rebuilding the invalid plugin index %s: %s", self.index_path, e)
+                self.build()
+        return self.entries
+
+    def resolve(self, alias: str) -> bool:
+        """
+        Import the module providing `alias` and make sure it is registered.
+        The index is rebuilt once per process if the alias is unknown or points to a module or attribute that no
+        longer exists.
+        :param alias: the alias of the plugin
+        :return: True if the plugin has been registered
+        """
+        entries = self.load()
+        if alias not in entries and not self.rebuilt:
+            entries = self.build()
+        if alias not in entries:
+            return False
+
+        module_name, _, attribute = entries[alias].partition(':')
+        try:
+            registrable = importlib.import_module(module_name.strip())
+            # Importing the module usually registers the plugin through `register_plugin`
+            if alias not in REGISTRY and attribute:
+                for name in attribute.strip().split('.'):
+                    registrable = getattr(registrable, name)
+        except (ImportError, AttributeError):
+            if not self.rebuilt:
+                self.build()
+                return self.resolve(alias)
+            logger.warning("Could not load plugin %s from %s", alias, entries[alias], exc_info=True)
+            return False
+
+        if alias not in REGISTRY:
+            if not attribute:
+                return False
+            register_plugin(registrable, alias=alias)
+
+        logger.debug("Loaded plugin %s from %s", alias, entries[alias])
+        return True
+
+
+PLUGIN_INDEX = PluginIndex()
+
+
+def get_registrable(alias: str) -> Any:
+    """
+    Get a registered plugin, importing it lazily through the plugin index if it hasn't been registered yet
+    :param alias: the alias of the plugin
+    :return: the registrable
+    :raise KeyError: if no plugin is known for this alias
+    """
+    if alias not in REGISTRY:
+        PLUGIN_INDEX.resolve(alias)
+    return REGISTRY[alias]
+
+
+class LazyRegistry(Mapping[str, Any]):
+    """
+    Read-only view on REGISTRY that resolves missing aliases through the plugin index
+    """
+
+    def __init__(self, exclude: Sequence[Container[str]] = ()):
+        """
+        :param exclude: names never looked up in the plugin index, e.g. the keys of an experiment, which are
+        referenced with the same `$name` syntax as the plugins
+        """
+        self.exclude: Sequence[Container[str]] = exclude
+
+    def __getitem__(self, alias: str) -> Any:
+        if alias not in REGISTRY and any(alias in names for names in self.exclude):
+            raise KeyError(alias)
+        return get_registrable(alias)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(REGISTRY)
+
+    def __len__(self) -> int:
+        return len(REGISTRY)
+
+
 class InstantiationError(Exception):
     """
     An error happened while instantiating an experiment
@@ -135,14 +302,29 @@ class ObjectBuilder:
     """
     The main builder class
     """
-    def __init__(self, instantiators: List[ObjectInstantiator]):
+    def __init__(self, instantiators: List[ObjectInstantiator], trace: bool = False, profiler: BuildProfiler = None):
         """
         :param instantiators: The ordered list of instantiators that can be used to instantiate the objects
+        :param trace: If True, record the build time of every node in `build_trace`
+        :param profiler: A profiler recording the resources used to build every node. Takes precedence over `trace`.
         """
         self.instantiators: List[ObjectInstantiator] = instantiators
         for instantiator in instantiators:
             instantiator.set_builder(self)
 
+        if profiler is None and trace:
+            profiler = BuildProfiler(cpu=False, memory=False)
+        self.profiler: BuildProfiler = profiler
+
+    @property
+    def build_trace(self) -> List[Tuple[str, float]]:
+        """
+        :return: The (name, build time) of every node, in build order. Empty if the builder doesn't trace.
+        """
+        if self.profiler is None:
+            return []
+        return [(node.name, node.wall_time) for node in self.profiler.records]
+
     def instantiate(self, config: Union[Dict, str, List], name: str) -> Any:
         """
         build the object trying to use all the instantiators in a row, until one works
@@ -151,14 +333,26 @@ class ObjectBuilder:
         :param name: The full name of this object
         :return: The instantiated object
         """
+        if self.profiler is None:
+            return self._instantiate(config, name)
+
+        with self.profiler.profile(name):
+            return self._instantiate(config, name)
+
+    def format_build_trace(self) -> str:
+        """
+        :return: A compact table of the recorded build times, in build order. Times include the nested nodes.
+        """
+        return self.profiler.format_table() if self.profiler else ''
 
+    def _instantiate(self, config: Union[Dict, str, List], name: str) -> Any:
         for instantiator in self.instantiators:
             try:
                 return instantiator.instantiate(config, name)
             except InstantiationImpossible:
                 pass
 
-        logger.info(f'instantiating "{name}" as a simple object, {config}')
+        logger.debug('instantiating "%s" as a simple object, %s', name, config)
 
         return config
 
@@ -178,7 +372,7 @@ class DictInstantiator(ObjectInstantiator):
         if not isinstance(config, dict):
             raise InstantiationImpossible()
 
-        logger.info(f'instantiating "{name}" as a dictionary')
+        logger.info('instantiating "%s" as a dictionary', name)
 
         return {
             key: self.builder.instantiate(value_config, f'{name}.{key}')
@@ -201,7 +395,7 @@ class ListInstantiator(ObjectInstantiator):
         if not isinstance(config, list):
             raise InstantiationImpossible()
 
-        logger.info(f'instantiating "{name}" as a list')
+        logger.info('instantiating "%s" as a list', name)
 
         return [
             self.builder.instantiate(value_config, f'{name}.{i}')
@@ -236,7 +430,9 @@ class FromMappingInstantiator(ObjectInstantiator):
             raise InstantiationImpossible
         try:
             instance = self.env[config[1:]]
-            logger.info(f'instantiating "{name}" using value {instance} from key {config} in {self.mapping_name}')
+            # values can be large objects (tensors, dataframes...), only format them in debug mode
+            logger.info('instantiating "%s" from key %s in %s', name, config, self.mapping_name)
+            logger.debug('"%s" value: %s', name, instance)
             return instance
         except KeyError:
             raise InstantiationImpossible
@@ -281,7 +477,7 @@ class FromEnvironmentVariableInstantiator(FromMappingInstantiator):
             if v_upd.startswith('$'):
                 raise UnknownReferenceError(name, config) from None
 
-            logger.info(f'instantiating "{name}" using value {v_upd}')
+            logger.info('instantiating "%s" using value %s', name, v_upd)
 
             return v_upd
 
@@ -305,12 +501,12 @@ class CallableInstantiator(DictInstantiator):
 
         klass_name: str = config['_name']
 
-        if klass_name not in REGISTRY:
-            raise UnknownPluginException(object_name=name, registrable=klass_name)
-
-        klass: Union[Type, Callable] = REGISTRY[klass_name]
+        try:
+            klass: Union[Type, Callable] = get_registrable(klass_name)
+        except KeyError:
+            raise UnknownPluginException(object_name=name, registrable=klass_name) from None
 
-        logger.info(f'instantiating "{name}" calling {klass_name}')
+        logger.info('instantiating "%s" calling %s', name, klass_name)
 
         param_instances: Dict[str, Any] = {
             key: self.builder.instantiate(value_config, f'{name}.{key}')
@@ -342,9 +538,11 @@ class ExperimentConfig(Mapping[str, Any]):
                     raise ValueError("Only Dict, json, yaml and toml experiment files are supported")
         return config
 
-    def __init__(self, experiment: Union[str, Path, Dict], **env):
+    def __init__(self, experiment: Union[str, Path, Dict], trace_build: bool = False, profiler: BuildProfiler = None, **env):
         """
         :param experiment: the experiment config
+        :param trace_build: if True, record the build time of every node and log it as a table once the experiment is built
+        :param profiler: a profiler recording the time and memory spent building every node, see `transfer_nlp.plugins.profiling`
         :param env: substitution variables, e.g. a HOME directory. generally use all caps.
         :return: the experiment
         """
@@ -352,22 +550,35 @@ class ExperimentConfig(Mapping[str, Any]):
         self.config: Dict[str, Any] = ExperimentConfig.load_experiment_config(experiment)
 
         self.builds_started: List[str] = []
+        # keys of the objects referenced by each object, to know what to rebuild when the config changes
+        self.dependencies: Dict[str, Set[str]] = {}
+        self._build_stack: List[str] = []
         self.builders = [
             CallableInstantiator(),
             DictInstantiator(),
             ListInstantiator(),
-            FromMappingInstantiator(REGISTRY, 'Registry'),
+            FromMappingInstantiator(LazyRegistry(exclude=[self.config, env]), 'Registry'),
             FromMappingInstantiator(self, 'Experiment objects'),
             FromEnvironmentVariableInstantiator(env),
         ]
 
-        self.builder: ObjectBuilder = ObjectBuilder(self.builders)
+        self.builder: ObjectBuilder = ObjectBuilder(self.builders, trace=trace_build, profiler=profiler)
+        self.profiler: BuildProfiler = self.builder.profiler
 
         self.experiment: Dict[str, Any] = {}
 
-        for key, value_config in self.config.items():
-            if key not in self.experiment:
-                self.build(key)
+        if self.profiler:
+            self.profiler.start()
+        try:
+            for key, value_config in self.config.items():
+                if key not in self.experiment:
+                    self.build(key)
+        finally:
+            if self.profiler:
+                self.profiler.stop()
+
+        if self.profiler:
+            logger.info("Experiment build trace:\n%s", self.builder.format_build_trace())
 
     def _check_init(self):
         if self.experiment is None:
@@ -379,15 +590,93 @@ class ExperimentConfig(Mapping[str, Any]):
         if key in self.builds_started:
             raise LoopInConfigError(key)
         self.builds_started.append(key)
-        self.experiment[key] = self.builder.instantiate(self.config[key], name=key)
+        self.dependencies[key] = set()
+        self._build_stack.append(key)
+        try:
+            self.experiment[key] = self.builder.instantiate(self.config[key], name=key)
+        finally:
+            self._build_stack.pop()
         return self.experiment[key]
 
+    def apply_diff(self, diff: Dict[str, Any]) -> Set[str]:
+        """
+        Update the config and rebuild only the objects invalidated by the update, along with the objects referencing them.
+        E.g. changing `optimizer.lr` rebuilds the optimizer and the trainer, but not the dataset nor the model.
+
+        :param diff: the new config values by path, e.g. {'optimizer.lr': 0.01}. Nested keys are separated by dots and list items
+               are referred to by their index. A path made of a single key replaces (or adds) a whole object config.
+        :return: the keys of the rebuilt objects
+        :raise KeyError: if a path refers to an object missing from the config. The config and the objects are left
+               unchanged when the update or a rebuild fails.
+        """
+        self._check_init()
+
+        # Shallow copies are enough, the updated configs are copied before being modified
+        config = dict(self.config)
+        experiment = dict(self.experiment)
+        dependencies = {key: set(references) for key, references in self.dependencies.items()}
+        builds_started = list(self.builds_started)
+        try:
+            invalidated: Set[str] = set()
+            for path, value in diff.items():
+                key, *sub_keys = path.split('.')
+                if not sub_keys:
+                    self.config[key] = value
+                else:
+                    if key not in self.config:
+                        raise KeyError(f"{key} is not in the experiment config")
+                    # Don't modify the config the experiment was created from
+                    self.config[key] = node = deepcopy(self.config[key])
+                    for sub_key in sub_keys[:-1]:
+                        node = node[int(sub_key)] if isinstance(node, list) else node.setdefault(sub_key, {})
+                    if isinstance(node, list):
+                        node[int(sub_keys[-1])] = value
+                    else:
+                        node[sub_keys[-1]] = value
+                invalidated.add(key)
+
+            dependents: Dict[str, Set[str]] = {}
+            for key, references in self.dependencies.items():
+                for reference in references:
+                    dependents.setdefault(reference, set()).add(key)
+
+            to_visit = list(invalidated)
+            while to_visit:
+                for dependent in dependents.get(to_visit.pop(), ()):
+                    if dependent not in invalidated:
+                        invalidated.add(dependent)
+                        to_visit.append(dependent)
+
+            for key in invalidated:
+                self.experiment.pop(key, None)
+                self.dependencies.pop(key, None)
+            self.builds_started = [key for key in self.builds_started if key not in invalidated]
+
+            for key in self.config:
+                if key in invalidated and key not in self.experiment:
+                    self.build(key)
+        except BaseException:
+            # Leave the experiment as it was before the update, in place since the registry refers to the config
+            for current, previous in ((self.config, config), (self.experiment, experiment),
+                                      (self.dependencies, dependencies)):
+                current.clear()
+                current.update(previous)
+            self.builds_started = builds_started
+            raise
+
+        logger.info("Rebuilt %s", ', '.join(sorted(invalidated)))
+        return invalidated
+
     # map-like methods
     def __getitem__(self, item):
         self._check_init()
         if item in self.experiment:
-            return self.experiment[item]
-        return self.build(item)
+            value = self.experiment[item]
+        else:
+            value = self.build(item)
+        if self._build_stack:
+            self.dependencies[self._build_stack[-1]].add(item)
+        return value
 
     def get(self, item, default=None):
         self._check_init()
@@ -1,15 +1,28 @@
+import asyncio
 import inspect
 import logging
+import queue
+import threading
+import time
+import weakref
+from collections.abc import Sized
+from concurrent.futures import Future, ThreadPoolExecutor
 from itertools import zip_longest
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Sequence, Tuple, Union
 
+import numpy as np
 import torch
 from ignite.utils import convert_tensor
 
-from transfer_nlp.loaders.vectorizers import Vectorizer
+from transfer_nlp.loaders.vectorizers import CachedVectorizer, Vectorizer
+from transfer_nlp.loaders.vocabulary import Vocabulary
+from transfer_nlp.plugins.config import register_plugin
 
 logger = logging.getLogger(__name__)
 
+# Default value of the forward parameters without defaults, which must be in the batch
+_REQUIRED = object()
+
 
 def _prepare_batch(batch: Dict, device=None, non_blocking: bool = False):
     """Prepare batch for training: pass to a device with options.
@@ -19,19 +32,93 @@ def _prepare_batch(batch: Dict, device=None, non_blocking: bool = False):
     return result
 
 
+class _PendingLimiter:
+    """
+    Bound the number of pending calls of every asyncio event loop: once the bound is reached, new callers wait for a
+    pending call to complete
+    """
+
+    def __init__(self, max_pending: int):
+        self.max_pending: int = max_pending
+        self._semaphores: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    def __call__(self) -> asyncio.Semaphore:
+        # Called from coroutines, where get_event_loop returns the running loop (get_running_loop needs python 3.7)
+        loop = asyncio.get_event_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_pending)
+        return semaphore
+
+
 class PredictorABC:
 
+    # Thread pool running the async calls, created by `enable_async`
+    _executor: ThreadPoolExecutor = None
+    _limiter: _PendingLimiter = None
+
+    # Options of `decode_classes`, set by `configure_decoding`
+    top_k: int = 1
+    threshold: float = None
+    columnar: bool = False
+
     def __init__(self, vectorizer: Vectorizer, model: torch.nn.Module):
 
         self.model: torch.nn.Module = model
         self.model.eval()
         self.forward_params = {}
         model_spec = inspect.getfullargspec(self.model.forward)
-        for fparam, pdefault in zip_longest(reversed(model_spec.args[1:]), reversed(model_spec.defaults if model_spec.defaults else [])):
+        for fparam, pdefault in zip_longest(reversed(model_spec.args[1:]), reversed(model_spec.defaults if model_spec.defaults else []),
+                                            fillvalue=_REQUIRED):
             self.forward_params[fparam] = pdefault
 
         self.vectorizer: Vectorizer = vectorizer
 
+    def enable_cache(self, maxsize: int = 10000) -> 'PredictorABC':
+        """
+        Cache the vectorization of inputs, so that repeated inputs (e.g. the same headline sent by many users) skip
+        tokenization and array allocation. Hits and misses are given by `self.vectorizer.cache_info()`
+        :param maxsize: maximum number of cached inputs
+        :return: the predictor
+        """
+        if isinstance(self.vectorizer, CachedVectorizer):
+            self.vectorizer = self.vectorizer.vectorizer
+        self.vectorizer = CachedVectorizer(vectorizer=self.vectorizer, maxsize=maxsize)
+        return self
+
+    def enable_async(self, max_workers: int = 1, max_pending: int = 64) -> 'PredictorABC':
+        """
+        Configure the thread pool running the model for the async methods. It is created with the defaults on the first
+        async call otherwise.
+        :param max_workers: number of threads running predictions
+        :param max_pending: maximum number of calls queued or running per event loop, further callers wait
+        :return: the predictor
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='predictor')
+        self._limiter = _PendingLimiter(max_pending=max_pending)
+        return self
+
+    def configure_decoding(self, top_k: int = 1, threshold: float = None, columnar: bool = False) -> 'PredictorABC':
+        """
+        Configure the outputs of classification predictors, see `decode_classes`
+        :param top_k: number of classes returned per example
+        :param threshold: minimum probability of the returned classes
+        :param columnar: return one list per output field instead of one dictionary per example
+        :return: the predictor
+        """
+        self.top_k = top_k
+        self.threshold = threshold
+        self.columnar = columnar
+        return self
+
+    async def _run_async(self, function, *args):
+        if self._executor is None:
+            self.enable_async()
+        async with self._limiter():
+            return await asyncio.get_event_loop().run_in_executor(self._executor, function, *args)
+
     def forward(self, batch: Dict[str, Any]) -> torch.tensor:
         """
         Do the forward pass
@@ -44,7 +131,7 @@ class PredictorABC:
             for p, pdefault in self.forward_params.items():
                 val = batch.get(p)
                 if val is None:
-                    if pdefault is None:
+                    if pdefault is _REQUIRED:
                         raise ValueError(f'missing model parameter "{p}"')
                     else:
                         val = pdefault
@@ -54,6 +141,32 @@ class PredictorABC:
 
         return y_pred
 
+    def vectorize_batch(self, inputs: Sequence[Any], keys: Sequence[str] = ('x_in',),
+                        dtypes: Dict[str, Any] = None) -> Dict[str, torch.Tensor]:
+        """
+        Vectorize every input exactly once, into arrays allocated once for the whole batch, converted to tensors
+        without copy. Vectorizer outputs must have the same shape for all inputs.
+        :param inputs: the inputs of the request, passed to `self.vectorizer.vectorize`
+        :param keys: the batch key of the vectorizer output, or of every element of the tuples it returns
+        :param dtypes: the dtype of the arrays by key, the dtype of the vectorizer outputs by default
+        :return: the batch of tensors
+        """
+        if not len(inputs):
+            raise ValueError("Cannot vectorize an empty batch")
+        dtypes = dtypes or {}
+        buffers = None
+        for row, value in enumerate(inputs):
+            encodings = self.vectorizer.vectorize(value)
+            if len(keys) == 1:
+                encodings = (encodings,)
+            if buffers is None:
+                buffers = [np.empty((len(inputs),) + np.shape(encoding), dtype=dtypes.get(key, np.asarray(encoding).dtype))
+                           for key, encoding in zip(keys, encodings)]
+            for buffer, encoding in zip(buffers, encodings):
+                buffer[row] = encoding
+
+        return {key: torch.from_numpy(buffer) for key, buffer in zip(keys, buffers)}
+
     def json_to_data(self, input_json: Dict) -> Dict:
         """
         Transform a json entry into a data example, which is the same that what the __getitem__ method in the
@@ -81,6 +194,41 @@ class PredictorABC:
         """
         raise NotImplementedError
 
+    def decode_classes(self, output: torch.Tensor, vocabulary: Vocabulary) -> Union[List[Dict], Dict[str, List]]:
+        """
+        Decode classification logits for the whole batch at once: softmax, top classes and their probability, labels
+        looked up in bulk in the vocabulary.
+
+        By default, every example gets its most probable `class` and its `probability`. With `top_k` > 1 they are lists
+        of the top classes, in decreasing probability. With a `threshold`, classes below it are dropped (a single
+        class becomes None).
+        :param output: the (batch, num_classes) logits
+        :param vocabulary: the vocabulary of the classes
+        :return: a dictionary per example, or a dictionary of lists if `columnar`
+        """
+        probabilities = torch.nn.functional.softmax(output.detach(), dim=1)
+        if self.top_k == 1:
+            probability_values, indices = probabilities.max(dim=1)
+        else:
+            probability_values, indices = probabilities.topk(min(self.top_k, probabilities.shape[1]), dim=1)
+        probability_values, indices = probability_values.cpu().numpy(), indices.cpu().numpy()
+        classes = np.array(vocabulary.lookup_indices(indices.ravel()), dtype=object).reshape(indices.shape)
+
+        if self.threshold is not None:
+            kept = probability_values >= self.threshold
+            if self.top_k == 1:
+                classes[~kept] = None
+                classes, probability_values = classes.tolist(), probability_values.tolist()
+            else:
+                classes = [row[row_kept].tolist() for row, row_kept in zip(classes, kept)]
+                probability_values = [row[row_kept].tolist() for row, row_kept in zip(probability_values, kept)]
+        else:
+            classes, probability_values = classes.tolist(), probability_values.tolist()
+
+        if self.columnar:
+            return {"class": classes, "probability": probability_values}
+        return [{"class": label, "probability": probability} for label, probability in zip(classes, probability_values)]
+
     def predict(self, batch: Dict[str, Any]) -> List[Dict]:
         """
         Decode the output of the forward pass
@@ -101,3 +249,199 @@ class PredictorABC:
         predictions2json = self.output_to_json(predictions)
 
         return predictions2json
+
+    async def apredict(self, batch: Dict[str, Any]) -> List[Dict]:
+        """
+        `predict` run in the predictor thread pool, without blocking the event loop
+        """
+        return await self._run_async(self.predict, batch)
+
+    async def ajson_to_json(self, input_json: Dict) -> Dict[str, Any]:
+        """
+        `json_to_json` run in the predictor thread pool, without blocking the event loop
+        """
+        return await self._run_async(self.json_to_json, input_json)
+
+
+@register_plugin
+class MicroBatchingPredictor:
+    """
+    Serve a predictor to concurrent callers with dynamic micro-batching: the requests received within
+    `max_latency_ms` of the oldest waiting one are merged into a single batch, run in one forward pass by a worker
+    thread, and the decoded outputs are split back per request.
+
+    Requests follow the convention of the bundled predictors, `{"inputs": [...]}`: they are merged on their inputs,
+    other keys are ignored. A request failing within a batch is retried alone, so that its error is only raised to its
+    caller.
+
+    Usage:
+
+        server = MicroBatchingPredictor(predictor=predictor, max_batch_size=64, max_latency_ms=5)
+        server.json_to_json({"inputs": ["hello world"]})  # from any thread
+        await server.ajson_to_json({"inputs": ["hello world"]})  # from coroutines
+        server.close()
+    """
+
+    def __init__(self, predictor: PredictorABC, max_batch_size: int = 64, max_latency_ms: float = 5.,
+                 inputs_key: str = 'inputs', max_pending: int = 1024):
+        """
+        :param predictor: the predictor to serve
+        :param max_batch_size: a batch is run as soon as it holds this number of inputs
+        :param max_latency_ms: maximum time spent waiting for other requests before running a batch
+        :param inputs_key: the key of the inputs in the requests
+        :param max_pending: maximum number of pending requests from `ajson_to_json` per event loop, further callers
+        wait
+        """
+        self.predictor: PredictorABC = predictor
+        self.max_batch_size: int = max_batch_size
+        self.max_latency_ms: float = max_latency_ms
+        self.inputs_key: str = inputs_key
+        self._limiter: _PendingLimiter = _PendingLimiter(max_pending=max_pending)
+
+        self._queue: queue.Queue = queue.Queue()
+        self._closed: bool = False
+        # Held while queuing, so that no request is queued after the stop sentinel
+        self._lock: threading.Lock = threading.Lock()
+        self._thread: threading.Thread = threading.Thread(target=self._run, name='micro-batching', daemon=True)
+        self._thread.start()
+
+    def submit(self, input_json: Dict) -> Future:
+        """
+        Queue a request
+        :param input_json: the request
+        :return: a future of the json output
+        :raise KeyError: if the request has no inputs
+        :raise ValueError: if the request is not a dict, or its inputs are not a sequence
+        """
+        self._size(input_json)
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The predictor is closed")
+            self._queue.put((input_json, future))
+        return future
+
+    def json_to_json(self, input_json: Dict) -> Dict[str, Any]:
+        """
+        Full prediction of a request, batched with the concurrent ones
+        """
+        return self.submit(input_json).result()
+
+    async def ajson_to_json(self, input_json: Dict) -> Dict[str, Any]:
+        """
+        Full prediction of a request, batched with the concurrent ones, without blocking the event loop
+        """
+        async with self._limiter():
+            return await asyncio.wrap_future(self.submit(input_json))
+
+    def predict_many(self, input_jsons: List[Dict]) -> List[Dict[str, Any]]:
+        """
+        Run several requests in a single forward pass
+        :param input_jsons: the requests
+        :return: the json output of every request
+        """
+        inputs = [input_json[self.inputs_key] for input_json in input_jsons]
+        merged = [value for values in inputs for value in values]
+        predictions = self.predictor.predict(batch=self.predictor.json_to_data({self.inputs_key: merged})) if merged else []
+
+        outputs = []
+        start = 0
+        for values in inputs:
+            end = start + len(values)
+            if isinstance(predictions, dict):
+                # Columnar predictions
+                outputs.append(self.predictor.output_to_json({key: column[start:end] for key, column in predictions.items()}))
+            else:
+                outputs.append(self.predictor.output_to_json(predictions[start:end]))
+            start = end
+        return outputs
+
+    def close(self):
+        """
+        Process the queued requests and stop the worker thread
+        """
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put(None)
+        self._thread.join()
+
+    def _size(self, input_json: Dict) -> int:
+        """
+        :return: the number of inputs of a request
+        """
+        if not isinstance(input_json, dict):
+            raise ValueError(f"Requests should be dicts, got {type(input_json).__name__}")
+        inputs = input_json[self.inputs_key]
+        if not isinstance(inputs, Sized) or isinstance(inputs, (str, bytes, dict)):
+            raise ValueError(f"The {self.inputs_key} of a request should be a sequence, got {type(inputs).__name__}")
+        return len(inputs)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._collect()
+            batch = [(input_json, future) for input_json, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                self._process(batch)
+            except Exception as e:
+                # Never let a request stop the worker thread, the other callers would wait forever
+                logger.exception("Micro-batching failed")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _request_size(self, request: Tuple[Dict, Future]) -> int:
+        try:
+            return self._size(request[0])
+        except Exception as e:
+            # Requests are validated by submit, this only happens if a request is modified once submitted
+            if request[1].set_running_or_notify_cancel():
+                request[1].set_exception(e)
+            return -1
+
+    def _collect(self) -> Tuple[List[Tuple[Dict, Future]], bool]:
+        """
+        Wait for a request, then for other ones until the batch is full or the latency budget is spent
+        :return: the requests and whether the predictor is closing
+        """
+        request = self._queue.get()
+        if request is None:
+            return [], True
+        size = self._request_size(request)
+        if size < 0:
+            return [], False
+        batch = [request]
+        deadline = time.monotonic() + self.max_latency_ms / 1000
+
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                return batch, True
+            request_size = self._request_size(request)
+            if request_size >= 0:
+                batch.append(request)
+                size += request_size
+        return batch, False
+
+    def _process(self, batch: List[Tuple[Dict, Future]]):
+        try:
+            outputs = self.predict_many([input_json for input_json, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+            else:
+                for request in batch:
+                    self._process([request])
+            return
+
+        for (_, future), output in zip(batch, outputs):
+            future.set_result(output)
@@ -0,0 +1,227 @@
+"""
+Profiling of the experiment build: time and memory spent building every node of an `ExperimentConfig`.
+
+Usage:
+
+    profiler = BuildProfiler(memory=True)
+    experiment = ExperimentConfig(experiment_path, profiler=profiler)
+    print(profiler.format_table(sort_by='wall_time'))
+    profiler.to_json()       # machine readable report
+    profiler.to_folded()     # collapsed stacks, for flamegraph.pl or speedscope
+    profiler.to_hierarchy()  # nested dict, for d3-flame-graph
+"""
+import json
+import logging
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+logger = logging.getLogger(__name__)
+
+try:
+    import resource
+except ImportError:
+    logger.debug("Peak RSS is not available on this platform")
+    resource = None
+
+# ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+class NodeProfile:
+    """
+    Resources spent building one node of the experiment, nested nodes included
+    """
+
+    def __init__(self, name: str, depth: int):
+        self.name: str = name
+        self.depth: int = depth
+        self.children: List[NodeProfile] = []
+
+        self.wall_time: float = 0.
+        self.cpu_time: float = None
+        self.memory_delta: int = None
+        self.memory_peak: int = None
+        self.rss_peak_delta: int = None
+
+    @property
+    def self_wall_time(self) -> float:
+        """
+        :return: the wall time spent in this node, excluding the nested nodes
+        """
+        return max(self.wall_time - sum(child.wall_time for child in self.children), 0.)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'depth': self.depth,
+            'wall_time': self.wall_time,
+            'self_wall_time': self.self_wall_time,
+            'cpu_time': self.cpu_time,
+            'memory_delta': self.memory_delta,
+            'memory_peak': self.memory_peak,
+            'rss_peak_delta': self.rss_peak_delta}
+
+
+class BuildProfiler:
+    """
+    Record wall time, and optionally CPU time and memory, for every node built by an `ObjectBuilder`.
+
+    Memory is measured with tracemalloc (allocation delta and peak above the starting point, in bytes), which slows
+    down the build noticeably, so it is disabled by default. The growth of the process peak RSS is recorded along with it.
+    """
+
+    def __init__(self, cpu: bool = True, memory: bool = False):
+        """
+        :param cpu: record the CPU time of every node
+        :param memory: record the memory allocated by every node
+        """
+        self.cpu: bool = cpu
+        self.memory: bool = memory
+
+        self.records: List[NodeProfile] = []
+        self.roots: List[NodeProfile] = []
+        self._stack: List[NodeProfile] = []
+        self._peaks: List[int] = []
+        self._started_tracemalloc: bool = False
+
+    def start(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def stop(self):
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    @contextmanager
+    def profile(self, name: str) -> Iterator[NodeProfile]:
+        """
+        Profile the build of a node, nesting it under the node currently being built
+        :param name: the full name of the node
+        """
+        node = NodeProfile(name=name, depth=len(self._stack))
+        if self._stack:
+            self._stack[-1].children.append(node)
+        else:
+            self.roots.append(node)
+        self._stack.append(node)
+
+        tracing = self.memory and tracemalloc.is_tracing()
+        if tracing:
+            memory_start = self._enter_memory()
+        rss_start = self._max_rss() if self.memory else None
+        cpu_start = time.process_time() if self.cpu else None
+        wall_start = time.perf_counter()
+        try:
+            yield node
+        finally:
+            node.wall_time = time.perf_counter() - wall_start
+            if self.cpu:
+                node.cpu_time = time.process_time() - cpu_start
+            if tracing:
+                self._exit_memory(node, memory_start)
+            if rss_start is not None:
+                node.rss_peak_delta = self._max_rss() - rss_start
+
+            self._stack.pop()
+            self.records.append(node)
+
+    def _enter_memory(self) -> int:
+        current, peak = tracemalloc.get_traced_memory()
+        # tracemalloc has a single global peak: keep the peak reached so far by the enclosing node before resetting it
+        if self._peaks:
+            self._peaks[-1] = max(self._peaks[-1], peak)
+        self._peaks.append(current)
+        self._reset_peak()
+        return current
+
+    def _exit_memory(self, node: NodeProfile, memory_start: int):
+        current, peak = tracemalloc.get_traced_memory()
+        peak = max(self._peaks.pop(), peak)
+        node.memory_delta = current - memory_start
+        node.memory_peak = peak - memory_start
+        if self._peaks:
+            self._peaks[-1] = max(self._peaks[-1], peak)
+
+    @staticmethod
+    def _reset_peak():
+        # Only available from python 3.9, otherwise peaks are measured from the start of the trace
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+    @staticmethod
+    def _max_rss() -> int:
+        if resource is None:
+            return None
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT
+
+    def to_dict(self) -> List[Dict[str, Any]]:
+        """
+        :return: the profile of every node, in build order
+        """
+        return [node.to_dict() for node in self.records]
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def format_table(self, sort_by: str = None) -> str:
+        """
+        :param sort_by: a `NodeProfile` attribute to sort the nodes by, in decreasing order. Build order by default.
+        :return: a human readable table of the profile. Times include the nested nodes.
+        """
+        records = self.records
+        if sort_by:
+            records = sorted(records, key=lambda node: getattr(node, sort_by) or 0, reverse=True)
+
+        columns = [('time (ms)', lambda node: 1000 * node.wall_time)]
+        if self.cpu:
+            columns.append(('cpu (ms)', lambda node: 1000 * node.cpu_time))
+        if self.memory:
+            columns.extend([
+                ('mem (KiB)', lambda node: node.memory_delta / 1024 if node.memory_delta is not None else None),
+                ('peak (KiB)', lambda node: node.memory_peak / 1024 if node.memory_peak is not None else None),
+                ('rss (KiB)', lambda node: node.rss_peak_delta / 1024 if node.rss_peak_delta is not None else None)])
+
+        width = max([len(node.name) for node in records] + [4])
+        lines = [f"{'node':<{width}}" + ''.join(f"  {title:>10}" for title, _ in columns)]
+        for node in records:
+            values = (value(node) for _, value in columns)
+            lines.append(f"{node.name:<{width}}" + ''.join(f"  {v:>10.2f}" if v is not None else f"  {'-':>10}" for v in values))
+        return '\n'.join(lines)
+
+    def to_hierarchy(self) -> Dict[str, Any]:
+        """
+        :return: the nested build profile in the d3-flame-graph format, values are wall times in ms
+        """
+
+        def node_to_dict(node: NodeProfile) -> Dict[str, Any]:
+            return {
+                'name': node.name,
+                'value': 1000 * node.wall_time,
+                'children': [node_to_dict(child) for child in node.children]}
+
+        return {
+            'name': 'experiment',
+            'value': 1000 * sum(node.wall_time for node in self.roots),
+            'children': [node_to_dict(node) for node in self.roots]}
+
+    def to_folded(self) -> str:
+        """
+        :return: the build profile in the collapsed stack format (one `a;a.b;a.b.c <self time in us>` line per node),
+        readable by flamegraph.pl or speedscope
+        """
+        lines = []
+
+        def fold(node: NodeProfile, stack: List[str]):
+            stack = stack + [node.name]
+            lines.append(f"{';'.join(stack)} {int(1e6 * node.self_wall_time)}")
+            for child in node.children:
+                fold(child, stack)
+
+        for root in self.roots:
+            fold(root, [])
+        return '\n'.join(lines)
@@ -27,6 +27,7 @@ from ignite.engine.engine import Engine
 from ignite.metrics import Loss, Metric, RunningAverage, MetricsLambda, Accuracy
 from ignite.utils import convert_tensor
 
+from transfer_nlp.embeddings.projector import EmbeddingExporter
 from transfer_nlp.loaders.loaders import DatasetSplits
 from transfer_nlp.plugins.config import register_plugin
 from transfer_nlp.plugins.regularizers import RegularizerABC
@@ -293,6 +294,14 @@ class BaseIgniteTrainer(TrainerABC):
 
 @register_plugin
 class SingleTaskTrainer(BaseIgniteTrainer):
+    """
+    When `embeddings_name` and `tensorboard_logs` are set, the embeddings of the model are exported to the
+    Tensorboard projector once the training is completed. The export runs in the background, call
+    `embeddings_exporter.close()` to wait for it, otherwise it is waited for at interpreter exit.
+    `embeddings_max_points` limits the number of exported embeddings: the `top` sampling keeps the first tokens of
+    the vocabulary, i.e. the most frequent ones only if the vocabulary was built with
+    `VocabularyBuilder(by_frequency=True)`, the `random` sampling draws them uniformly.
+    """
 
     def __init__(self,
                  model: nn.Module,
@@ -311,7 +320,9 @@ class SingleTaskTrainer(BaseIgniteTrainer):
                  output_transform=None,
                  tensorboard_logs: str = None,
                  optional_tensorboard_features: bool = False,
-                 embeddings_name: str = None):
+                 embeddings_name: str = None,
+                 embeddings_max_points: int = None,
+                 embeddings_sampling: str = 'top'):
 
         super().__init__(
             model=model,
@@ -332,6 +343,10 @@ class SingleTaskTrainer(BaseIgniteTrainer):
 
         self.optional_tensorboard_features: bool = optional_tensorboard_features
         self.embeddings_name: str = embeddings_name
+        self.embeddings_exporter: EmbeddingExporter = None
+        if self.embeddings_name and self.tensorboard_logs:
+            self.embeddings_exporter = EmbeddingExporter(log_dir=self.tensorboard_logs, max_points=embeddings_max_points,
+                                                         sampling=embeddings_sampling)
 
         self.custom_setup()
 
@@ -369,15 +384,22 @@ class SingleTaskTrainer(BaseIgniteTrainer):
                 logger.info("Training completed")
                 tb_logger.close()
 
-        if self.embeddings_name:
+        if self.embeddings_exporter:
             @self.trainer.on(Events.COMPLETED)
             def log_embeddings(trainer):
-                if hasattr(self.model, self.embeddings_name) and hasattr(self.dataset_splits, "vectorizer") and TENSORBOARD:
+                if hasattr(self.model, self.embeddings_name) and hasattr(self.dataset_splits, "vectorizer"):
                     logger.info(f"Logging embeddings ({self.embeddings_name}) to Tensorboard!")
-                    embeddings = getattr(self.model, self.embeddings_name).weight.data
-                    metadata = [str(self.dataset_splits.vectorizer.data_vocab._id2token[token_index]).encode('utf-8') for token_index in
-                                range(embeddings.shape[0])]
-                    self.writer.add_embedding(mat=embeddings, metadata=metadata, global_step=self.trainer.state.epoch)
+                    module = getattr(self.model, self.embeddings_name)
+                    embeddings = module.weight
+                    if not embeddings.is_floating_point():
+                        # Quantized embeddings
+                        embeddings = module(torch.arange(len(embeddings), device=embeddings.device))
+                    data_vocab = self.dataset_splits.vectorizer.data_vocab
+                    # Written in a background thread, errors are logged as soon as they happen
+                    self.embeddings_exporter.export(embeddings=embeddings,
+                                                    tokens=data_vocab.lookup_indices(range(len(data_vocab))),
+                                                    tag=self.embeddings_name,
+                                                    global_step=self.trainer.state.epoch)
 
     def update_engine(self, engine, batch):
 
@@ -460,6 +482,8 @@ class SingleTaskFineTuner(SingleTaskTrainer):
                  tensorboard_logs: str = None,
                  optional_tensorboard_features: bool = False,
                  embeddings_name: str = None,
+                 embeddings_max_points: int = None,
+                 embeddings_sampling: str = 'top',
                  adaptation: str = 'hard-freezing',
                  decreasing_factor: int = 2.6,
                  pretrained: bool = False):
@@ -480,7 +504,9 @@ class SingleTaskFineTuner(SingleTaskTrainer):
             output_transform=output_transform,
             tensorboard_logs=tensorboard_logs,
             optional_tensorboard_features=optional_tensorboard_features,
-            embeddings_name=embeddings_name
+            embeddings_name=embeddings_name,
+            embeddings_max_points=embeddings_max_points,
+            embeddings_sampling=embeddings_sampling
         )
         self.adaptation: str = adaptation
         self.decreasing_factor: int = decreasing_factor
@@ -1,19 +1,95 @@
 import configparser
+import gc
 import logging
 import shutil
 from copy import deepcopy
 from pathlib import Path
-from typing import Dict, Any, Union
+from typing import Dict, Any, Iterable, Union
 
+import numpy as np
 import toml
 
 from transfer_nlp.plugins.config import ExperimentConfig
 from transfer_nlp.plugins.reporters import ReporterABC
 from transfer_nlp.plugins.trainer_abc import TrainerABC
 
+logger = logging.getLogger(__name__)
+
+TORCH = True
+try:
+    import torch
+except ImportError:
+    logger.debug("Torch is not installed, only numpy arrays will be frozen in the experiment cache")
+    TORCH = False
+
 ConfigEnv = Dict[str, Any]
 
 
+def freeze_read_only_objects(objects: Iterable[Any], max_depth: int = 4) -> int:
+    """
+    Prepare read-only objects to be shared by forked workers:
+
+    - every object tracked by the garbage collector is moved to the permanent generation (`gc.freeze`), so that
+      collections in the workers don't write to the pages holding them and the pages stay shared copy-on-write.
+      Call `gc.unfreeze` once the workers are done.
+    - torch tensors and modules are moved to shared memory, so that workers started by `torch.multiprocessing` get
+      them without a copy
+    - numpy arrays are flagged as read-only, including the per-row arrays held by the object columns of dataframes,
+      e.g. vectorized inputs. This is only a safety guard, it doesn't save memory: an experiment modifying a cached
+      array in place fails instead of silently changing the data of the next experiments.
+
+    :param objects: the objects to freeze, e.g. the values of the experiment cache
+    :param max_depth: how deep to look for arrays and tensors in the attributes, lists and dicts of the objects
+    :return: the number of arrays and tensors frozen
+    """
+    visited = set()
+
+    def freeze(obj: Any, depth: int) -> int:
+        if id(obj) in visited or depth > max_depth:
+            return 0
+        visited.add(id(obj))
+
+        if isinstance(obj, np.ndarray):
+            if obj.dtype != object:
+                obj.setflags(write=False)
+                return 1
+            return 0
+        if TORCH and isinstance(obj, torch.Tensor):
+            if not obj.is_cuda:
+                obj.share_memory_()
+            return 1
+        if TORCH and isinstance(obj, torch.nn.Module):
+            obj.share_memory()
+            return 1
+        # The numeric blocks of dataframes are handled by pandas, only the values of object columns are walked
+        if type(obj).__module__.startswith('pandas'):
+            if hasattr(obj, 'dtypes') and hasattr(obj, 'iloc') and obj.ndim == 2:
+                columns = [obj.iloc[:, i] for i, dtype in enumerate(obj.dtypes) if dtype == object]
+            elif getattr(obj, 'dtype', None) == object:
+                columns = [obj]
+            else:
+                return 0
+            return sum(freeze(value, depth + 1) for column in columns for value in column.values)
+
+        if isinstance(obj, dict):
+            children = obj.values()
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            children = obj
+        elif hasattr(obj, '__dict__') and not isinstance(obj, type):
+            children = vars(obj).values()
+        else:
+            return 0
+        return sum(freeze(child, depth + 1) for child in children)
+
+    frozen = sum(freeze(obj, 0) for obj in objects)
+
+    if hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
+
+    return frozen
+
+
 def load_config(p: Path) -> Dict[str, ConfigEnv]:
     p = Path(str(p)).expanduser()
     if p.suffix == '.toml':
@@ -82,6 +158,7 @@ class ExperimentRunner:
                 trainer_config_name: str = 'trainer',
                 reporter_config_name: str = 'reporter',
                 experiment_cache: Union[str, Path, Dict] = None,
+                freeze_cache: bool = False,
                 **env_vars) -> ExperimentConfig:
         """
         :param experiment: the experiment config
@@ -93,6 +170,9 @@ class ExperimentRunner:
         :param trainer_config_name: the name of the trainer configuration object. The referenced object should implement `TrainerABC`.
         :param reporter_config_name: the name of the reporter configuration object. The referenced object should implement `ReporterABC`.
         :param experiment_cache: the experiment config with cached objects
+        :param freeze_cache: freeze the cached objects (see `freeze_read_only_objects`) so that they are shared rather
+               than copied by forked workers, e.g. data loader workers. The cached arrays are also made read-only,
+               experiments must not modify them in place when enabled.
         :param env_vars: any additional environment variables, like file system paths
         :return: the experiment cache
         """
@@ -114,39 +194,46 @@ class ExperimentRunner:
             logging.info("#" * 5 + f"Building a set of read-only objects and cache them for use in different experiment settings" + "#" * 5)
             experiment_config_cache = ExperimentConfig(experiment_cache, **env_vars)
             logging.info("#" * 5 + f"Read-only objects are built and cached for use in different experiment settings" + "#" * 5)
+            if freeze_cache:
+                frozen = freeze_read_only_objects(experiment_config_cache.values())
+                logger.info("Froze %d arrays and tensors of the experiment cache", frozen)
 
         aggregate_reports = {}
-        for exp_name, env in envs.items():
-            exp_report_path = report_path / exp_name
-            exp_report_path.mkdir()
-            log_handler = ExperimentRunner._capture_logs(exp_report_path)
-            try:
-                logging.info('running %s', exp_name)
-                all_vars = dict(env_vars)
-                all_vars.update(env)
-
-                exp = deepcopy(experiment)
-                if experiment_cache:
-                    exp = ExperimentConfig.load_experiment_config(exp)
-                    exp.update(experiment_config_cache)
-
-                experiment_config = ExperimentConfig(exp, **all_vars)
-                trainer: TrainerABC = experiment_config[trainer_config_name]
-                reporter: ReporterABC = experiment_config[reporter_config_name]
-                trainer.train()
-
-                # Save the config for this particular experiment
-                exp_config = {
-                    exp_name: all_vars}
-                with (exp_report_path / 'experiment_config.toml').open('w') as expfile:
-                    toml.dump(exp_config, expfile)
-
-                # Get this particular config reporting and store it in the
-                # aggregated reportings
-                report = reporter.report(exp_name, experiment_config, exp_report_path)
-                aggregate_reports[exp_name] = report
-            finally:
-                ExperimentRunner._stop_log_capture(log_handler)
+        try:
+            for exp_name, env in envs.items():
+                exp_report_path = report_path / exp_name
+                exp_report_path.mkdir()
+                log_handler = ExperimentRunner._capture_logs(exp_report_path)
+                try:
+                    logging.info('running %s', exp_name)
+                    all_vars = dict(env_vars)
+                    all_vars.update(env)
+
+                    exp = deepcopy(experiment)
+                    if experiment_cache:
+                        exp = ExperimentConfig.load_experiment_config(exp)
+                        exp.update(experiment_config_cache)
+
+                    experiment_config = ExperimentConfig(exp, **all_vars)
+                    trainer: TrainerABC = experiment_config[trainer_config_name]
+                    reporter: ReporterABC = experiment_config[reporter_config_name]
+                    trainer.train()
+
+                    # Save the config for this particular experiment
+                    exp_config = {
+                        exp_name: all_vars}
+                    with (exp_report_path / 'experiment_config.toml').open('w') as expfile:
+                        toml.dump(exp_config, expfile)
+
+                    # Get this particular config reporting and store it in the
+                    # aggregated reportings
+                    report = reporter.report(exp_name, experiment_config, exp_report_path)
+                    aggregate_reports[exp_name] = report
+                finally:
+                    ExperimentRunner._stop_log_capture(log_handler)
+        finally:
+            if experiment_cache and freeze_cache and hasattr(gc, 'unfreeze'):
+                gc.unfreeze()
 
         reporter_class = experiment_config[reporter_config_name].__class__
         if issubclass(reporter_class, ReporterABC):